@@ -67,6 +67,12 @@ class CambTest(unittest.TestCase):
                            bbn_predictor=bbn.BBN_table_interpolator())
         self.assertAlmostEqual(pars.YHe, 0.2453469, 5)
         self.assertAlmostEqual(pars.get_Y_p(), bbn.BBN_table_interpolator().Y_p(0.022242, 0), 5)
+        predictor = bbn.BBN_table_interpolator(cache=False)
+        ombh2s = np.array([0.0215, 0.022242, 0.023])
+        batch = predictor.get_all(ombh2s, [0.5, 0, -0.2], names=['Yp^BBN', 'D/H'])
+        self.assertAlmostEqual(batch['Yp^BBN'][1], predictor.Y_p(0.022242, 0), 10)
+        self.assertAlmostEqual(batch['D/H'][2], predictor.DH(0.023, -0.2), 10)
+        self.assertEqual(predictor.get_all(ombh2s)['Yp^BBN'].shape, ombh2s.shape)
 
         # test massive sterile models as in Planck papers
         pars.set_cosmology(H0=68.0, ombh2=0.022305, omch2=0.11873, mnu=0.06, nnu=3.073, omk=0, meffsterile=0.013)
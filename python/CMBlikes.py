@@ -8,7 +8,9 @@ import numpy as np
 import sys
 import six
 from getdist import IniFile, ParamNames
+from planck import datacache
 from scipy.linalg import sqrtm
+from scipy import sparse
 
 try:
     sys.path.insert(0, 'c://work/dist/git/camb/pycamb')
@@ -115,19 +117,61 @@ class ClsArray(object):
 
 
 class BinWindows(object):
+    # Bin window functions for each bin and input spectrum (cols_in), stored as sparse matrix windows
+    # with rows for each (bin, spectrum) pair and columns for each (spectrum, L - lmin) pair,
+    # so that all spectra are binned with one sparse product
+
     def __init__(self, lmin, lmax, nbins):
         self.lmin = lmin
         self.lmax = lmax
         self.nbins = nbins
 
+    def set_windows(self, bins, orders, Ls, values):
+        """
+        Set the window functions from (bin, spectrum, L) index arrays of non-zero window values
+
+        :param bins: array of bin indices
+        :param orders: array of indices into cols_in
+        :param Ls: array of L values
+        :param values: array of window values
+        """
+        norder = self.cols_in.shape[1]
+        nL = self.lmax - self.lmin + 1
+        self.windows = sparse.csr_matrix((values, (bins * norder + orders, orders * nL + Ls - self.lmin)),
+                                         shape=(self.nbins * norder, norder * nL))
+        used = self.cols_out >= 0
+        self.scatter = np.zeros((norder, max(self.cols_out[used]) + 1))
+        self.scatter[np.arange(norder)[used], self.cols_out[used]] = 1
+
+    @property
+    def binning_matrix(self):
+        # dense array of windows [cols_in index, bin, L - lmin]
+        norder = self.cols_in.shape[1]
+        W = self.windows.tocoo()
+        matrix = np.zeros((norder, self.nbins, self.lmax - self.lmin + 1))
+        matrix[W.row % norder, W.row // norder, W.col % matrix.shape[2]] = W.data
+        return matrix
+
     def bin(self, TheoryCls, cls=None):
-        if cls is None: cls = np.zeros((self.nbins, max([x for x in self.cols_out if x >= 0]) + 1))
-        for i, ((x, y), ix_out) in enumerate(zip(self.cols_in.T, self.cols_out)):
+        nL = self.lmax - self.lmin + 1
+        theory = np.zeros(self.cols_in.shape[1] * nL)
+        for i, (x, y) in enumerate(self.cols_in.T):
             cl = TheoryCls[x, y]
-            if cl is not None and ix_out >= 0:
-                cls[:, ix_out] += np.dot(self.binning_matrix[i, :, :], cl.CL)
+            if cl is not None:
+                theory[i * nL:(i + 1) * nL] = cl.CL
+        band = self.windows.dot(theory).reshape(self.nbins, -1).dot(self.scatter)
+        if cls is None: return band
+        cls += band
         return cls
 
+    def bin_stack(self, TheoryCls):
+        # bin stacked theory TheoryCls[..., nmaps, nmaps, L] for any leading (model) dimensions
+        cls = TheoryCls[..., self.cols_in[0], self.cols_in[1], :]
+        shape = cls.shape[:-2]
+        cls = cls.reshape((-1, cls.shape[-2] * cls.shape[-1]))
+        band = self.windows.dot(cls.T).T.reshape(shape + (self.nbins, -1))
+        return np.matmul(band, self.scatter)
+
     def write(self, froot, stem):
         if not os.path.exists(froot + stem + '_window'): os.mkdir(froot + '_window')
         for b in range(self.nbins):
@@ -137,7 +181,10 @@ class BinWindows(object):
 
 
 class DatasetLikelihood(object):
-    def __init__(self, fname, dataset_params={}, field_names=['T', 'E', 'B', 'P'], map_separator='x'):
+    def __init__(self, fname, dataset_params={}, field_names=['T', 'E', 'B', 'P'], map_separator='x',
+                 use_cache=True):
+        # if use_cache, preprocessed covariance and window data are cached in binary files (see planck.datacache)
+        self.use_cache = use_cache
         self.field_names = field_names
         self.tot_theory_fields = len(field_names)
         self.map_separator = map_separator
@@ -247,10 +294,29 @@ class DatasetLikelihood(object):
             X[ix:ix + i + 1] = M[i, 0:i + 1]
             ix += i + 1
 
+    def elements_to_matrices(self, X):
+        # stacked version of elements_to_matrix: X[..., ncl] -> matrices[..., nmaps, nmaps]
+        rows, cols = np.tril_indices(self.nmaps)
+        M = np.empty(X.shape[:-1] + (self.nmaps, self.nmaps))
+        M[..., rows, cols] = X
+        M[..., cols, rows] = X
+        return M
+
+    def matrices_to_elements(self, M):
+        # stacked version of matrix_to_elements: matrices[..., nmaps, nmaps] -> X[..., ncl]
+        rows, cols = np.tril_indices(self.nmaps)
+        return M[..., rows, cols]
+
+    def cached_arrays(self, ini, tag, files, settings, compute):
+        # dictionary of arrays calculated by compute() from files and the settings they depend on,
+        # using the binary cache if enabled
+        if not self.use_cache: return compute()
+        name = os.path.splitext(os.path.basename(ini.original_filename or files[0]))[0] + '_' + tag
+        return datacache.cached_arrays(name, files, settings, compute)
+
     def ReadClArr(self, ini, file_stem, return_full=False):
         # read file of CL or bins (indexed by L)
         filename = ini.relativeFileName(file_stem + '_file')
-        cl = np.zeros((self.ncl, self.nbins_used))
         order = ini.string(file_stem + '_order', '')
         if not order:
             incols = lastTopComment(filename)
@@ -259,18 +325,27 @@ class DatasetLikelihood(object):
         else:
             incols = 'L ' + order
         cols = self.GetColsFromOrder(incols)
-        data = np.loadtxt(filename)
-        Ls = data[:, 0].astype(int)
-        if self.binned: Ls -= 1
-        for i, L in enumerate(Ls):
-            if L >= self.bin_min and L <= self.bin_max:
-                for ix in range(self.ncl):
-                    if cols[ix] != -1:
-                        cl[ix, L - self.bin_min] = data[i, cols[ix]]
-        if L < self.bin_max:
-            raise Exception('CMBLikes_ReadClArr: C_l file does not go up to maximum used: %s' % self.bin_max)
+
+        def compute():
+            cl = np.zeros((self.ncl, self.nbins_used))
+            data = np.loadtxt(filename)
+            Ls = data[:, 0].astype(int)
+            if self.binned: Ls -= 1
+            for i, L in enumerate(Ls):
+                if L >= self.bin_min and L <= self.bin_max:
+                    for ix in range(self.ncl):
+                        if cols[ix] != -1:
+                            cl[ix, L - self.bin_min] = data[i, cols[ix]]
+            if L < self.bin_max:
+                raise Exception('CMBLikes_ReadClArr: C_l file does not go up to maximum used: %s' % self.bin_max)
+            return {'data': data, 'cl': cl}
+
+        arrays = self.cached_arrays(ini, file_stem, [filename],
+                                    (cols.tolist(), self.binned, self.bin_min, self.bin_max), compute)
+        # copies, as may be modified
+        cl = np.array(arrays['cl'])
         if return_full:
-            return incols.split(), data, cl
+            return incols.split(), np.array(arrays['data']), cl
         else:
             return cl
 
@@ -284,17 +359,28 @@ class DatasetLikelihood(object):
         if norder != bins.cols_out.shape[0]:
             raise Exception('_in_order and _out_order must have same number of entries')
 
-        bins.binning_matrix = np.zeros((norder, self.nbins_used, self.pcl_lmax - self.pcl_lmin + 1))
         windows = ini.relativeFileName(file_stem + '_files')
-        for b in range(self.nbins_used):
-            window = np.loadtxt(windows % (b + 1 + self.bin_min))
-            Err = False
-            for i, L in enumerate(window[:, 0].astype(int)):
-                if self.pcl_lmin <= L <= self.pcl_lmax:
-                    bins.binning_matrix[:, b, L - self.pcl_lmin] = window[i, 1:]
-                else:
-                    Err = Err or any(window[i, 1:] != 0)
-            if Err: print('WARNING: %s %u outside pcl_lmin-cl_max range: %s' % (file_stem, b, windows % (b + 1)))
+        files = [windows % (b + 1 + self.bin_min) for b in range(self.nbins_used)]
+
+        def compute():
+            bin_ix, order_ix, L_ix, values = [], [], [], []
+            for b, fname in enumerate(files):
+                window = np.loadtxt(fname, ndmin=2)
+                Ls = window[:, 0].astype(int)
+                window = window[:, 1:norder + 1]
+                in_range = (Ls >= self.pcl_lmin) & (Ls <= self.pcl_lmax)
+                if np.any(window[~in_range] != 0):
+                    print('WARNING: %s %u outside pcl_lmin-cl_max range: %s' % (file_stem, b, windows % (b + 1)))
+                rows, orders = np.nonzero(window * in_range[:, np.newaxis])
+                bin_ix.append(np.full(len(rows), b, dtype=int))
+                order_ix.append(orders)
+                L_ix.append(Ls[rows])
+                values.append(window[rows, orders])
+            return {'bins': np.concatenate(bin_ix), 'orders': np.concatenate(order_ix), 'Ls': np.concatenate(L_ix),
+                    'values': np.concatenate(values)}
+
+        arrays = self.cached_arrays(ini, file_stem, files, (norder, self.pcl_lmin, self.pcl_lmax), compute)
+        bins.set_windows(arrays['bins'], arrays['orders'], arrays['Ls'], arrays['values'])
         if ini.hasKey(file_stem + '_fix_cl_file'):
             raise Exception('fix_cl_file not implemented yet')
         return bins
@@ -468,7 +554,6 @@ class DatasetLikelihood(object):
             self.fsky = ini.float('fullsky_exact_fksy')
         else:
             self.cov = self.ReadCovmat(ini)
-            self.covinv = np.linalg.inv(self.cov)
 
         if 'linear_correction_fiducial_file' in ini.params:
             self.fid_correction = self.ReadClArr(ini, 'linear_correction_fiducial')
@@ -502,11 +587,11 @@ class DatasetLikelihood(object):
 
     def ReadCovmat(self, ini):
         # read the covariance matrix, and the array of which CL are in the covariance,
-        # which then defines which set of bandpowers are used (subject to other restrictions)
+        # which then defines which set of bandpowers are used (subject to other restrictions).
+        # Also sets full_cov and the inverse of the used covariance, covinv
         covmat_cl = ini.string('covmat_cl', allowEmpty=False)
         if ini.string('covmat_format', 'text') != 'text':
             raise Exception('Only text oovmat supported in python so far')
-        self.full_cov = np.loadtxt(ini.relativeFileName('covmat_fiducial'))
         covmat_scale = ini.float('covmat_scale', 1.0)
         cl_in_index = self.UseString_to_cols(covmat_cl)
         self.ncl_used = np.sum(cl_in_index >= 0)
@@ -518,19 +603,27 @@ class DatasetLikelihood(object):
                 self.cl_used_index[ix] = index
                 cov_cl_used[ix] = i
                 ix += 1
-        if self.binned:
+        if not self.binned:
+            raise Exception('unbinned covariance not implemented')
+        filename = ini.relativeFileName('covmat_fiducial')
+
+        def compute():
+            full_cov = np.loadtxt(filename)
             num_in = len(cl_in_index)
             pcov = np.empty((self.nbins_used * self.ncl_used, self.nbins_used * self.ncl_used))
             for binx in range(self.nbins_used):
                 for biny in range(self.nbins_used):
                     pcov[binx * self.ncl_used: (binx + 1) * self.ncl_used,
                     biny * self.ncl_used: (biny + 1) * self.ncl_used] = \
-                        covmat_scale * self.full_cov[np.ix_((binx + self.bin_min) * num_in + cov_cl_used,
-                                                            (biny + self.bin_min) * num_in + cov_cl_used)]
+                        covmat_scale * full_cov[np.ix_((binx + self.bin_min) * num_in + cov_cl_used,
+                                                       (biny + self.bin_min) * num_in + cov_cl_used)]
+            return {'full_cov': full_cov, 'cov': pcov, 'covinv': np.linalg.inv(pcov)}
 
-        else:
-            raise Exception('unbinned covariance not implemented')
-        return pcov
+        arrays = self.cached_arrays(ini, 'covmat', [filename], (cl_in_index.tolist(), cov_cl_used.tolist(),
+                                                                self.bin_min, self.nbins_used, covmat_scale), compute)
+        self.full_cov = arrays['full_cov']
+        self.covinv = arrays['covinv']
+        return arrays['cov']
 
     def get_binned_theory(self, ClArray, data_params={}):
         # Useful for plotting, not used for likelihood
@@ -588,17 +681,22 @@ class DatasetLikelihood(object):
         self.adapt_theory_for_maps(self.map_cls, data_params)
 
     def adapt_theory_for_maps(self, cls, data_params):
+        # cls[i,j].CL may have leading (model) dimensions, in which case data_params values may be
+        # scalars or arrays with a value for each model (see theory_map_cls_stack)
         if self.aberration_coeff: self.add_aberration(cls)
         self.add_foregrounds(cls, data_params)
         if self.calibration_param is not None and self.calibration_param in data_params:
+            calib = np.asarray(data_params[self.calibration_param])[..., np.newaxis]
             for i in range(self.nmaps_required):
                 for j in range(i + 1):
                     CL = cls[i, j]
                     if CL is not None:
                         if CL.theory_ij[0] <= 2 and CL.theory_ij[1] <= 2:
-                            CL.CL /= data_params[self.calibration_param] ** 2
+                            CL.CL /= calib ** 2
 
     def add_foregrounds(self, cls, data_params):
+        # cls[i,j].CL arrays are indexed by L - pcl_lmin in the last dimension; any data_params arrays
+        # have one value for each leading (model) index of CL, so use e.g. value[..., np.newaxis]
         pass
 
     def add_aberration(self, cls):
@@ -613,10 +711,10 @@ class DatasetLikelihood(object):
                         # first get Cl instead of Dl
                         cl_deriv = CL.CL / cl_norm
                         # second take derivative dCl/dl
-                        cl_deriv[1:-1] = (cl_deriv[2:] - cl_deriv[:-2]) / 2
+                        cl_deriv[..., 1:-1] = (cl_deriv[..., 2:] - cl_deriv[..., :-2]) / 2
                         # handle endpoints approximately
-                        cl_deriv[0] = cl_deriv[1]
-                        cl_deriv[-1] = cl_deriv[-2]
+                        cl_deriv[..., 0] = cl_deriv[..., 1]
+                        cl_deriv[..., -1] = cl_deriv[..., -2]
                         # reapply to Dl's.
                         # note never took 2pi out, so not putting it back either
                         cl_deriv *= cl_norm
@@ -660,6 +758,34 @@ class DatasetLikelihood(object):
             rot[:, i] = U[:, i] * d
         rot.dot(U.T, C)
 
+    def transform_stack(self, C, Chat, Cfhalf):
+        # HL transformation of stacked matrices C[..., nmaps, nmaps] (same as transform for each matrix),
+        # returning the transformed matrices
+        if C.shape[-1] == 1:
+            rat = Chat[..., 0, 0] / C[..., 0, 0]
+            return (np.sign(rat - 1) * np.sqrt(2 * np.maximum(0, rat - np.log(rat) - 1))
+                    * Cfhalf[..., 0, 0] ** 2)[..., np.newaxis, np.newaxis]
+        diag, U = np.linalg.eigh(C)
+        rot = np.matmul(np.matmul(np.swapaxes(U, -1, -2), Chat), U)
+        roots = np.sqrt(diag)
+        rot /= roots[..., :, np.newaxis]
+        rot /= roots[..., np.newaxis, :]
+        rot = np.matmul(np.matmul(U, rot), np.swapaxes(U, -1, -2))
+        diag, rot = np.linalg.eigh(rot)
+        diag = np.sign(diag - 1) * np.sqrt(2 * np.maximum(0, diag - np.log(diag) - 1))
+        U = np.matmul(Cfhalf, rot)
+        return np.matmul(U * diag[..., np.newaxis, :], np.swapaxes(U, -1, -2))
+
+    def exact_chi_sq_stack(self, C, Chat, Ls):
+        # sum of exact_chi_sq over stacked matrices C[..., nbins, nmaps, nmaps] with multipoles Ls[nbins]
+        if C.shape[-1] == 1:
+            rat = Chat[..., 0, 0] / C[..., 0, 0]
+            terms = rat - 1 - np.log(rat)
+        else:
+            M = np.linalg.solve(C, np.broadcast_to(Chat, C.shape))
+            terms = np.trace(M, axis1=-2, axis2=-1) - self.nmaps - np.linalg.slogdet(M)[1]
+        return np.sum((2 * Ls + 1) * self.fsky * terms, axis=-1)
+
     def exact_chi_sq(self, C, Chat, L):
         if C.shape[0] == 1:
             return (2 * L + 1) * self.fsky * (Chat[0, 0] / C[0, 0] - 1 - np.log(Chat[0, 0] / C[0, 0]))
@@ -670,53 +796,120 @@ class DatasetLikelihood(object):
     def chi_squared(self, ClArray, data_params={}, return_binned_theory=False):
 
         self.get_theory_map_cls(ClArray, data_params)
+        C = self.theory_matrices(self.map_cls_stack(self.map_cls), return_binned_theory)
+        if return_binned_theory and self.binned:
+            C, binned_theory = C
 
-        C = np.empty((self.nmaps, self.nmaps))
-        bigX = np.empty(self.nbins_used * self.ncl_used)
-        vecp = np.empty(self.ncl)
-        chisq = 0
+        chisq = self.chi_squared_matrices(C)
 
-        if self.binned:
-            binned_theory = self.get_binned_map_cls(self.map_cls)
+        if self.log_calibration_prior > 0:
+            chisq += (np.log(data_params[self.calibration_param]) / self.log_calibration_prior) ** 2
+        if return_binned_theory and self.binned:
+            return chisq, binned_theory
         else:
-            Cs = np.zeros((self.nbins_used, self.nmaps, self.nmaps))
-            for i in range(self.nmaps):
-                for j in range(i + 1):
-                    CL = self.map_cls[i, j]
-                    if CL is not None:
-                        Cs[:, i, j] = CL.CL[self.bin_min - self.pcl_lmin:self.bin_max - self.pcl_lmin + 1]
-                        Cs[:, j, i] = CL.CL[self.bin_min - self.pcl_lmin:self.bin_max - self.pcl_lmin + 1]
-
-        for bin in range(self.nbins_used):
-            if self.binned:
-                self.elements_to_matrix(binned_theory[bin, :], C)
-            else:
-                C[:, :] = Cs[bin, :, :]
-
-            if self.cl_noise is not None:
-                C += self.noise_matrix[bin]
+            return chisq
 
-            if self.like_approx == 'exact':
-                chisq += self.exact_chi_sq(C, self.bandpower_matrix[bin], self.bin_min + bin)
-                continue
-            elif self.like_approx == 'HL':
-                self.transform(C, self.bandpower_matrix[bin], self.fiducial_sqrt_matrix[bin])
-            elif self.like_approx == 'gaussian':
-                C -= self.bandpower_matrix[bin]
+    def map_cls_stack(self, map_cls):
+        """
+        Stack map spectra into symmetric arrays
 
-            self.matrix_to_elements(C, vecp)
+        :param map_cls: CrossPowerSpectrum array (as from init_map_cls), with CL arrays of shape [..., L]
+        :return: array of map spectra[..., nmaps_required, nmaps_required, pcl_lmax - pcl_lmin + 1]
+        """
+        shape = np.shape(map_cls[0, 0].CL)
+        theory = np.zeros(shape[:-1] + (self.nmaps_required, self.nmaps_required, shape[-1]))
+        for i in range(self.nmaps_required):
+            for j in range(i + 1):
+                if map_cls[i, j] is not None:
+                    theory[..., i, j, :] = map_cls[i, j].CL
+                    theory[..., j, i, :] = theory[..., i, j, :]
+        return theory
 
-            bigX[bin * self.ncl_used:(bin + 1) * self.ncl_used] = vecp[self.cl_used_index]
+    def theory_matrices(self, theory, return_binned_theory=False):
+        """
+        Get theory matrices for each used bin from stacked map spectra
 
-        if self.like_approx != 'exact':
-            chisq = fast_chi_squared(self.covinv, bigX)
+        :param theory: array of map spectra[..., nmaps_required, nmaps_required, L] (as from map_cls_stack)
+        :param return_binned_theory: if binned, also return the binned theory[..., nbins, ncl]
+        :return: array of matrices C[..., nbins_used, nmaps, nmaps]
+        """
+        if self.binned:
+            band = self.bins.bin_stack(theory)
+            if self.linear_correction is not None:
+                band += self.linear_correction.bin_stack(theory) - self.fid_correction.T
+            C = self.elements_to_matrices(band)
+            if return_binned_theory: return C, band
+            return C
+        return np.moveaxis(theory[..., self.bin_min - self.pcl_lmin:self.bin_max - self.pcl_lmin + 1], -1, -3)
+
+    def theory_map_cls_stack(self, cls, cols=['TT', 'EE', 'BB', 'TE', 'PP'], data_params={}):
+        """
+        Get stacked theory map spectra for a set of models (the vectorized equivalent of get_theory_map_cls,
+        without using or changing any stored state)
+
+        :param cls: array of theory Cls cls[n_models, len(cols), L], with L index from zero (as for ClsArray)
+        :param cols: names of the columns in cls, e.g. TT, EE, TE (in terms of field_names)
+        :param data_params: dictionary of nuisance parameter values, either scalars or arrays with value
+                            for each model
+        :return: array of map spectra[n_models, nmaps_required, nmaps_required, pcl_lmax - pcl_lmin + 1]
+        """
+        cls = np.asarray(cls)
+        col_index = dict()
+        for k, name in enumerate(cols):
+            for n in range(1, len(name)):
+                if name[:n] in self.field_names and name[n:] in self.field_names:
+                    col_index[tuple(sorted([self.typeIndex(name[:n]), self.typeIndex(name[n:])]))] = k
+        map_cls = self.init_map_cls(self.nmaps_required, self.required_order)
+        for i in range(self.nmaps_required):
+            for j in range(i + 1):
+                CL = map_cls[i, j]
+                k = col_index.get(tuple(CL.theory_ij))
+                if k is not None:
+                    CL.CL = cls[:, k, self.pcl_lmin:self.pcl_lmax + 1].astype(np.float64)
+                else:
+                    CL.CL = np.zeros((cls.shape[0], self.pcl_lmax - self.pcl_lmin + 1))
+        self.adapt_theory_for_maps(map_cls, data_params)
+        return self.map_cls_stack(map_cls)
 
+    def chi_squared_batch(self, cls, cols=['TT', 'EE', 'BB', 'TE', 'PP'], data_params={}):
+        """
+        Get chi-squared for many theory models at once. Does not use or change stored theory state,
+        so can be called from multiple threads.
+
+        :param cls: array of theory Cls cls[n_models, len(cols), L], with L index from zero (as for ClsArray)
+        :param cols: names of the columns in cls, e.g. TT, EE, TE (in terms of field_names)
+        :param data_params: dictionary of nuisance parameter values, either scalars or arrays with value
+                            for each model
+        :return: array of chi-squared values for each model
+        """
+        chisq = self.chi_squared_matrices(self.theory_matrices(self.theory_map_cls_stack(cls, cols, data_params)))
         if self.log_calibration_prior > 0:
             chisq += (np.log(data_params[self.calibration_param]) / self.log_calibration_prior) ** 2
-        if return_binned_theory and self.binned:
-            return chisq, binned_theory
-        else:
-            return chisq
+        return chisq
+
+    def chi_squared_matrices(self, C):
+        """
+        Get chi-squared from stacked theory matrices, transforming all bins at once
+
+        :param C: array of theory (without noise) matrices for each bin, C[..., nbins_used, nmaps, nmaps].
+                  Any leading dimensions are treated as separate models.
+        :return: chi-squared (array over any leading dimensions)
+        """
+        if self.cl_noise is not None:
+            C = C + self.noise_matrix
+
+        if self.like_approx == 'exact':
+            return self.exact_chi_sq_stack(C, self.bandpower_matrix, np.arange(self.bin_min, self.bin_max + 1))
+        elif self.like_approx == 'HL':
+            C = self.transform_stack(C, self.bandpower_matrix, self.fiducial_sqrt_matrix)
+        elif self.like_approx == 'gaussian':
+            C = C - self.bandpower_matrix
+
+        vecp = self.matrices_to_elements(C)[..., self.cl_used_index]
+        bigX = vecp.reshape(vecp.shape[:-2] + (self.nbins_used * self.ncl_used,))
+        if bigX.ndim == 1:
+            return fast_chi_squared(self.covinv, bigX)
+        return np.einsum('...i,...i->...', np.dot(bigX, self.covinv), bigX)
 
 
 def plotAndChisq(dataset, cl_file, data_params={}):
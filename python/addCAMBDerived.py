@@ -0,0 +1,30 @@
+# Add CAMB-calculated derived parameters (sigma8, distances, f*sigma8) to a thinned chain
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+from getdist import loadMCSamples
+import cosmomc_to_camb
+
+parser = argparse.ArgumentParser(description='Calculate derived parameters with CAMB for samples of a chain')
+parser.add_argument('chain_root')
+parser.add_argument('out_root', help='root name for the output chain with the new derived parameters')
+parser.add_argument('--thin', type=int, default=10, help='keep every thin-th sample')
+parser.add_argument('--procs', type=int, default=1, help='number of processes to use')
+parser.add_argument('--redshifts', nargs='+', type=float, default=[], help='redshifts for distances and fsigma8')
+parser.add_argument('--sigma8', action='store_true', help='calculate sigma8 and fsigma8 at the redshifts')
+parser.add_argument('--checkpoint', default=None,
+                    help='file to record results so that interrupted runs resume (default out_root.camb_checkpoint)')
+parser.add_argument('--ignore_rows', type=float, default=0.3)
+
+args = parser.parse_args()
+
+samples = loadMCSamples(args.chain_root, settings={'ignore_rows': args.ignore_rows})
+derived = cosmomc_to_camb.distance_functions(args.redshifts)
+if args.sigma8:
+    derived['sigma8'] = cosmomc_to_camb.sigma8
+    derived.update(cosmomc_to_camb.fsigma8_functions(args.redshifts))
+samples = cosmomc_to_camb.add_camb_derived(samples, derived, thin=args.thin, procs=args.procs,
+                                           checkpoint=args.checkpoint or args.out_root + '.camb_checkpoint',
+                                           matter_power_redshifts=args.redshifts if args.sigma8 else None,
+                                           background_only=not args.sigma8)
+samples.saveAsText(args.out_root, make_dirs=True)
@@ -14,11 +14,12 @@ for subBatch in sys.argv[2:]:
     batchPath2 = os.path.abspath(subBatch) + os.sep
     batch2 = batchjob.readobject(batchPath2)
     batch.subBatches.append(batch2)
+batch.resetIndex()
 
 for jobItem in list(batch.items()):
     for x in [imp for imp in jobItem.importanceJobsRecursive()]:
         if batch.hasName(x.name.replace('_post', '')):
             print('replacing importance sampling run (not deleting files): ' + x.name)
-            jobItem.removeImportance(x)
+            batch.removeImportance(jobItem, x)
 
 batch.save()
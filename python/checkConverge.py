@@ -2,7 +2,8 @@ from __future__ import absolute_import
 from __future__ import print_function
 from paramgrid import batchjob_args
 
-Opts = batchjob_args.batchArgs('Find chains which have failed or not converged.', importance=True, converge=True)
+Opts = batchjob_args.batchArgs('Find chains which have failed or not converged.', importance=True, converge=True,
+                               statusSnapshot=True)
 
 Opts.parser.add_argument('--exist', action='store_true')
 Opts.parser.add_argument('--checkpoint', action='store_true')
@@ -2,11 +2,9 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import fnmatch
-import shutil
-import zipfile
 from datetime import datetime, timedelta
 
-from paramgrid import batchjob, batchjob_args
+from paramgrid import batchjob_args, gridcopy
 
 Opts = batchjob_args.batchArgs('copy or zip chains and optionally other files', importance=True, converge=True)
 
@@ -30,6 +28,9 @@ Opts.parser.add_argument('--dryrun', action='store_true')
 Opts.parser.add_argument('--verbose', action='store_true')
 Opts.parser.add_argument('--zip', action='store_true',
                          help='make a zip file. Not needed if target_dir is a filename ending in .zip')
+Opts.parser.add_argument('--procs', type=int, default=1, help='number of processes to use for copying files')
+Opts.parser.add_argument('--resume', action='store_true',
+                         help='continue an interrupted run, skipping files already copied and unchanged')
 
 (batch, args) = Opts.parseForBatch()
 
@@ -39,15 +40,14 @@ if args.max_age_days:
 
 sizeMB = 0
 
-if args.zip:
-    zipper = zipfile.ZipFile(args.target_dir, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
-    target_dir = None
-else:
-    zipper = None
-    target_dir = os.path.abspath(args.target_dir) + os.sep
-    batchjob.makePath(target_dir)
+if args.sym_link and (args.remove_burn_fraction or args.zip):
+    raise Exception('option not compatible with --sym_link')
 
-if args.sym_link and (args.remove_burn_fraction or args.zip): raise Exception('option not compatible with --sym_link')
+if args.dryrun:
+    copier = None
+else:
+    copier = gridcopy.gridCopier(args.target_dir, zip=args.zip, sym_link=args.sym_link,
+                                 resume=args.resume, verbose=args.verbose)
 
 
 def fileMatches(f, name):
@@ -61,59 +61,37 @@ def fileMatches(f, name):
 
 def doCopy(source, dest, f, hasBurn=False):
     global sizeMB
-    if args.verbose: print(source + f)
-    frac = 1
-    if not args.dryrun:
-        if args.remove_burn_fraction and hasBurn:
-            lines = open(source + f).readlines()
-            lines = lines[int(len(lines) * args.remove_burn_fraction):]
-            frac = 1 - args.remove_burn_fraction
-        else:
-            lines = None
-        destf = dest + f
-        if args.zip:
-            if lines:
-                zipper.writestr(destf, "".join(lines))
-
-            else:
-                zipper.write(source + f, destf)
-        else:
-            if lines:
-                open(target_dir + destf, 'w').writelines(lines)
-            else:
-                if args.sym_link:
-                    if os.path.islink(target_dir + destf): os.unlink(target_dir + destf)
-                    os.symlink(os.path.realpath(source + f), target_dir + destf)
-                else:
-                    shutil.copyfile(source + f, target_dir + destf)
-    elif args.remove_burn_fraction and hasBurn:
-        frac = 1 - args.remove_burn_fraction
-    sizeMB += os.path.getsize(source + f) / 1024. ** 2 * frac
+    if args.verbose and args.dryrun: print(source + f)
+    op = gridcopy.copyOperation(source + f, dest + f,
+                                burn_fraction=args.remove_burn_fraction if hasBurn else 0.0)
+    ops.append(op)
+    sizeMB += op.sizeMB()
 
 
 def writeIni(iniName, props):
     if args.dryrun: return
-    if args.zip:
-        zipper.writestr(outdir + iniName, "\n".join(props.fileLines()))
-    else:
-        props.saveFile(target_dir + outdir + iniName)
+    copier.writeString(outdir + iniName, str(props))
 
 
+groups = []
+ops = []
 if not args.no_config:
     config_path = os.path.join(batch.batchPath, 'config/')
-    if not args.dryrun and not args.zip: batchjob.makePath(target_dir + 'config')
+    if copier: copier.makePath('config')
     for f in os.listdir(config_path):
         doCopy(config_path, 'config/', f)
+    groups.append(ops)
 
 for jobItem in Opts.filteredBatchItems():
     if args.converge == 0 or jobItem.hasConvergeBetterThan(args.converge):
         print(jobItem.name)
+        ops = []
         chainfiles = 0
         infofiles = 0
         distfiles = 0
         doneProperties = False
         outdir = jobItem.relativePath
-        if not args.zip: batchjob.makePath(target_dir + outdir)
+        if copier: copier.makePath(outdir)
         if args.chains and jobItem.chainExists() and (not args.max_age_days or datetime.fromtimestamp(jobItem.chainFileDate()) > max_age):
             i = 1
             while os.path.exists(jobItem.chainRoot + '_%d.txt' % i):
@@ -132,19 +110,24 @@ for jobItem in Opts.filteredBatchItems():
                 if doneProperties and '.properties.ini' in f: continue
                 if not args.max_age_days or datetime.fromtimestamp(os.path.getmtime(jobItem.chainPath + f)) > max_age:
                     infofiles += 1
-                    if args.verbose: print(jobItem.chainPath + f)
                     doCopy(jobItem.chainPath, outdir, f)
         if args.dist and os.path.exists(jobItem.distPath):
             outdir += 'dist' + os.sep
-            if not args.zip: batchjob.makePath(target_dir + outdir)
+            if copier: copier.makePath(outdir)
             for f in os.listdir(jobItem.distPath):
                 if fileMatches(f, jobItem.name) and (not args.max_age_days or
                                                      datetime.fromtimestamp(
                                                          os.path.getmtime(jobItem.distPath + f)) > max_age):
                     distfiles += 1
                     doCopy(jobItem.distPath, outdir, f)
+        groups.append(ops)
         print('... %d chain files, %d other files and %d dist files' % (chainfiles, infofiles, distfiles))
 
-if zipper: zipper.close()
+if copier:
+    try:
+        skipped = copier.transfer(groups, procs=args.procs)
+        if skipped: print('Skipped %u files already copied' % skipped)
+    finally:
+        copier.close()
 
 print('Total size: %u MB' % sizeMB)
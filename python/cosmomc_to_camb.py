@@ -3,6 +3,11 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import sys
+import copy
+import json
+import hashlib
+import multiprocessing
+import numpy as np
 
 try:
     import camb
@@ -28,3 +33,220 @@ def get_camb_params(p, num_massive_neutrinos=1, neutrino_hierarchy='degenerate',
     pars.set_dark_energy(w=p.get('w', -1))
     pars.set_for_lmax(2500, lens_potential_accuracy=1)
     return pars
+
+
+# derived parameter functions and CAMB settings for worker processes (each has its own CAMB state)
+_worker_args = None
+
+
+def sigma8(results, p):
+    # z=0 value, needs matter_power_redshifts set in add_camb_derived
+    return results.get_sigma8()[-1]
+
+
+class redshift_function(object):
+    """
+    Derived parameter function(results, p) calling a CAMB results method at a fixed redshift (e.g.
+    'angular_diameter_distance'). Unlike a lambda this can be pickled to send to worker processes.
+    """
+
+    def __init__(self, method, z):
+        self.method = method
+        self.z = z
+
+    def __call__(self, results, p):
+        return getattr(results, self.method)(self.z)
+
+
+class fsigma8_function(object):
+    """
+    Derived parameter function(results, p) giving f*sigma8 for the index-th matter power redshift
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __call__(self, results, p):
+        return results.get_fsigma8()[self.index]
+
+
+def distance_functions(redshifts):
+    """
+    Functions for standard derived distances at given redshifts, for use with :func:`add_camb_derived`
+
+    :param redshifts: list of redshifts
+    :return: dictionary of name: function(results, p)
+    """
+    funcs = dict()
+    for z in redshifts:
+        tag = ('%g' % z).replace('.', 'p')
+        funcs['DM_z' + tag] = redshift_function('comoving_radial_distance', z)
+        funcs['DA_z' + tag] = redshift_function('angular_diameter_distance', z)
+        funcs['H_z' + tag] = redshift_function('hubble_parameter', z)
+    return funcs
+
+
+def fsigma8_functions(redshifts):
+    """
+    Functions for f*sigma8 at given redshifts, for use with :func:`add_camb_derived` with the same
+    matter_power_redshifts
+
+    :param redshifts: list of redshifts
+    :return: dictionary of name: function(results, p)
+    """
+    funcs = dict()
+    ordered = _power_redshifts(redshifts)
+    for z in redshifts:
+        tag = ('%g' % z).replace('.', 'p')
+        funcs['fsigma8_z' + tag] = fsigma8_function(ordered.index(z))
+    return funcs
+
+
+def _power_redshifts(redshifts):
+    # CAMB orders redshifts decreasing; include zero for sigma8
+    return sorted(set(list(redshifts) + [0]), reverse=True)
+
+
+def _sample_derived(task):
+    index, p = task
+    derived, settings = _worker_args
+    try:
+        pars = get_camb_params(p, num_massive_neutrinos=settings['num_massive_neutrinos'],
+                               neutrino_hierarchy=settings['neutrino_hierarchy'])
+        if settings['matter_power_redshifts'] is not None:
+            pars.set_matter_power(redshifts=settings['matter_power_redshifts'], kmax=settings['kmax'])
+        if settings['background_only']:
+            results = camb.get_background(pars)
+        else:
+            results = camb.get_results(pars)
+        return index, [float(func(results, p)) for _, func in derived], None
+    except Exception as e:
+        return index, None, '%s: %s' % (type(e).__name__, e)
+
+
+def _init_worker(derived, settings):
+    global _worker_args
+    _worker_args = (derived, settings)
+
+
+class _checkpoint(object):
+    # JSON lines file of results for each sample index, after a header identifying the samples and outputs
+
+    def __init__(self, filename, header):
+        self.filename = filename
+        self.results = dict()
+        resume = False
+        if os.path.exists(filename):
+            with open(filename) as f:
+                try:
+                    resume = json.loads(f.readline()) == header
+                except ValueError:
+                    pass
+                line = '\n'
+                if resume:
+                    for line in f:
+                        try:
+                            index, values = json.loads(line)
+                            self.results[index] = values
+                        except ValueError:
+                            # incomplete last line from interrupted run
+                            pass
+        self.f = open(filename, 'a' if resume else 'w')
+        if resume and not line.endswith('\n'):
+            # start new results after any incomplete last line
+            self.f.write('\n')
+        if not resume:
+            self.f.write(json.dumps(header) + '\n')
+            self.f.flush()
+
+    def add(self, index, values):
+        self.results[index] = values
+        self.f.write(json.dumps([index, values]) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def add_camb_derived(samples, derived, thin=1, procs=1, checkpoint=None, matter_power_redshifts=None,
+                     kmax=2.0, background_only=False, num_massive_neutrinos=1, neutrino_hierarchy='degenerate'):
+    """
+    Calculate new derived parameters with CAMB for each sample of a (thinned) chain, returning a copy of the
+    samples with the new parameters added (the input samples are not changed). Samples are evaluated by a pool
+    of processes; if a checkpoint file is given, finished samples are recorded so that an interrupted run can be
+    resumed by calling again with the same arguments.
+
+    :param samples: :class:`~getdist.mcsamples.MCSamples` instance with cosmomc parameters
+    :param derived: dictionary of name: function(results, p), where results is the CAMB results object and p
+                    the dictionary of parameter values for the sample (see e.g. :func:`distance_functions`).
+                    With procs > 1 the functions must be picklable (module level functions or instances
+                    like :class:`redshift_function`, not lambdas)
+    :param thin: thin factor (if > 1 the samples are thinned to unit weights, see
+                 :meth:`~getdist.chains.WeightedSamples.thin`; needs integer weights, so not importance
+                 sampled chains)
+    :param procs: number of processes to use
+    :param checkpoint: optional file name to record results as they are calculated
+    :param matter_power_redshifts: redshifts for the matter power spectrum (e.g. to get sigma8, fsigma8),
+                                   or None if not needed
+    :param kmax: maximum k for the matter power spectrum
+    :param background_only: only calculate background quantities (much faster, enough for distances)
+    :param num_massive_neutrinos: as for :func:`get_camb_params`
+    :param neutrino_hierarchy: as for :func:`get_camb_params`
+    :return: new samples, with the derived parameters added (NaN for any samples where CAMB failed)
+    """
+    if thin > 1 and np.any(samples.weights != np.round(samples.weights)):
+        raise ValueError('add_camb_derived: can only thin samples with integer weights (e.g. not importance '
+                         'sampled); use thin=1 to calculate for all samples')
+    samples = copy.deepcopy(samples)
+    if thin > 1: samples.thin(thin)
+    derived = sorted(derived.items())
+    if matter_power_redshifts is not None: matter_power_redshifts = _power_redshifts(matter_power_redshifts)
+    settings = {'matter_power_redshifts': matter_power_redshifts, 'kmax': kmax, 'background_only': background_only,
+                'num_massive_neutrinos': num_massive_neutrinos, 'neutrino_hierarchy': neutrino_hierarchy}
+    results = dict()
+    store = None
+    if checkpoint:
+        header = {'names': [name for name, _ in derived], 'settings': settings,
+                  'samples': hashlib.md5(np.ascontiguousarray(samples.samples).tobytes()).hexdigest()}
+        store = _checkpoint(checkpoint, header)
+        results.update(store.results)
+    fixed = samples.ranges.fixedValueDict()
+    names = samples.paramNames.list()
+    tasks = []
+    for i in range(samples.numrows):
+        if i not in results:
+            p = dict(fixed)
+            p.update(zip(names, samples.samples[i, :]))
+            tasks.append((i, p))
+    print('Calculating %s samples (%s done)' % (len(tasks), len(results)))
+
+    def finish(index, values, error):
+        if error is not None:
+            print('CAMB error for sample %s: %s' % (index, error))
+            values = [np.nan] * len(derived)
+        results[index] = values
+        if store: store.add(index, values)
+
+    try:
+        if procs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(procs, len(tasks)), initializer=_init_worker,
+                                        initargs=(derived, settings))
+            try:
+                for res in pool.imap_unordered(_sample_derived, tasks, chunksize=max(1, len(tasks) // (procs * 8))):
+                    finish(*res)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            _init_worker(derived, settings)
+            for task in tasks:
+                finish(*_sample_derived(task))
+    finally:
+        if store: store.close()
+    values = np.array([results[i] for i in range(samples.numrows)], dtype=np.float64).reshape(samples.numrows, -1)
+    for i, (name, _) in enumerate(derived):
+        samples.addDerived(values[:, i], name, label=name)
+    return samples
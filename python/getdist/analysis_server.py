@@ -0,0 +1,455 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import time
+import pickle
+import hashlib
+import tempfile
+import stat
+import threading
+import subprocess
+import logging
+from multiprocessing.connection import Listener, Client
+import six
+
+"""
+Local analysis server for keeping :class:`~.plots.MCSampleAnalysis` state warm between plot scripts.
+
+A server process loads and analyses chains once, and then serves samples, statistics and density grids over
+a Unix socket. Plot scripts use :class:`MCSampleAnalysisClient` in place of :class:`~.plots.MCSampleAnalysis`
+(e.g. by constructing the plotter with *analysis_server=True*), so they only pay for drawing.
+"""
+
+default_idle_timeout = 3600
+
+# MCSampleAnalysis methods that can be called remotely
+served_methods = ['samplesForRoot', 'get_density', 'get_density_grid', 'load_single_samples', 'paramsForRoot',
+                  'boundsForRoot', 'removeRoot', 'reset', 'addChainDir']
+
+
+class AnalysisServerError(Exception):
+    """
+    An exception that is raised when there is an error communicating with the analysis server
+    """
+    pass
+
+
+def _check_private(path, is_dir):
+    # only use files that belong to this user and that nobody else can access
+    info = os.lstat(path)
+    is_type = stat.S_ISDIR if is_dir else stat.S_ISREG
+    if not is_type(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise AnalysisServerError('%s must be owned by the current user and not accessible by others' % path)
+
+
+def server_dir():
+    """
+    Get the (user private) directory used for server sockets, checking it is owned by and private to the user
+
+    :return: directory name
+    """
+    user = os.environ.get('USER') or os.environ.get('USERNAME') or str(os.getuid())
+    path = os.path.join(tempfile.gettempdir(), 'getdist-server-' + user)
+    if not os.path.lexists(path):
+        try:
+            os.mkdir(path, 0o700)
+        except OSError:
+            # e.g. created at the same time by another process; checked below
+            pass
+    _check_private(path, True)
+    return path
+
+
+def server_authkey():
+    """
+    Get the per-user secret key that clients must use to connect to a server
+    (stored in the private server directory, generated on first use)
+
+    :return: key (bytes)
+    """
+    fname = os.path.join(server_dir(), 'authkey')
+    if not os.path.lexists(fname):
+        try:
+            fd = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(hashlib.sha256(os.urandom(64)).hexdigest().encode('ascii'))
+        except OSError:
+            pass
+    _check_private(fname, False)
+    with open(fname, 'rb') as f:
+        key = f.read().strip()
+    if not key: raise AnalysisServerError('Empty analysis server key file %s' % fname)
+    return key
+
+
+def _connect(address):
+    return Client(address, family='AF_UNIX', authkey=server_authkey())
+
+
+def param_bounds(samples):
+    """
+    Get just the parameter limits of samples (as used by getUpper and getLower), e.g. to send instead of all samples
+
+    :param samples: :class:`~.mcsamples.MCSamples` instance, or object that already has getUpper and getLower
+    :return: :class:`~.parampriors.ParamBounds` instance
+    """
+    from getdist.parampriors import ParamBounds
+
+    if not hasattr(samples, 'paramNames'): return samples
+    bounds = ParamBounds()
+    bounds.names = samples.paramNames.list()
+    for par in samples.paramNames.names:
+        if getattr(par, 'limmin', None) is not None: bounds.lower[par.name] = par.limmin
+        if getattr(par, 'limmax', None) is not None: bounds.upper[par.name] = par.limmax
+    return bounds
+
+
+def server_address(chain_locations=None, settings=None):
+    """
+    Get the socket address for a server with given chain locations and analysis settings.
+    Each distinct combination gets its own server.
+
+    :param chain_locations: chain directory, grid path or list of such
+    :param settings: analysis settings (dict or name of .ini file)
+    :return: socket file name
+    """
+    if isinstance(chain_locations, six.string_types): chain_locations = [chain_locations]
+    locations = [os.path.abspath(loc) if isinstance(loc, six.string_types) else str(loc)
+                 for loc in chain_locations or []]
+    if isinstance(settings, dict):
+        settings_key = sorted((str(key), str(value)) for key, value in six.iteritems(settings))
+    else:
+        settings_key = settings
+    key = hashlib.md5(repr((locations, settings_key)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(server_dir(), key + '.sock')
+
+
+class AnalysisServer(object):
+    """
+    Server holding a :class:`~.plots.MCSampleAnalysis` instance and answering requests from clients.
+    """
+
+    def __init__(self, chain_locations, settings=None, address=None, idle_timeout=default_idle_timeout):
+        """
+        :param chain_locations: chain directory or grid path, or list of such
+        :param settings: analysis settings for :class:`~.plots.MCSampleAnalysis`
+        :param address: socket file name (default from :func:`server_address`)
+        :param idle_timeout: shut down after this many seconds without requests
+        """
+        from getdist.plots import MCSampleAnalysis
+
+        self.address = address or server_address(chain_locations, settings)
+        self.analysis = MCSampleAnalysis(chain_locations, settings)
+        self.idle_timeout = idle_timeout
+        self.last_request = time.time()
+        self.lock = threading.Lock()
+        self.listener = None
+        self.running = False
+
+    def handle(self, request):
+        """
+        Process a single request.
+
+        :param request: tuple of (method name, args, kwargs)
+        :return: the result of the call
+        """
+        method, args, kwargs = request
+        if method == 'ping':
+            return True
+        if method == 'getattr':
+            return getattr(self.analysis, args[0])
+        if method == 'samples_method':
+            # call a method on the MCSamples for given root, e.g. getMargeStats
+            root, name = args[:2]
+            if name.startswith('_'): raise AnalysisServerError('Cannot call private method %s' % name)
+            return getattr(self.analysis.samplesForRoot(root), name)(*args[2:], **kwargs)
+        if method not in served_methods:
+            raise AnalysisServerError('Unknown method %s' % method)
+        if method == 'boundsForRoot':
+            return param_bounds(self.analysis.boundsForRoot(*args, **kwargs))
+        return getattr(self.analysis, method)(*args, **kwargs)
+
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, IOError):
+                    break
+                self.last_request = time.time()
+                if request[0] == 'shutdown':
+                    conn.send((True, None))
+                    self.stop()
+                    break
+                with self.lock:
+                    try:
+                        result = (True, self.handle(request))
+                    except Exception as e:
+                        logging.exception('Error serving request %s', request[0])
+                        result = (False, e)
+                try:
+                    conn.send(result)
+                except pickle.PicklingError as e:
+                    conn.send((False, AnalysisServerError('Result not picklable: %s' % e)))
+        finally:
+            conn.close()
+
+    def _watch_idle(self):
+        while self.running:
+            time.sleep(min(10, self.idle_timeout))
+            if time.time() - self.last_request > self.idle_timeout:
+                logging.info('Analysis server idle, shutting down')
+                self.stop()
+
+    def stop(self):
+        """
+        Stop the server and remove the socket file
+        """
+        if not self.running: return
+        self.running = False
+        try:
+            # wake up the accept call
+            _connect(self.address).close()
+        except Exception:
+            pass
+
+    def serve_forever(self):
+        """
+        Listen for clients until shut down or idle for longer than idle_timeout.
+        """
+        if os.path.exists(self.address): os.remove(self.address)
+        self.listener = Listener(self.address, family='AF_UNIX', authkey=server_authkey())
+        self.running = True
+        watcher = threading.Thread(target=self._watch_idle)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            while self.running:
+                try:
+                    conn = self.listener.accept()
+                except Exception as e:
+                    # e.g. client with the wrong key
+                    logging.warning('Rejected connection: %s', e)
+                    continue
+                if not self.running:
+                    conn.close()
+                    break
+                thread = threading.Thread(target=self._serve_connection, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.listener.close()
+            if os.path.exists(self.address): os.remove(self.address)
+
+
+def start_server(chain_locations, settings=None, address=None, idle_timeout=default_idle_timeout, wait=30):
+    """
+    Start a detached server process, and wait for it to accept connections.
+
+    :param chain_locations: chain directory or grid path, or list of such
+    :param settings: analysis settings
+    :param address: socket file name (default from :func:`server_address`)
+    :param idle_timeout: server shuts down after this many seconds without requests
+    :param wait: maximum time in seconds to wait for the server to start
+    :return: the socket address
+    """
+    address = address or server_address(chain_locations, settings)
+    config = pickle.dumps((chain_locations, settings, address, idle_timeout), protocol=2)
+    log_file = open(os.path.splitext(address)[0] + '.log', 'ab')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+                                        [p for p in [env.get('PYTHONPATH')] if p])
+    # run in a new session, so that e.g. Ctrl-C in the calling terminal does not also stop the shared server
+    detach = {'start_new_session': True} if six.PY3 else {'preexec_fn': getattr(os, 'setsid', None)}
+    proc = subprocess.Popen([sys.executable, '-m', 'getdist.analysis_server', '--stdin_config'],
+                            stdin=subprocess.PIPE, stdout=log_file, stderr=subprocess.STDOUT,
+                            cwd=os.getcwd(), close_fds=True, env=env, **detach)
+    proc.stdin.write(config)
+    proc.stdin.close()
+    log_file.close()
+    start = time.time()
+    while time.time() - start < wait:
+        if proc.poll() is not None:
+            raise AnalysisServerError('Analysis server failed to start, see %s' % log_file.name)
+        if os.path.exists(address):
+            try:
+                _connect(address).close()
+                return address
+            except Exception:
+                pass
+        time.sleep(0.05)
+    raise AnalysisServerError('Timed out waiting for analysis server at %s' % address)
+
+
+class MCSampleAnalysisClient(object):
+    """
+    Drop-in replacement for :class:`~.plots.MCSampleAnalysis` that forwards requests to an :class:`AnalysisServer`,
+    starting a server process if one is not already running for the given chain locations and settings.
+    """
+
+    def __init__(self, chain_locations, settings=None, address=None, idle_timeout=default_idle_timeout):
+        """
+        :param chain_locations: chain directory or grid path, or list of such
+        :param settings: analysis settings for :class:`~.plots.MCSampleAnalysis`
+        :param address: optional socket file name
+        :param idle_timeout: idle timeout for any newly started server
+        """
+        self.chain_locations = chain_locations
+        self.settings = settings
+        self.idle_timeout = idle_timeout
+        self.address = address or server_address(chain_locations, settings)
+        self.conn = None
+        self._ini = None
+        self._chain_dirs = None
+        self._connect()
+        self.newPlot()
+
+    def _connect(self):
+        try:
+            self.conn = _connect(self.address)
+        except AnalysisServerError:
+            raise
+        except Exception:
+            start_server(self.chain_locations, self.settings, self.address, self.idle_timeout)
+            self.conn = _connect(self.address)
+
+    def _call(self, method, *args, **kwargs):
+        for attempt in range(2):
+            try:
+                self.conn.send((method, args, kwargs))
+                ok, result = self.conn.recv()
+                break
+            except (EOFError, IOError):
+                # server may have timed out; restart it once
+                if attempt: raise
+                self._connect()
+        if not ok: raise result
+        return result
+
+    @property
+    def ini(self):
+        if self._ini is None: self._ini = self._call('getattr', 'ini')
+        return self._ini
+
+    @property
+    def chain_dirs(self):
+        if self._chain_dirs is None: self._chain_dirs = self._call('getattr', 'chain_dirs')
+        return self._chain_dirs
+
+    def samplesForRoot(self, root, file_root=None, cache=True, settings=None):
+        if not isinstance(root, six.string_types): return root
+        if cache and settings is None and root in self.mcsamples: return self.mcsamples[root]
+        samples = self._call('samplesForRoot', root, file_root=file_root, cache=cache, settings=settings)
+        self.mcsamples[root] = samples
+        return samples
+
+    def samples_method(self, root, name, *args, **kwargs):
+        """
+        Call a method of the (server-side) :class:`~.mcsamples.MCSamples` for a given root,
+        without transferring the samples, e.g. samples_method(root, 'getMargeStats')
+
+        :param root: root name
+        :param name: name of the method
+        :return: result of the method
+        """
+        return self._call('samples_method', root, name, *args, **kwargs)
+
+    def addRoots(self, roots):
+        for root in roots:
+            self.addRoot(root)
+
+    def addRoot(self, file_root):
+        from getdist.plots import RootInfo
+
+        if isinstance(file_root, RootInfo):
+            if file_root.batch:
+                return self.samplesForRoot(file_root.root)
+            else:
+                return self.samplesForRoot(file_root.root, os.path.join(file_root.path, file_root.root))
+        else:
+            return self.samplesForRoot(os.path.basename(file_root), file_root)
+
+    def addChainDir(self, chain_dir):
+        self._chain_dirs = None
+        self._call('addChainDir', chain_dir)
+
+    def removeRoot(self, file_root):
+        root = os.path.basename(file_root)
+        self.mcsamples.pop(root, None)
+        self.single_samples.pop(root, None)
+        self._call('removeRoot', file_root)
+
+    def reset(self, settings=None, chain_settings_have_priority=True):
+        self._ini = None
+        self.newPlot()
+        self._call('reset', settings, chain_settings_have_priority)
+
+    def newPlot(self):
+        self.mcsamples = {}
+        self.single_samples = {}
+
+    def get_density(self, root, param, likes=False):
+        if not isinstance(root, six.string_types): return root.get1DDensityGridData(param, meanlikes=likes)
+        return self._call('get_density', root, getattr(param, 'name', param), likes=likes)
+
+    def get_density_grid(self, root, param1, param2, conts=2, likes=False):
+        if not isinstance(root, six.string_types):
+            return root.get2DDensityGridData(param1.name, param2.name, num_plot_contours=conts, meanlikes=likes)
+        return self._call('get_density_grid', root, param1, param2, conts=conts, likes=likes)
+
+    def load_single_samples(self, root):
+        if not root in self.single_samples:
+            if not isinstance(root, six.string_types):
+                self.single_samples[root] = root.makeSingleSamples()
+            else:
+                self.single_samples[root] = self._call('load_single_samples', root)
+        return self.single_samples[root]
+
+    def paramsForRoot(self, root, labelParams=None):
+        if hasattr(root, 'paramNames'):
+            from paramgrid import batchjob
+
+            names = root.paramNames
+            if labelParams is not None:
+                names.setLabelsAndDerivedFromParamNames(os.path.join(batchjob.getCodeRootPath(), labelParams))
+            return names
+        return self._call('paramsForRoot', root, labelParams=labelParams)
+
+    def boundsForRoot(self, root):
+        if hasattr(root, 'getUpper'): return root
+        # server only sends the limits, not the samples
+        return self._call('boundsForRoot', root)
+
+    def shutdown(self):
+        """
+        Shut down the server process
+        """
+        try:
+            self.conn.send(('shutdown', (), {}))
+            self.conn.recv()
+        except (EOFError, IOError):
+            pass
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a GetDist analysis server')
+    parser.add_argument('chain_dir', nargs='*', help='chain directories or grid paths to serve')
+    parser.add_argument('--settings', help='.ini file with analysis settings')
+    parser.add_argument('--address', help='socket file name (default determined by chain_dir and settings)')
+    parser.add_argument('--idle_timeout', type=float, default=default_idle_timeout,
+                        help='seconds to wait without requests before exiting')
+    parser.add_argument('--stdin_config', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.stdin_config:
+        chain_locations, settings, address, idle_timeout = pickle.load(getattr(sys.stdin, 'buffer', sys.stdin))
+    else:
+        chain_locations, settings, address, idle_timeout = \
+            args.chain_dir, args.settings, args.address, args.idle_timeout
+    server = AnalysisServer(chain_locations, settings, address, idle_timeout)
+    print('Serving on %s' % server.address)
+    sys.stdout.flush()
+    server.serve_forever()
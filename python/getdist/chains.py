@@ -5,6 +5,8 @@ import numpy as np
 from getdist.paramnames import ParamNames, ParamInfo, escapeLatex
 from getdist.convolve import autoConvolve
 import pickle
+import hashlib
+import multiprocessing
 import six
 
 # whether to write to terminal chain names and burn in details when loaded from file
@@ -40,6 +42,75 @@ def slice_or_none(x, start=None, end=None):
     return getattr(x, "__getitem__", lambda _: None)(slice(start, end))
 
 
+# parameter names and derived parameter definitions for worker processes evaluating derived parameters
+_derived_worker_args = None
+
+
+def _derivedSpecs(derived):
+    # normalize dictionary or list of (name, definition[, label]) tuples or dictionaries to list of dictionaries
+    if isinstance(derived, dict):
+        derived = list(derived.items())
+    specs = []
+    for item in derived:
+        if isinstance(item, dict):
+            spec = dict(item)
+        else:
+            spec = dict(zip(['name', 'definition', 'label', 'comment', 'range'], item))
+        if 'name' not in spec or 'definition' not in spec:
+            raise ValueError('derived parameters need a name and definition')
+        specs.append(spec)
+    return specs
+
+
+def derivedDefinitionKey(definition):
+    """
+    Get a string identifying a derived parameter definition, used to check whether stored derived parameters
+    are up to date.
+
+    :param definition: expression string or function
+    :return: string key
+    """
+    if isinstance(definition, six.string_types): return definition
+    code = getattr(definition, '__code__', None)
+    name = getattr(definition, '__module__', '') + '.' + getattr(definition, '__name__', repr(definition))
+    if code is None: return name
+    return name + ':' + hashlib.md5(code.co_code + repr(code.co_consts).encode('utf-8')).hexdigest()
+
+
+def _evaluateDerived(names, definitions, samples):
+    pars = ParSamples()
+    namespace = {}
+    for i, name in enumerate(names):
+        path = name.split('.')
+        ob = pars
+        for p in path[:-1]:
+            if not hasattr(ob, p): setattr(ob, p, ParSamples())
+            ob = getattr(ob, p)
+        setattr(ob, path[-1], samples[:, i])
+        namespace[path[0]] = getattr(pars, path[0])
+    namespace['np'] = np
+    result = np.empty((samples.shape[0], len(definitions)))
+    for i, (name, definition) in enumerate(definitions):
+        if isinstance(definition, six.string_types):
+            value = eval(definition, {'__builtins__': {}}, namespace)
+        else:
+            value = definition(pars)
+        result[:, i] = value
+        # later definitions can use earlier ones
+        setattr(pars, name, result[:, i])
+        namespace[name] = result[:, i]
+    return result
+
+
+def _initDerivedWorker(names, definitions):
+    global _derived_worker_args
+    _derived_worker_args = (names, definitions)
+
+
+def _derivedChunk(samples):
+    return _evaluateDerived(_derived_worker_args[0], _derived_worker_args[1], samples)
+
+
 def chainFiles(root, chain_indices=None, ext='.txt', first_chain=0, last_chain=-1, chain_exclude=None):
     """
     Creates a list of file names for samples given a root name and optional filters
@@ -265,6 +336,8 @@ class WeightedSamples(object):
         self.vars = None
         self.sddev = None
         self.needs_update = True
+        # samples and weights no longer as loaded from file
+        self._rows_loaded = False
 
     def _makeParamvec(self, par):
         if isinstance(par, six.integer_types):
@@ -1029,6 +1102,56 @@ class Chains(WeightedSamples):
         self.changeSamples(np.c_[self.samples, paramVec])
         return self.paramNames.addDerived(name, **kwargs)
 
+    def addDerivedParams(self, derived, chunk_size=100000, procs=1):
+        """
+        Adds a set of new derived parameters, evaluated over chunks of samples (optionally in parallel),
+        growing the samples array only once.
+
+        Each parameter is defined by an expression string in terms of parameter names (e.g. "H0/100", numpy available
+        as np), or a function that takes a :class:`ParSamples` object with a vector for each parameter (e.g. p.H0).
+        Definitions can use earlier parameters in the same list.
+
+        :param derived: dictionary of name: definition, or list of (name, definition[, label[, comment]])
+                        tuples or of dictionaries with keys name, definition and optionally label, comment
+        :param chunk_size: number of samples to evaluate at once
+        :param procs: number of processes to use. With procs > 1 functions must be picklable unless using
+                      fork multiprocessing (the default on Linux).
+        :return: list of the added parameters' :class:`~.paramnames.ParamInfo` objects
+                 (not including parameters that already exist with the same definition)
+        """
+        definitions = getattr(self, 'derived_definitions', None)
+        if definitions is None: definitions = self.derived_definitions = dict()
+        specs = []
+        for spec in _derivedSpecs(derived):
+            spec['key'] = derivedDefinitionKey(spec['definition'])
+            if self.paramNames.parWithName(spec['name']):
+                # skip parameters already added with the same definition (e.g. restored from cache)
+                if definitions.get(spec['name']) == spec['key']: continue
+                raise ValueError('Parameter with name %s already exists' % spec['name'])
+            specs.append(spec)
+        if not specs: return []
+        names = self.paramNames.list()
+        evaluate = [(spec['name'], spec['definition']) for spec in specs]
+        chunks = [self.samples[i:i + chunk_size] for i in range(0, self.samples.shape[0], chunk_size)]
+        if procs > 1 and len(chunks) > 1:
+            pool = multiprocessing.Pool(min(procs, len(chunks)), initializer=_initDerivedWorker,
+                                        initargs=(names, evaluate))
+            try:
+                results = pool.map(_derivedChunk, chunks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            results = [_evaluateDerived(names, evaluate, chunk) for chunk in chunks]
+        self.changeSamples(np.hstack((self.samples, np.vstack(results))))
+        for spec in specs:
+            definitions[spec['name']] = spec['key']
+        return [self.paramNames.addDerived(spec['name'], label=spec.get('label') or spec['name'],
+                                           comment=spec.get('comment') or '') for spec in specs]
+
     def loadChains(self, root, files_or_samples, weights=None, loglikes=None,
                    ignore_lines=None):
         """
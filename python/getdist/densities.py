@@ -9,6 +9,85 @@ class DensitiesError(Exception):
 defaultContours = [0.68, 0.95]
 
 
+def _halfEdgeBins(inbins):
+    """
+    Get copy of bins with edge bins halved in each direction (so edges are only half integrated over)
+    """
+    abins = inbins.copy()
+    for axis in range(abins.ndim):
+        edges = [slice(None)] * abins.ndim
+        for edge in (0, -1):
+            edges[axis] = edge
+            abins[tuple(edges)] /= 2
+    return abins
+
+
+class SortedBins(object):
+    """
+    Bins of a density sorted by value, with the cumulative (lowest-first) probability mass, used to find
+    contour levels. Only the largest bins are sorted if that is sufficient for the requested contours,
+    using selection (:func:`numpy.argpartition`) rather than a full sort.
+
+    Can be computed once for a density and then reused for any set of contours.
+    """
+
+    # use selection of the largest bins rather than a full sort for arrays larger than this
+    partition_min_size = 2 ** 16
+
+    def __init__(self, inbins, half_edge=True, edge_weights=None):
+        """
+        :param inbins: binned density
+        :param half_edge: If True, edge bins are only half integrated over in each direction.
+        :param edge_weights: optional array of integration weights for each bin, used instead of half_edge
+        """
+        self.inbins = inbins.reshape(-1)
+        if edge_weights is not None:
+            self.abins = self.inbins * edge_weights
+        elif half_edge:
+            self.abins = _halfEdgeBins(inbins).reshape(-1)
+        else:
+            self.abins = self.inbins
+        self.norm = np.sum(self.abins)
+        self.size = self.inbins.size
+        self.num_sorted = 0
+
+    def _sortLargest(self, num):
+        if num >= self.size or self.size < self.partition_min_size:
+            indexes = self.inbins.argsort()
+            self.sortgrid = self.abins[indexes]
+            self.cumsum = np.cumsum(self.sortgrid)
+            self.num_sorted = self.size
+        else:
+            top = np.argpartition(self.inbins, self.size - num)[self.size - num:]
+            indexes = top[self.inbins[top].argsort()]
+            self.sortgrid = self.abins[indexes]
+            cumsum = np.cumsum(self.sortgrid)
+            # mass in all bins up to and including each sorted bin
+            self.cumsum = cumsum + (self.norm - cumsum[-1])
+            self.num_sorted = num
+
+    def getContourLevels(self, contours=defaultContours, missing_norm=0):
+        """
+        Get contour levels enclosing "contours" fraction of the probability
+
+        :param contours: list of confidence contours to calculate
+        :param missing_norm: accounts of any points not included in the bins
+        :return: array of density levels
+        """
+        targets = (1 - np.atleast_1d(contours)) * self.norm - missing_norm
+        num = max(self.num_sorted, self.size // 8)
+        if not self.num_sorted: self._sortLargest(num)
+        while self.num_sorted < self.size and np.min(targets) <= self.cumsum[0]:
+            num *= 4
+            self._sortLargest(num)
+        ixs = np.searchsorted(self.cumsum, targets)
+        if np.any(ixs == 0):
+            raise DensitiesError("Contour level outside plotted ranges")
+        h = self.cumsum[ixs] - self.cumsum[ixs - 1]
+        d = (self.cumsum[ixs] - targets) / h
+        return self.sortgrid[ixs] * (1 - d) + d * self.sortgrid[ixs - 1]
+
+
 def getContourLevels(inbins, contours=defaultContours, missing_norm=0, half_edge=True):
     """
      Get contour levels enclosing "contours" fraction of the probability, for any dimension bins array
@@ -20,32 +99,7 @@ def getContourLevels(inbins, contours=defaultContours, missing_norm=0, half_edge
      :return: list of density levels
 
     """
-    contour_levels = np.zeros(len(contours))
-    if half_edge:
-        abins = inbins.copy()
-        lastindices = [-1] + [slice(None, None, None) for _ in abins.shape[1:]]
-        firstindices = [0] + [slice(None, None, None) for _ in abins.shape[1:]]
-        for _ in abins.shape:
-            abins[tuple(lastindices)] /= 2
-            abins[tuple(firstindices)] /= 2
-            lastindices = np.roll(lastindices, 1)
-            firstindices = np.roll(firstindices, 1)
-    else:
-        abins = inbins
-    norm = np.sum(abins)
-    targets = (1 - np.array(contours)) * norm - missing_norm
-    bins = abins.reshape(-1)
-    indexes = inbins.reshape(-1).argsort()
-    sortgrid = bins[indexes]
-    cumsum = np.cumsum(sortgrid)
-    ixs = np.searchsorted(cumsum, targets)
-    for i, ix in enumerate(ixs):
-        if ix == 0:
-            raise DensitiesError("Contour level outside plotted ranges")
-        h = cumsum[ix] - cumsum[ix - 1]
-        d = (cumsum[ix] - targets[i]) / h
-        contour_levels[i] = sortgrid[ix] * (1 - d) + d * sortgrid[ix - 1]
-    return contour_levels
+    return SortedBins(inbins, half_edge).getContourLevels(contours, missing_norm)
 
 
 class GridDensity(object):
@@ -55,6 +109,12 @@ class GridDensity(object):
     :ivar P: array of density values
     """
 
+    def __getstate__(self):
+        # don't pickle cached sorting data
+        state = self.__dict__.copy()
+        state.pop('_sorted_bins', None)
+        return state
+
     def normalize(self, by='integral', in_place=False):
         """
         Normalize the density grid
@@ -76,6 +136,7 @@ class GridDensity(object):
         else:
             self.setP(self.P / norm)
         self.spl = None
+        self._sorted_bins = None
         return self
 
     def setP(self, P=None):
@@ -92,6 +153,7 @@ class GridDensity(object):
         else:
             self.P = np.zeros([ax.size for ax in self.axes])
         self.spl = None
+        self._sorted_bins = None
 
     def bounds(self):
         """
@@ -108,12 +170,14 @@ class GridDensity(object):
 
     def getContourLevels(self, contours=defaultContours):
         """
-        Get contour levels
+        Get contour levels. The sorted bins are cached, so calling again for different contours is fast.
 
         :param contours: list of confidence limits to get (default [0.68, 0.95])
         :return: list of contour levels
         """
-        return getContourLevels(self.P, contours)
+        if getattr(self, '_sorted_bins', None) is None:
+            self._sorted_bins = SortedBins(self.P)
+        return self._sorted_bins.getContourLevels(contours)
 
 
 class Density1D(GridDensity):
@@ -345,3 +409,137 @@ class DensityND(GridDensity, LinearNDInterpolator):
         """
         if self.spl is None: self._initSpline()
         return self.spl.__call__(xs)
+
+
+class SparseDensityND(GridDensity):
+    """
+    Class for ND marginalized densities stored sparsely, as values only for the occupied bins of the grid.
+    Useful for higher dimensions where a dense grid would be mostly empty.
+
+    Bins are indexed by flat index q = ix_0 + n_0 * ix_1 + n_0 * n_1 * ix_2..., for bin indices ix_i of
+    the x_i parameter (as for the dense arrays, which are indexed [ix_{n-1},...,ix_0]).
+
+    :ivar indices: sorted array of flat indices of occupied bins
+    :ivar P: array of density values in each occupied bin
+    """
+
+    def __init__(self, xs, indices, P, view_ranges=None):
+        """
+        :param xs: list of arrays of x values
+        :param indices: sorted array of flat indices of occupied bins
+        :param P: array of density values for each occupied bin
+        :param view_ranges: optional ranges for viewing density
+        """
+        self.dim = len(xs)
+        self.xs = xs
+        self.axes = xs[::-1]
+        self.shape = tuple(len(x) for x in self.axes)
+        self.view_ranges = view_ranges
+        self.spacing = np.prod([x[1] - x[0] for x in xs])
+        self.indices = indices
+        self.spl = None
+        self.setP(P)
+
+    def setP(self, P=None):
+        """
+        Set the density values in the occupied bins
+
+        :param P: numpy array of density values, one for each occupied bin
+        """
+        if P is not None:
+            if P.shape != self.indices.shape:
+                raise DensitiesError("Array size mismatch in sparse density: P %s, bins %s" %
+                                     (P.shape, self.indices.shape))
+            self.P = P
+        else:
+            self.P = np.zeros(self.indices.shape)
+        self._sorted_bins = None
+
+    def binIndices(self, indices=None):
+        """
+        Get the bin indices along each parameter direction
+
+        :param indices: flat indices (default: all occupied bins)
+        :return: list of arrays of bin indices for x_0, x_1...
+        """
+        return list(np.unravel_index(self.indices if indices is None else indices, self.shape))[::-1]
+
+    def edge_weights(self):
+        """
+        Integration weights for occupied bins: edge bins are only half integrated over in each direction.
+        """
+        nboundaries = np.zeros(self.indices.shape, dtype=int)
+        for ix, x in zip(self.binIndices(), self.xs):
+            nboundaries += (ix == 0)
+            nboundaries += (ix == x.size - 1)
+        return 0.5 ** nboundaries
+
+    def integrate(self, P):
+        return np.dot(P, self.edge_weights())
+
+    def norm_integral(self):
+        return self.integrate(self.P)
+
+    def getContourLevels(self, contours=defaultContours, P=None, half_edge=True):
+        """
+        Get contour levels. The sorted bins are cached, so calling again for different contours is fast.
+
+        :param contours: list of confidence limits to get (default [0.68, 0.95])
+        :param P: optional other values on the occupied bins to use (e.g. profile likelihoods), not cached
+        :param half_edge: If True, edge bins are only half integrated over in each direction.
+        :return: list of contour levels
+        """
+        cache = P is None and half_edge
+        if cache and self._sorted_bins is not None:
+            return self._sorted_bins.getContourLevels(contours)
+        values = self.P if P is None else P
+        weights = self.edge_weights() if half_edge else np.ones(values.shape)
+        if self.indices.size < np.prod(self.shape):
+            # include one empty bin, as for a dense grid
+            values = np.concatenate(([0.], values))
+            weights = np.concatenate(([1.], weights))
+        sorted_bins = SortedBins(values, edge_weights=weights)
+        if cache: self._sorted_bins = sorted_bins
+        return sorted_bins.getContourLevels(contours)
+
+    def dense(self, index_ranges=None, P=None):
+        """
+        Get a dense grid for the whole density or a sub-box of it.
+
+        :param index_ranges: optional list of (min, max) bin index ranges (inclusive) for each parameter x_0, x_1..
+                             (None for the whole range of a given parameter)
+        :param P: optional other values on the occupied bins to put on the grid (e.g. density.likes)
+        :return: :class:`DensityND` instance
+        """
+        if index_ranges is None: index_ranges = [None] * self.dim
+        index_ranges = [(0, x.size - 1) if r is None else r for r, x in zip(index_ranges, self.xs)]
+        ixs = self.binIndices()
+        mask = np.ones(self.indices.shape, dtype=bool)
+        for ix, (imin, imax) in zip(ixs, index_ranges):
+            mask &= (ix >= imin) & (ix <= imax)
+        shape = tuple(imax - imin + 1 for imin, imax in index_ranges[::-1])
+        grid = np.zeros(shape)
+        grid[tuple(ix[mask] - imin for ix, (imin, _) in zip(ixs[::-1], index_ranges[::-1]))] = \
+            (self.P if P is None else P)[mask]
+        xs = [x[imin:imax + 1] for x, (imin, imax) in zip(self.xs, index_ranges)]
+        return DensityND(xs, grid, view_ranges=self.view_ranges)
+
+    def Prob(self, xs):
+        """
+        Evaluate density at points xs as the value of the bin containing each point (no interpolation)
+
+        :param xs: array of points, shape (npoints, ndim), or single point
+        :return: density values
+        """
+        pts = np.atleast_2d(xs)
+        flat = np.zeros(pts.shape[0], dtype=self.indices.dtype)
+        inside = np.ones(pts.shape[0], dtype=bool)
+        stride = 1
+        for i, x in enumerate(self.xs):
+            ix = np.rint((pts[:, i] - x[0]) / (x[1] - x[0])).astype(int)
+            inside &= (ix >= 0) & (ix < x.size)
+            flat += ix * stride
+            stride *= x.size
+        pos = np.minimum(np.searchsorted(self.indices, flat), max(self.indices.size - 1, 0))
+        found = inside & (self.indices[pos] == flat)
+        return np.where(found, self.P[pos], 0.)
@@ -11,7 +11,7 @@ import numpy as np
 from scipy.stats import norm
 import getdist
 from getdist import chains, types, covmat, ParamInfo, IniFile, ParamNames
-from getdist.densities import Density1D, Density2D, DensityND
+from getdist.densities import Density1D, Density2D, DensityND, SparseDensityND
 from getdist.densities import getContourLevels as getOtherContourLevels
 from getdist.chains import Chains, chainFiles, lastModified
 from getdist.convolve import convolve1D, convolve2D
@@ -85,6 +85,8 @@ def loadMCSamples(file_root, ini=None, jobItem=None, no_cache=False, settings={}
                 changed = len(samples.contours) != len(cache.contours) or \
                           np.any(np.array(samples.contours) != np.array(cache.contours))
                 cache.updateSettings(ini=ini, settings=settings, doUpdate=changed)
+                cache.cache_file = cachefile
+                cache._rows_loaded = True
                 return cache
         except Exception as e:
             pass
@@ -92,6 +94,9 @@ def loadMCSamples(file_root, ini=None, jobItem=None, no_cache=False, settings={}
         raise IOError('No chains found: ' + file_root)
     samples.readChains(files)
     samples.savePickle(cachefile)
+    if not no_cache:
+        samples.cache_file = cachefile
+        samples._rows_loaded = True
     return samples
 
 
@@ -1835,12 +1840,12 @@ class MCSamples(Chains):
         for i in range(ndim):
             if vrap[i].has_limits_bot:
                 mskSlices[i] = 0
-                prior_mask[mskSlices] /= 2
+                prior_mask[tuple(mskSlices)] /= 2
                 mskSlices[i] = slice(None)
 
             if vrap[i].has_limits_top:
                 mskSlices[i] = mskShape[i] - 1
-                prior_mask[mskSlices] /= 2
+                prior_mask[tuple(mskSlices)] /= 2
                 mskSlices[i] = slice(None)
 
     def _flattenValues(self, ixs, xsizes):
@@ -1860,13 +1865,13 @@ class MCSamples(Chains):
             ixs[0] = q
             return ixs
 
-        ixs[ndim - 1] = q / np.prod(xsizes[0:ndim - 1])
+        ixs[ndim - 1] = q // np.prod(xsizes[0:ndim - 1])
 
         acc = 0
         for k in range(ndim - 2, -1, -1):
             acc = acc + ixs[k + 1] * np.prod(xsizes[0:k + 1])
             if k > 0:
-                ixs[k] = (q - acc) / np.prod(xsizes[0:k])
+                ixs[k] = (q - acc) // np.prod(xsizes[0:k])
             else:
                 ixs[k] = q - acc
 
@@ -1893,8 +1898,9 @@ class MCSamples(Chains):
 
         :param xs: indices or names of x_i parameters
         :param kwargs: keyword arguments for the :meth:`~.mcsamples.MCSamples.getRawNDDensityGridData` function
+                       (e.g. sparse=True to return a :class:`~.densities.SparseDensityND`)
         :param normalized: if False, is normalized so the maximum is 1, if True, density is normalized
-        :return: :class:`~.densities.DensityND` instance
+        :return: :class:`~.densities.DensityND` (or :class:`~.densities.SparseDensityND`) instance
         """
         if self.needs_update: self.updateBaseStatistics()
         density = self.getRawNDDensityGridData(xs, get_density=True, **kwargs)
@@ -1904,7 +1910,7 @@ class MCSamples(Chains):
 
     def getRawNDDensityGridData(self, js, writeDataToFile=False,
                                 num_plot_contours=None, get_density=False,
-                                meanlikes=False, maxlikes=False, **kwargs):
+                                meanlikes=False, maxlikes=False, sparse=False, **kwargs):
         """
         Low-level function to get unsmooth ND plot marginalized
         density and optional additional plot data.
@@ -1915,9 +1921,12 @@ class MCSamples(Chains):
         :param get_density: only get the ND marginalized density, no additional plot data, no contours.
         :param meanlikes: calculate mean likelihoods as well as marginalized density (returned as array in density.likes)
         :param maxlikes: calculate the profile likelihoods in addition to the others (returned as array in density.maxlikes)
+        :param sparse: if True, only store the occupied bins, returning a :class:`~.densities.SparseDensityND`
+                       (with likes and maxlikes arrays for the occupied bins). Use this for higher dimensions,
+                       where a dense num_bins_ND ** ndim grid would be mostly empty.
         :param kwargs: optional settings to override instance settings of the same name (see `analysis_settings`):
 
-        :return: a :class:`~.densities.DensityND` instance
+        :return: a :class:`~.densities.DensityND` or :class:`~.densities.SparseDensityND` instance
         """
 
         if self.needs_update: self.updateBaseStatistics()
@@ -1938,38 +1947,50 @@ class MCSamples(Chains):
                                                            parv[i], nbinsND) for i in range(ndim)])
 
         # could also be non-equals over the dimensions
-        xsizev = nbinsND * np.ones(ndim, dtype=np.int)
-
-        binsND, flatixv = self._makeNDhist(ixv, xsizev)
+        xsizev = nbinsND * np.ones(ndim, dtype=int)
+
+        if sparse:
+            flatixv = self._flattenValues(ixv, xsizev)
+            occupied, flatixv = np.unique(flatixv, return_inverse=True)
+            nbins = occupied.size
+            binsND = np.bincount(flatixv, weights=self.weights, minlength=nbins)
+            if has_prior and boundary_correction_order >= 0:
+                # Correct for edge effects
+                occupied_ix = np.unravel_index(occupied, xsizev[::-1])[::-1]
+                for ix, par, size in zip(occupied_ix, parv, xsizev):
+                    if par.has_limits_bot: binsND[ix == 0] *= 2
+                    if par.has_limits_top: binsND[ix == size - 1] *= 2
+        else:
+            binsND, flatixv = self._makeNDhist(ixv, xsizev)
+            nbins = np.prod(xsizev)
 
-        if has_prior and boundary_correction_order >= 0:
-            # Correct for edge effects
-            prior_mask = np.ones(xsizev[::-1])
-            self._setRawEdgeMaskND(parv, prior_mask)
-            binsND /= prior_mask
+            if has_prior and boundary_correction_order >= 0:
+                # Correct for edge effects
+                prior_mask = np.ones(xsizev[::-1])
+                self._setRawEdgeMaskND(parv, prior_mask)
+                binsND /= prior_mask
 
         if meanlikes:
             likeweights = self.weights * np.exp(self.mean_loglike - self.loglikes)
-            binNDlikes = np.bincount(flatixv, weights=likeweights,
-                                     minlength=np.prod(xsizev)).reshape(xsizev[::-1], order='C')
+            binNDlikes = np.bincount(flatixv, weights=likeweights, minlength=nbins).reshape(binsND.shape, order='C')
         else:
             binNDlikes = None
 
         if maxlikes:
-            binNDmaxlikes = np.zeros(binsND.shape)
-            ndindex = zip(*[ixv[i] for i in range(ndim)[::-1]])
+            binNDmaxlikes = np.zeros(nbins)
             bestfit = np.max(-self.loglikes)
-
-            for irec in range(len(self.loglikes)):
-                binNDmaxlikes[ndindex[irec]] = max(binNDmaxlikes[ndindex[irec]],
-                                                   np.exp(-bestfit - self.loglikes[irec]))
+            np.maximum.at(binNDmaxlikes, flatixv, np.exp(-bestfit - self.loglikes))
+            binNDmaxlikes = binNDmaxlikes.reshape(binsND.shape, order='C')
         else:
             binNDmaxlikes = None
 
         xv = [np.linspace(xminv[i], xmaxv[i], xsizev[i]) for i in range(ndim)]
         views = [(parv[i].range_min, parv[i].range_max) for i in range(ndim)]
 
-        density = DensityND(xv, binsND, view_ranges=views)
+        if sparse:
+            density = SparseDensityND(xv, occupied, binsND, view_ranges=views)
+        else:
+            density = DensityND(xv, binsND, view_ranges=views)
 
         # density.normalize('integral', in_place=True)
         density.normalize('max', in_place=True)
@@ -1990,21 +2011,25 @@ class MCSamples(Chains):
 
         if maxlikes:
             density.maxlikes = binNDmaxlikes
-            density.maxcontours = getOtherContourLevels(binNDmaxlikes, contours, half_edge=False)
+            if sparse:
+                density.maxcontours = density.getContourLevels(contours, P=binNDmaxlikes, half_edge=False)
+            else:
+                density.maxcontours = getOtherContourLevels(binNDmaxlikes, contours, half_edge=False)
         else:
             density.maxlikes = None
 
         if writeDataToFile:
             # note store things in confusing transpose form
+            # sparse densities only write out the occupied bins
 
             postfile = self.rootname + "_posterior" + "_%sD.dat" % ndim
             contfile = self.rootname + "_posterior" + "_%sD_cont.dat" % ndim
 
-            allND = [np.array(binsND) for _ in range(ndim + 1)]
-            allND[0] = np.ravel(binsND, order='C')
-            for i in range(ndim):
-                # [index[::-1] for column-major order
-                allND[i + 1] = [xv[i][index[::-1][i]] for index in np.ndindex(binsND.shape)]
+            if sparse:
+                bin_ix = density.binIndices()
+            else:
+                bin_ix = np.unravel_index(np.arange(binsND.size), binsND.shape)[::-1]
+            allND = [np.ravel(density.P, order='C')] + [xv[i][bin_ix[i]] for i in range(ndim)]
 
             filename = os.path.join(self.plot_data_dir, postfile)
             np.savetxt(filename, np.transpose(allND), "%16.7E")
@@ -2335,6 +2360,68 @@ class MCSamples(Chains):
             self.ranges.setRange(name, range)
         return super(MCSamples, self).addDerived(paramVec, name, label=label, comment=comment)
 
+    def addDerivedParams(self, derived, chunk_size=100000, procs=1, save_cache=True):
+        """
+        Adds a set of new derived parameters, evaluated in chunks of samples and optionally in parallel,
+        growing the samples array only once. See :meth:`~.chains.Chains.addDerivedParams`.
+        Dictionary or tuple definitions can also specify a range (tuple of min, max values).
+
+        If the samples were loaded with :func:`loadMCSamples` and the samples and weights have not been changed
+        since (e.g. by filtering or reweighting), the new parameters are added to the cache file, so that loading
+        the samples again restores them without re-evaluating (parameters that already exist with the same
+        definition are skipped). Only the new columns are saved, not any other changes made in memory.
+
+        :param derived: dictionary of name: definition, or list of (name, definition[, label[, comment[, range]]])
+                        tuples or of dictionaries with keys name, definition and optionally label, comment, range
+        :param chunk_size: number of samples to evaluate at once
+        :param procs: number of processes to use
+        :param save_cache: whether to update the cache file with the new parameters
+        :return: list of the added parameters' :class:`~.paramnames.ParamInfo` objects
+        """
+        specs = chains._derivedSpecs(derived)
+        rows_loaded = getattr(self, '_rows_loaded', False)
+        added = super(MCSamples, self).addDerivedParams(specs, chunk_size=chunk_size, procs=procs)
+        # adding columns does not change the rows
+        self._rows_loaded = rows_loaded
+        if added:
+            ranges = dict((spec['name'], spec.get('range')) for spec in specs)
+            for par in added:
+                if ranges[par.name] is not None: self.ranges.setRange(par.name, ranges[par.name])
+            if save_cache and rows_loaded and getattr(self, 'cache_file', None):
+                self._saveDerivedToCache(added, ranges)
+        return added
+
+    def _saveDerivedToCache(self, added, ranges):
+        # add new derived columns to the samples in the cache file (as loaded from disk), so that no other changes
+        # made to this instance are saved
+        try:
+            with open(self.cache_file, 'rb') as inp:
+                cache = pickle.load(inp)
+        except Exception:
+            return
+        if cache.numrows != self.numrows: return
+        added = [par for par in added if not cache.paramNames.parWithName(par.name)]
+        if not added: return
+        cache.changeSamples(np.hstack([cache.samples] + [self.samples[:, self.paramNames.numberOfName(par.name),
+                                                          np.newaxis] for par in added]))
+        definitions = getattr(cache, 'derived_definitions', None)
+        if definitions is None: definitions = cache.derived_definitions = dict()
+        for par in added:
+            cache.paramNames.addDerived(par.name, label=par.label, comment=par.comment)
+            definitions[par.name] = self.derived_definitions[par.name]
+            if ranges[par.name] is not None: cache.ranges.setRange(par.name, ranges[par.name])
+        try:
+            cache.savePickle(self.cache_file)
+        except (IOError, OSError):
+            pass
+
+    def __getstate__(self):
+        # the cache file belongs to the loaded instance, not to copies or pickles
+        state = self.__dict__.copy()
+        state.pop('cache_file', None)
+        state.pop('_rows_loaded', None)
+        return state
+
     def getParamBestFitDict(self):
         """
         Gets a dictionary of parameter values for the best fit point, assuming .minimum best fit file exists
@@ -18,6 +18,7 @@ from getdist.paramnames import escapeLatex, makeList, mergeRenames
 from getdist.parampriors import ParamBounds
 from getdist.densities import Density1D, Density2D
 from getdist.gaussian_mixtures import MixtureND
+from getdist.analysis_server import MCSampleAnalysisClient
 import logging
 
 """Plotting scripts for GetDist outputs"""
@@ -561,8 +562,16 @@ class MCSampleAnalysis(object):
         density = rootdata.get(key)
         if not density:
             samples = self.samplesForRoot(root)
-            density = samples.get2DDensityGridData(param1.name, param2.name, num_plot_contours=conts, meanlikes=likes)
-            if density is None: return None
+            for (name1, name2, has_likes, _), cached in rootdata.items():
+                if (name1, name2, has_likes) == key[:3]:
+                    # same density for different number of contours; levels are fast from cached sorted bins
+                    density = copy.copy(cached)
+                    density.contours = density.getContourLevels(samples.contours[:conts])
+                    break
+            else:
+                density = samples.get2DDensityGridData(param1.name, param2.name, num_plot_contours=conts,
+                                                       meanlikes=likes)
+                if density is None: return None
             rootdata[key] = density
         return density
 
@@ -617,13 +626,17 @@ class GetDistPlotter(object):
          and derived data from a given root name tag (e.g. sampleAnalyser.samplesForRoot('rootname'))
     """
 
-    def __init__(self, plot_data=None, chain_dir=None, settings=None, analysis_settings=None, mcsamples=True):
+    def __init__(self, plot_data=None, chain_dir=None, settings=None, analysis_settings=None, mcsamples=True,
+                 analysis_server=False):
         """
 
         :param plot_data: (deprecated) directory name if you have pre-computed plot_data/ directory from GetDist; None by default
         :param chain_dir: Set this to a directory or grid root to search for chains (can also be a list of such, searched in order)
         :param analysis_settings: The settings to be used by :class:`MCSampleAnalysis` when analysing samples
         :param mcsamples: if True defaults to current method of using :class:`MCSampleAnalysis` instance to analyse chains on demand
+        :param analysis_server: if True (or a socket file name), analyse samples in a persistent local
+                                :class:`~.analysis_server.AnalysisServer` process (started if not already running),
+                                so that loaded chains and densities are shared between scripts
         """
         self.chain_dir = chain_dir
         if settings is None:
@@ -635,7 +648,10 @@ class GetDistPlotter(object):
             self.plot_data = [plot_data]
         else:
             self.plot_data = plot_data
-        if chain_dir is not None or mcsamples and plot_data is None:
+        if analysis_server and plot_data is None:
+            address = analysis_server if isinstance(analysis_server, six.string_types) else None
+            self.sampleAnalyser = MCSampleAnalysisClient(chain_dir, analysis_settings, address=address)
+        elif chain_dir is not None or mcsamples and plot_data is None:
             self.sampleAnalyser = MCSampleAnalysis(chain_dir, analysis_settings)
         else:
             self.sampleAnalyser = SampleAnalysisGetDist(self.plot_data)
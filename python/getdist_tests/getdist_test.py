@@ -7,6 +7,7 @@ import numpy as np
 import unittest
 import subprocess
 import shutil
+import copy
 from getdist import loadMCSamples, plots, IniFile
 from getdist_tests.test_distributions import Test2DDistributions, Gaussian1D, Gaussian2D
 from getdist.mcsamples import MCSamples
@@ -50,6 +51,31 @@ class GetDistFileTest(unittest.TestCase):
         g.settings.num_plot_contours = 3
         g.plot_2d('testchain', ['x', 'y'])
 
+    def testDerivedParams(self):
+        samples = loadMCSamples(self.root, settings={'ignore_rows': 0.1})
+        p = samples.getParams()
+        derived = [('xy', 'x*y', 'xy'), ('r', lambda q: np.sqrt(q.x ** 2 + q.xy ** 2), 'r')]
+        added = samples.addDerivedParams(derived, chunk_size=5000, procs=2)
+        self.assertEqual([par.name for par in added], ['xy', 'r'])
+        self.assertTrue(np.allclose(samples.getParams().r, np.sqrt(p.x ** 2 + (p.x * p.y) ** 2)))
+        samples = loadMCSamples(self.root, settings={'ignore_rows': 0.1})
+        self.assertTrue(np.allclose(samples.getParams().xy, p.x * p.y), 'Derived parameters not cached')
+        self.assertEqual(samples.addDerivedParams({'xy': 'x*y'}), [])
+        with self.assertRaises(ValueError):
+            samples.addDerivedParams({'xy': 'x+y'})
+
+        # changes to the rows in memory must not be saved to the cache, or saved from a copy
+        samples.filter(samples.getParams().x > 1)
+        samples.addDerivedParams({'x2': 'x**2'})
+        copied = copy.deepcopy(samples)
+        self.assertIsNone(getattr(copied, 'cache_file', None))
+        copied.addDerivedParams({'x3': 'x**3'})
+        reloaded = loadMCSamples(self.root, settings={'ignore_rows': 0.1})
+        self.assertEqual(reloaded.numrows, len(p.x))
+        self.assertIsNone(reloaded.paramNames.parWithName('x2'))
+        self.assertIsNone(reloaded.paramNames.parWithName('x3'))
+        self.assertAlmostEqual(reloaded.mean('x'), np.average(p.x, weights=reloaded.weights))
+
     def testGetDist(self):
 
         def callGetDist(args):
@@ -154,6 +180,37 @@ class GetDistTest(unittest.TestCase):
         d2 = samps.get2DDensity('x', 'y')
         self.assertTrue(np.allclose(d.P, d2.P[::-1, ::], atol=1e-5))
 
+    def testContourLevels(self):
+        from getdist.densities import SortedBins, getContourLevels
+
+        x = np.linspace(-5, 5, 20)
+        bins = np.exp(-np.sum(np.array(np.meshgrid(x, x, x, x, indexing='ij')) ** 2, axis=0) / 2)
+        full = SortedBins(bins)
+        full.partition_min_size = bins.size + 1
+        partial = SortedBins(bins)
+        partial.partition_min_size = 1
+        levels = full.getContourLevels([0.68, 0.95, 0.99])
+        self.assertTrue(np.allclose(levels[:2], partial.getContourLevels([0.68, 0.95])))
+        self.assertTrue(partial.num_sorted < bins.size)
+        self.assertTrue(np.allclose(levels[2:], partial.getContourLevels([0.99])))
+        self.assertTrue(np.allclose(levels, getContourLevels(bins, [0.68, 0.95, 0.99])))
+
+    def testSparseND(self):
+        from getdist.gaussian_mixtures import GaussianND
+
+        samples = GaussianND([0, 1, 2], np.diagflat([1, 2, 0.5]), names=['x', 'y', 'z'],
+                             lims=[[0, None], [None, None], [None, None]]).MCSamples(20000, logLikes=True)
+        dense = samples.getRawNDDensityGridData(['x', 'y', 'z'], maxlikes=True, meanlikes=True, num_bins_ND=12)
+        sparse = samples.getRawNDDensityGridData(['x', 'y', 'z'], maxlikes=True, meanlikes=True, num_bins_ND=12,
+                                                 sparse=True)
+        self.assertTrue(sparse.P.size < dense.P.size)
+        self.assertTrue(np.allclose(dense.P, sparse.dense().P))
+        self.assertTrue(np.allclose(dense.contours, sparse.contours))
+        self.assertTrue(np.allclose(dense.maxcontours, sparse.maxcontours))
+        ix = sparse.binIndices()
+        self.assertTrue(np.allclose(dense.likes[tuple(ix[::-1])], sparse.likes))
+        self.assertAlmostEqual(dense.norm_integral(), sparse.norm_integral())
+
     def testLoads(self):
         # test initiating from multiple chain arrays
         samps = []
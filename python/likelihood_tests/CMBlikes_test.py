@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import CMBlikes
+
+
+class ForegroundLikelihood(CMBlikes.DatasetLikelihood):
+    def add_foregrounds(self, cls, data_params):
+        amp = np.asarray(data_params.get('A_fg', 0))[..., np.newaxis]
+        ells = np.arange(self.pcl_lmin, self.pcl_lmax + 1)
+        for i in range(self.nmaps_required):
+            for j in range(i + 1):
+                if cls[i, j].theory_ij[0] == cls[i, j].theory_ij[1]:
+                    cls[i, j].CL += amp * (ells / 100.) ** 2
+
+
+class BatchLikelihoodTest(unittest.TestCase):
+    """test chi_squared_batch gives the same answer as chi_squared for each model"""
+
+    cols = ['TT', 'TE', 'EE']
+
+    def setUp(self):
+        np.random.seed(10)
+        self.tempdir = tempfile.mkdtemp()
+        self.lmin, self.lmax = 2, 200
+        self.ls = np.arange(self.lmax + 1)
+        self.fiducial = self.theory_cls(1.)
+        fid = self.fiducial[:, self.lmin:]
+        noise = np.array([np.full(fid.shape[1], 50.), np.zeros(fid.shape[1]), np.full(fid.shape[1], 0.5)])
+        self.write_cls('noise_unbinned.dat', self.ls[self.lmin:], noise)
+        self.write_cls('hat_unbinned.dat', self.ls[self.lmin:], fid * (1 + 0.05 * np.random.randn(*fid.shape)))
+
+        # binned data, with top-hat bin windows
+        nbins = 10
+        edges = np.linspace(10, self.lmax, nbins + 1).astype(int)
+        binned = np.empty((3, nbins))
+        for b in range(nbins):
+            window = np.zeros(self.lmax - self.lmin + 1)
+            window[edges[b] - self.lmin:edges[b + 1] - self.lmin] = 1. / (edges[b + 1] - edges[b])
+            binned[:, b] = fid.dot(window)
+            np.savetxt(os.path.join(self.tempdir, 'window%u.dat' % (b + 1)),
+                       np.hstack((self.ls[self.lmin:, np.newaxis], np.tile(window[:, np.newaxis], 3))))
+        bin_ls = np.arange(1, nbins + 1)
+        bin_noise = np.array([np.full(nbins, 5.), np.zeros(nbins), np.full(nbins, 0.05)])
+        self.write_cls('fiducial.dat', bin_ls, binned)
+        self.write_cls('noise.dat', bin_ls, bin_noise)
+        self.write_cls('hat.dat', bin_ls, binned * (1 + 0.05 * np.random.randn(*binned.shape)))
+        sigma = (binned + bin_noise) * 0.1
+        sigma[1] = np.sqrt(binned[0] * binned[2]) * 0.1
+        np.savetxt(os.path.join(self.tempdir, 'covmat.dat'), np.diag(sigma.T.reshape(-1) ** 2))
+        with open(os.path.join(self.tempdir, 'calibration.paramnames'), 'w') as f:
+            f.write('calPlanck    y_{\\rm cal}\n')
+
+        self.write_dataset('binned.dataset', """binned = T
+nbins = %u
+cl_lmin = %u
+cl_lmax = %u
+fields_use = T E
+cl_hat_file = hat.dat
+cl_fiducial_file = fiducial.dat
+cl_noise_file = noise.dat
+covmat_cl = TT TE EE
+covmat_fiducial = covmat.dat
+bin_window_files = window%%u.dat
+bin_window_in_order = TT TE EE
+calibration_param = calibration.paramnames
+aberration_coeff = -0.0013
+""" % (nbins, self.lmin, self.lmax))
+        self.write_dataset('exact.dataset', """like_approx = exact
+binned = F
+cl_lmin = %u
+cl_lmax = %u
+use_min = 10
+fields_use = T E
+cl_hat_file = hat_unbinned.dat
+cl_noise_file = noise_unbinned.dat
+fullsky_exact_fksy = 0.7
+calibration_param = calibration.paramnames
+aberration_coeff = -0.0013
+""" % (self.lmin, self.lmax))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_cls(self, fname, ls, cls):
+        np.savetxt(os.path.join(self.tempdir, fname), np.hstack((ls[:, np.newaxis], cls.T)),
+                   header='L ' + ' '.join(self.cols))
+
+    def write_dataset(self, fname, text):
+        with open(os.path.join(self.tempdir, fname), 'w') as f:
+            f.write(text)
+
+    def theory_cls(self, scale):
+        # rough TT, TE, EE spectra (as L(L+1)C_L/2pi)
+        ls = np.maximum(self.ls, 2)
+        cls = np.array([6000 * (ls / 200.) ** 0.5 * np.exp(-(ls / 500.) ** 2),
+                        -30 * np.sin(ls / 50.),
+                        0.5 + ls / 20.]) * scale
+        cls[:, :2] = 0
+        return cls
+
+    def ClsArray(self, cls):
+        ClArray = CMBlikes.ClsArray()
+        ClArray.cls_array[0, 0] = cls[0]
+        ClArray.cls_array[1, 0] = cls[1]
+        ClArray.cls_array[1, 1] = cls[2]
+        return ClArray
+
+    def assertBatchMatches(self, like, data_params):
+        scales = [1, 1.1, 0.9]
+        stack = np.array([self.theory_cls(scale) for scale in scales])
+        batch = like.chi_squared_batch(stack, cols=self.cols, data_params=data_params)
+        self.assertEqual(batch.shape, (len(scales),))
+        for m in range(len(scales)):
+            params = dict((key, np.broadcast_to(value, (len(scales),))[m]) for key, value in data_params.items())
+            chisq = like.chi_squared(self.ClsArray(stack[m]), params)
+            self.assertAlmostEqual(batch[m] / chisq, 1, 10)
+
+    def testBatchChiSquared(self):
+        params = {'calPlanck': np.array([1, 1.01, 0.995])}
+        for like_approx in ['HL', 'gaussian']:
+            like = CMBlikes.DatasetLikelihood(os.path.join(self.tempdir, 'binned.dataset'),
+                                              dataset_params={'like_approx': like_approx}, use_cache=False)
+            self.assertBatchMatches(like, params)
+            self.assertBatchMatches(like, {'calPlanck': 1.002})
+        like = CMBlikes.DatasetLikelihood(os.path.join(self.tempdir, 'exact.dataset'), use_cache=False)
+        self.assertBatchMatches(like, params)
+
+    def testBatchForegrounds(self):
+        like = ForegroundLikelihood(os.path.join(self.tempdir, 'binned.dataset'),
+                                    dataset_params={'like_approx': 'HL'}, use_cache=False)
+        self.assertBatchMatches(like, {'calPlanck': 1.01, 'A_fg': np.array([0, 10, 20])})
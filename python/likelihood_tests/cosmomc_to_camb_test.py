@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from getdist.mcsamples import MCSamples
+
+# minimal stand-in for the camb package, so add_camb_derived can be tested without CAMB
+stub_camb = """
+from . import model, initialpower
+
+
+class InitialPower(object):
+    def set_params(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class CAMBparams(object):
+    def __init__(self):
+        self.InitPower = InitialPower()
+
+    def set_cosmology(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def set_dark_energy(self, w=-1):
+        self.w = w
+
+    def set_for_lmax(self, lmax, lens_potential_accuracy=0):
+        pass
+
+    def set_matter_power(self, redshifts, kmax):
+        self.redshifts = redshifts
+
+
+class CAMBdata(object):
+    def __init__(self, pars):
+        self.pars = pars
+
+    def comoving_radial_distance(self, z):
+        return 3e5 * z / self.pars.H0
+
+    def angular_diameter_distance(self, z):
+        return self.comoving_radial_distance(z) / (1 + z)
+
+    def hubble_parameter(self, z):
+        return self.pars.H0 * (1 + z)
+
+    def get_sigma8(self):
+        return np.array([0.5, 10 * self.pars.omch2])
+
+    def get_fsigma8(self):
+        return np.array([0.45, 0.4])
+
+
+def get_background(pars):
+    return CAMBdata(pars)
+
+
+def get_results(pars):
+    return CAMBdata(pars)
+"""
+
+
+class constant_function(object):
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, results, p):
+        return self.value
+
+
+class CAMBDerivedTest(unittest.TestCase):
+    """test add_camb_derived and its checkpointing, using a stub camb module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cambdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(cls.cambdir, 'camb'))
+        with open(os.path.join(cls.cambdir, 'camb', '__init__.py'), 'w') as f:
+            f.write('import numpy as np\n' + stub_camb)
+        for module in ['model', 'initialpower']:
+            open(os.path.join(cls.cambdir, 'camb', module + '.py'), 'w').close()
+        sys.path.insert(0, cls.cambdir)
+        import cosmomc_to_camb
+        cls.module = cosmomc_to_camb
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(cls.cambdir)
+        for name in ['cosmomc_to_camb', 'camb', 'camb.model', 'camb.initialpower']:
+            sys.modules.pop(name, None)
+        shutil.rmtree(cls.cambdir)
+
+    def setUp(self):
+        np.random.seed(10)
+        self.tempdir = tempfile.mkdtemp()
+        n = 40
+        names = ['omegabh2', 'omegach2', 'tau', 'ns', 'A', 'H0']
+        means = [0.0224, 0.12, 0.06, 0.965, 2.1, 67.]
+        values = np.array(means) * (1 + 0.01 * np.random.randn(n, len(means)))
+        self.samples = MCSamples(samples=values, weights=np.random.randint(1, 4, n).astype(float), names=names,
+                                 settings={'ignore_rows': 0})
+        self.derived = self.module.distance_functions([0.5])
+        self.derived['sigma8'] = self.module.sigma8
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testDerived(self):
+        H0 = self.samples.getParams().H0.copy()
+        omch2 = self.samples.getParams().omegach2.copy()
+        for procs in [1, 2]:
+            samples = self.module.add_camb_derived(self.samples, self.derived, procs=procs,
+                                                   matter_power_redshifts=[0.5])
+            p = samples.getParams()
+            self.assertTrue(np.allclose(p.DM_z0p5, 1.5e5 / H0))
+            self.assertTrue(np.allclose(p.DA_z0p5, 1e5 / H0))
+            self.assertTrue(np.allclose(p.H_z0p5, 1.5 * H0))
+            self.assertTrue(np.allclose(p.sigma8, 10 * omch2))
+        # input samples are not changed
+        self.assertIsNone(self.samples.paramNames.parWithName('sigma8'))
+        self.assertEqual(self.samples.samples.shape, (40, 6))
+
+        thinned = self.module.add_camb_derived(self.samples, self.derived, thin=2, matter_power_redshifts=[0.5])
+        self.assertEqual(thinned.numrows, int(np.sum(self.samples.weights)) // 2)
+        self.assertTrue(np.all(thinned.weights == 1))
+        self.assertTrue(np.allclose(thinned.getParams().H_z0p5, 1.5 * thinned.getParams().H0))
+        self.assertEqual(self.samples.numrows, 40)
+
+        self.samples.weights[0] = 0.5
+        with self.assertRaises(ValueError):
+            self.module.add_camb_derived(self.samples, self.derived, thin=2)
+
+    def testCheckpoint(self):
+        checkpoint = os.path.join(self.tempdir, 'derived.checkpoint')
+        samples = self.module.add_camb_derived(self.samples, self.derived, checkpoint=checkpoint,
+                                               matter_power_redshifts=[0.5])
+        # simulate an interrupted run, ending with an incomplete line
+        with open(checkpoint) as f:
+            lines = f.readlines()
+        with open(checkpoint, 'w') as f:
+            f.writelines(lines[:-5])
+            f.write(lines[-5][:10])
+        # resuming only calculates the missing samples
+        marker = dict((name, constant_function(-1.)) for name in self.derived)
+        resumed = self.module.add_camb_derived(self.samples, marker, procs=2, checkpoint=checkpoint,
+                                               matter_power_redshifts=[0.5])
+        for name in self.derived:
+            old = samples.getParams().__dict__[name]
+            new = resumed.getParams().__dict__[name]
+            self.assertTrue(np.array_equal(new[:-5], old[:-5]))
+            self.assertTrue(np.all(new[-5:] == -1))
+        # resuming again after the incomplete line keeps all results
+        again = self.module.add_camb_derived(self.samples, dict((name, constant_function(-2.)) for name in marker),
+                                             checkpoint=checkpoint, matter_power_redshifts=[0.5])
+        self.assertTrue(np.array_equal(again.getParams().sigma8, resumed.getParams().sigma8))
+        # different samples start again
+        self.samples.samples[0, 0] *= 1.1
+        restarted = self.module.add_camb_derived(self.samples, marker, checkpoint=checkpoint,
+                                                 matter_power_redshifts=[0.5])
+        self.assertTrue(np.all(restarted.getParams().sigma8 == -1))
@@ -3,15 +3,18 @@ from __future__ import print_function
 from paramgrid import batchjob_args
 
 
-Opts = batchjob_args.batchArgs('List items in a grid', importance=True, converge=True, notExist=True)
+Opts = batchjob_args.batchArgs('List items in a grid', importance=True, converge=True, notExist=True,
+                               statusSnapshot=True)
 Opts.parser.add_argument('--exists', action='store_true', help='chain must exist')
 Opts.parser.add_argument('--normed', action='store_true', help='Output normed names')
 
 (batch, args) = Opts.parseForBatch()
 items = Opts.sortedParamtagDict(chainExist=args.exists)
+db = batch.resultsDB() if args.converge else None
 
 for paramtag, parambatch in items:
     for jobItem in parambatch:
+        if args.converge and not jobItem.hasConvergeBetterThan(args.converge, db=db): continue
         if hasattr(jobItem, 'group'):
             tag = '(%s)' % jobItem.group
         else:
@@ -17,11 +17,13 @@ Opts.parser.add_argument('--latex_filename', default=None)
 Opts.parser.add_argument('--mathColumns', action='store_true')
 Opts.parser.add_argument('--endline', default='\\cr')
 Opts.parser.add_argument('--paramNameFile', default='clik_latex.paramnames')
+Opts.parser.add_argument('--procs', type=int, default=1, help='number of processes to use for reading results')
 
 (batch, args) = Opts.parseForBatch()
 formatter = types.TableFormatter()
 
 names = paramnames.ParamNames(args.paramNameFile)
+db = batch.resultsDB()
 
 if args.chain_name_params is None: args.chain_name_params = args.params
 
@@ -32,22 +34,26 @@ paramtag_for_param = dict()
 for par in args.params:
     paramtag_for_param[par] = []
 
-for jobItem in Opts.filteredBatchItems():
-    if (args.compare is None or jobItem.matchesDatatag(args.compare)) and (not args.single_extparam or
-                                                                                       len(
-                                                                                               jobItem.param_set) == 1 and jobItem.hasParam(
-                                                                                       args.chain_name_params)):
-        jobItem.loadJobItemResults(paramNameFile=None, bestfit=not args.nobestfits, noconverge=True, silent=True)
-        if jobItem.result_marge is not None:
-            results = []
-            for par in args.params:
-                texValues = jobItem.result_marge.texValues(formatter, par, limit=args.limit)
-                if texValues is not None:
-                    if not jobItem.paramtag in table: table[jobItem.paramtag] = dict()
-                    dataTable = table[jobItem.paramtag]
-                    if not jobItem.paramtag in paramtag_for_param[par]: paramtag_for_param[par].append(jobItem.paramtag)
-                    if not jobItem.normed_data in dataTable: dataTable[jobItem.normed_data] = dict()
-                    dataTable[jobItem.normed_data][par] = texValues
+jobItems = [jobItem for jobItem in Opts.filteredBatchItems() if
+            (args.compare is None or jobItem.matchesDatatag(args.compare)) and
+            (not args.single_extparam or len(jobItem.param_set) == 1 and jobItem.hasParam(args.chain_name_params))]
+
+# read result files (in parallel) into the results database, so loading results is just a lookup
+db.update(jobItems, procs=args.procs)
+
+for jobItem in jobItems:
+    jobItem.loadJobItemResults(paramNameFile=None, bestfit=not args.nobestfits, noconverge=True, silent=True,
+                               db=db)
+    if jobItem.result_marge is not None:
+        results = []
+        for par in args.params:
+            texValues = jobItem.result_marge.texValues(formatter, par, limit=args.limit)
+            if texValues is not None:
+                if not jobItem.paramtag in table: table[jobItem.paramtag] = dict()
+                dataTable = table[jobItem.paramtag]
+                if not jobItem.paramtag in paramtag_for_param[par]: paramtag_for_param[par].append(jobItem.paramtag)
+                if not jobItem.normed_data in dataTable: dataTable[jobItem.normed_data] = dict()
+                dataTable[jobItem.normed_data][par] = texValues
 
 
 def makeMath(txt):
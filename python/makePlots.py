@@ -1,7 +1,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import os
-from paramgrid import batchjob_args
+from paramgrid import batchjob_args, plotpipeline
 
 
 Opts = batchjob_args.batchArgs('Make plots from getdist outputs', importance=True, converge=True, plots=True)
@@ -28,6 +28,8 @@ Opts.parser.add_argument('--tri_params', nargs='+', default=None, help='list of
 Opts.parser.add_argument('--legend_ncol', type=int, default=None, help='numnber of columns to draw legends')
 Opts.parser.add_argument('--allhave', action='store_true', help='only include plots where all combinations exist')
 Opts.parser.add_argument('--outtag', default=None, help='tag to add to output filenames to distinguish output')
+Opts.parser.add_argument('--procs', type=int, default=1,
+                         help='number of worker processes for rendering and exporting figures')
 
 (batch, args, g) = Opts.parseForBatch()
 
@@ -36,19 +38,19 @@ if not os.path.exists(outdir): os.makedirs(outdir)
 outdir = os.path.abspath(outdir) + os.sep
 
 
-def doplot(roots):
+def makeTask(roots, output):
     ncol = args.legend_ncol or (1, 2)[len(roots) > 2]
+    outputs = [outdir + output + tp + '.' + ext for ext in args.outputs]
     if args.D2_param is not None:
-        g.plots_2d(roots, args.D2_param, params2=args.D2_y_params, nx=args.nx, legend_labels=args.legend_labels,
-                   filled=args.filled, legend_ncol=ncol)
+        return plotpipeline.plotTask(output, roots, outputs, '2D', param1=args.D2_param, params2=args.D2_y_params,
+                                     nx=args.nx, legend_labels=args.legend_labels, filled=args.filled,
+                                     legend_ncol=ncol)
     elif args.tri_params is not None:
-        g.triangle_plot(roots, args.tri_params, legend_labels=args.legend_labels, filled_compare=args.filled)
+        return plotpipeline.plotTask(output, roots, outputs, 'tri', params=args.tri_params,
+                                     legend_labels=args.legend_labels, filled_compare=args.filled)
     else:
-        g.plots_1d(roots, paramList=args.paramList, nx=args.nx, legend_labels=args.legend_labels, legend_ncol=ncol)
-
-
-def comparePlot(jobItems):
-    doplot([jobItem.name for jobItem in jobItems])
+        return plotpipeline.plotTask(output, roots, outputs, '1D', paramList=args.paramList, nx=args.nx,
+                                     legend_labels=args.legend_labels, legend_ncol=ncol)
 
 
 tp = ''
@@ -64,9 +66,9 @@ if args.compare_replacing is not None:
         args.data += args.compare_replacing
 
 items = Opts.sortedParamtagDict()
+tasks = []
 
 for paramtag, parambatch in items:
-    g.newPlot()
     if args.compare_replacing is not None:
         print('comparing changes in data for: ' + paramtag)
         origCompare = [item for item in parambatch if args.compare_replacing[0] in item.data_set.names]
@@ -82,9 +84,8 @@ for paramtag, parambatch in items:
                 compares = Opts.filterForDataCompare(parambatch, compares)
                 if len(compares) == 1 or args.allhave and len(compares) != len(args.compare_replacing): continue
                 print('comparing: ', [i.name for i in compares])
-                comparePlot(compares)
-                for ext in args.outputs: g.export(
-                    outdir + jobItem.name + '-vs-' + "-".join(args.compare_replacing[1:]) + tp + '.' + ext)
+                tasks.append(makeTask([i.name for i in compares],
+                                      jobItem.name + '-vs-' + "-".join(args.compare_replacing[1:])))
     elif args.compare_data is not None or args.compare_alldata:
         print('comparing data combinations for: ' + paramtag)
         if args.compare_alldata:
@@ -98,8 +99,7 @@ for paramtag, parambatch in items:
             print('..not all, skipping')
             continue
         else:
-            comparePlot(compares)
-        for ext in args.outputs: g.export(outdir + paramtag + tp + '.' + ext)
+            tasks.append(makeTask([i.name for i in compares], paramtag))
     elif args.compare_importance is not None:
         for jobItem in parambatch:
             if not jobItem.isImportanceJob:
@@ -108,8 +108,7 @@ for paramtag, parambatch in items:
                 for imp in jobItem.importanceItems:
                     if len(args.compare_importance) == 0 or imp.importanceTag in args.compare_importance: roots.append(
                         imp.name)
-                doplot(roots)
-                for ext in args.outputs: g.export(outdir + jobItem.name + tp + '.' + ext)
+                tasks.append(makeTask(roots, jobItem.name))
     elif args.compare_paramtag is not None:
         for jobItem in parambatch:
             if not jobItem.paramtag in args.compare_paramtag:
@@ -119,13 +118,15 @@ for paramtag, parambatch in items:
                          args.compare_paramtag]
                 roots = [jobItem.name] + [root.name for root in roots if root is not None]
                 if len(roots) > 1:
-                    doplot(roots)
-                    for ext in args.outputs: g.export(outdir + output + tp + '.' + ext)
+                    tasks.append(makeTask(roots, output))
     else:
         for jobItem in parambatch:
             print('plotting: ' + jobItem.name)
-            doplot([jobItem.name])
-            for ext in args.outputs: g.export(outdir + jobItem.name + tp + '.' + ext)
-
-
-
+            tasks.append(makeTask([jobItem.name], jobItem.name))
+
+if args.plot_data is not None:
+    plotter_args = {'plot_data': args.plot_data}
+else:
+    plotter_args = {'chain_dir': batch.batchPath}
+plotter_args['size_inch'] = args.size_inch
+plotpipeline.runTasks(tasks, plotter_args, procs=args.procs, g=g)
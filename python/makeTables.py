@@ -5,9 +5,6 @@ import copy
 import planckStyle
 from paramgrid import batchjob, batchjob_args
 from getdist import types, paramnames
-from getdist.mcsamples import loadMCSamples, MCSamples
-from getdist.paramnames import ParamNames
-import numpy as np
 
 Opts = batchjob_args.batchArgs('Make pdf tables from latex generated from getdist outputs', importance=True,
                                converge=True)
@@ -57,8 +54,11 @@ Opts.parser.add_argument('--separate_tex', action='store_true')
 Opts.parser.add_argument('--header_tex', default=None)
 Opts.parser.add_argument('--height', default="13in")
 Opts.parser.add_argument('--width', default="12in")
+Opts.parser.add_argument('--procs', type=int, default=1,
+                         help="number of processes to use for reading results and making systematic averages")
 
 (batch, args) = Opts.parseForBatch()
+db = batch.resultsDB()
 
 if args.blockEndParams is not None: args.blockEndParams = args.blockEndParams.split(';')
 
@@ -88,16 +88,8 @@ def getTableLines(content, referenceDataJobItem=None):
 def getSystematicAverageTableLines(jobItem1, jobItem2):
     # if you have two versions of the likelihood with the same data, and don't know which is right,
     # this just crudely adds the samples with equal weight per likelihood
-    samps1 = loadMCSamples(jobItem1.chainRoot, jobItem=jobItem1, settings=batch.getdist_options)
-    samps2 = loadMCSamples(jobItem2.chainRoot, jobItem=jobItem2, settings=batch.getdist_options)
-    samps = samps1.getCombinedSamplesWithSamples(samps2)
-    if False:
-        import planckStyle as s
-        g = s.getSubplotPlotter()
-        g.plots_1d([samps, samps1, samps2], params=params.list(),
-                   legend_labels=['Combined', texEscapeText(jobItem1.name), texEscapeText(jobItem2.name)])
-        g.export('joint_' + jobItem1.name)
-    return getTableLines(samps.getMargeStats())
+    # marginalized statistics are cached in the results database, so chains are only re-loaded if changed
+    return getTableLines(db.combinedMargeStats(jobItem1, jobItem2, settings=batch.getdist_options))
 
 
 def paramResultTable(jobItem, deltaChisqJobItem=None, referenceDataJobItem=None):
@@ -109,7 +101,7 @@ def paramResultTable(jobItem, deltaChisqJobItem=None, referenceDataJobItem=None)
     tableLines = []
     caption = []
     jobItem.loadJobItemResults(paramNameFile=args.paramNameFile, bestfit=not args.nobestfit,
-                               bestfitonly=args.bestfitonly)
+                               bestfitonly=args.bestfitonly, db=db)
     bf = jobItem.result_bestfit
     if not bf is None:
         caption.append(' Best-fit $\\chi^2_{\\rm eff} = ' + ('%.2f' % (bf.logLike * 2)) + '$')
@@ -159,7 +151,7 @@ def paramResultTable(jobItem, deltaChisqJobItem=None, referenceDataJobItem=None)
 def compareTable(jobItems, titles=None):
     for jobItem in jobItems:
         jobItem.loadJobItemResults(paramNameFile=args.paramNameFile, bestfit=not args.nobestfit,
-                                   bestfitonly=args.bestfitonly)
+                                   bestfitonly=args.bestfitonly, db=db)
         print(jobItem.name)
     if titles is None:
         titles = [jobItem.datatag for jobItem in jobItems if jobItem.result_marge is not None]
@@ -175,6 +167,9 @@ if args.changes_replacing is not None:
 
 items = Opts.sortedParamtagDict(chainExist=not args.bestfitonly)
 
+# read all result files (in parallel) into the results database first, so later loads are just lookups
+db.update([jobItem for _, parambatch in items for jobItem in parambatch], procs=args.procs)
+
 if args.all_limits:
     limits = [1, 2, 3]
 else:
@@ -207,9 +202,96 @@ for paramtag, parambatch in items:
         if (args.delta_chisq_paramtag is None and
                 isBase and not args.no_delta_chisq or args.delta_chisq_paramtag is not None and jobItem.paramtag == args.delta_chisq_paramtag):
             referenceJobItem = copy.deepcopy(jobItem)
-            referenceJobItem.loadJobItemResults(paramNameFile=args.paramNameFile)
+            referenceJobItem.loadJobItemResults(paramNameFile=args.paramNameFile, db=db)
             baseJobItems[jobItem.normed_data] = referenceJobItem
 
+# collect the items (and reference items) for each section of the tables
+sections = []
+for paramtag, parambatch in items:
+    isBase = len(parambatch[0].param_set) == 0
+    if not args.forpaper:
+        if isBase:
+            paramText = 'Baseline model'
+        else:
+            paramText = texEscapeText("+".join(parambatch[0].param_set))
+        section = '\\newpage\\section{ ' + paramText + '}'
+    else:
+        section = ''
+    if args.compare is not None:
+        compares = Opts.filterForDataCompare(parambatch, args.compare)
+        if len(compares) == len(args.compare):
+            sections.append((section, compares, None))
+        else:
+            print('no matches for compare: ' + paramtag)
+    else:
+        theseItems = [jobItem for jobItem in parambatch
+                      if (os.path.exists(jobItem.distPath) or args.bestfitonly) and (
+                              args.converge == 0 or jobItem.hasConvergeBetterThan(args.converge, db=db))]
+
+        referenceDataJobItem = None
+        if args.changes_from_datatag is not None:
+            for jobItem in theseItems:
+                if jobItem.normed_data == args.changes_from_datatag or jobItem.datatag == args.changes_from_datatag:
+                    referenceDataJobItem = copy.deepcopy(jobItem)
+                    referenceDataJobItem.loadJobItemResults(paramNameFile=args.paramNameFile,
+                                                            bestfit=args.bestfitonly, db=db)
+        if args.changes_adding_data is not None:
+            baseJobItems = dict()
+            refItems = []
+            for jobItem in theseItems:
+                if jobItem.data_set.hasName(args.changes_adding_data):
+                    jobItem.normed_without = "_".join(
+                        sorted([x for x in jobItem.data_set.names if not x in args.changes_adding_data]))
+                    refItems.append(jobItem.normed_without)
+                else:
+                    jobItem.normed_without = None
+            for jobItem in theseItems:
+                if jobItem.normed_data in refItems:
+                    referenceJobItem = copy.deepcopy(jobItem)
+                    referenceJobItem.loadJobItemResults(paramNameFile=args.paramNameFile, bestfit=args.bestfitonly,
+                                                        db=db)
+                    baseJobItems[jobItem.normed_data] = referenceJobItem
+        if args.changes_replacing is not None:
+            origCompare = [item for item in theseItems if args.changes_replacing[0] in item.data_set.names]
+            baseJobItems = dict()
+            for jobItem in origCompare:
+                referenceJobItem = copy.deepcopy(jobItem)
+                referenceJobItem.loadJobItemResults(paramNameFile=args.paramNameFile, bestfit=args.bestfitonly,
+                                                    db=db)
+                baseJobItems[jobItem.normed_data] = referenceJobItem
+
+        tableItems = []
+        for jobItem in theseItems:
+            if args.changes_adding_data is not None:
+                if jobItem.normed_without is not None:
+                    referenceDataJobItem = baseJobItems.get(jobItem.normed_without, None)
+                else:
+                    referenceDataJobItem = None
+                referenceJobItem = referenceDataJobItem
+                if args.changes_only and not referenceDataJobItem: continue
+            elif args.changes_replacing is not None:
+                referenceDataJobItem = None
+                for replace in args.changes_replacing[1:]:
+                    if replace in jobItem.data_set.names:
+                        referenceDataJobItem = baseJobItems.get(
+                            batch.normalizeDataTag(
+                                jobItem.data_set.tagReplacing(replace, args.changes_replacing[0])), None)
+                        break
+                referenceJobItem = referenceDataJobItem
+                if args.changes_only and not referenceDataJobItem: continue
+            else:
+                referenceJobItem = baseJobItems.get(dataIndex(jobItem), None)
+            if args.changes_from_paramtag is not None:
+                referenceDataJobItem = referenceJobItem
+            if args.systematic_average and referenceDataJobItem is None: continue
+            tableItems.append((jobItem, referenceJobItem, referenceDataJobItem))
+        sections.append((section, None, tableItems))
+
+if args.systematic_average:
+    db.updateCombined([(jobItem, referenceDataJobItem) for _, _, tableItems in sections if tableItems
+                       for jobItem, _, referenceDataJobItem in tableItems], settings=batch.getdist_options,
+                      procs=args.procs)
+
 loc = os.path.split(args.latex_filename)[0]
 if loc: batchjob.makePath(loc)
 
@@ -235,95 +317,25 @@ for limit in limits:
 
     # set of baseline results, e.g. for Delta chi^2
 
-    for paramtag, parambatch in items:
-        isBase = len(parambatch[0].param_set) == 0
-        if not args.forpaper:
-            if isBase:
-                paramText = 'Baseline model'
-            else:
-                paramText = texEscapeText("+".join(parambatch[0].param_set))
-            section = '\\newpage\\section{ ' + paramText + '}'
-        else:
-            section = ''
-        if args.compare is not None:
-            compares = Opts.filterForDataCompare(parambatch, args.compare)
-            if len(compares) == len(args.compare):
-                lines.append(section)
-                lines += compareTable(compares, args.titles)
-            else:
-                print('no matches for compare: ' + paramtag)
-        else:
-            lines.append(section)
-            theseItems = [jobItem for jobItem in parambatch
-                          if (os.path.exists(jobItem.distPath) or args.bestfitonly) and (
-                                  args.converge == 0 or jobItem.hasConvergeBetterThan(args.converge))]
-
-            referenceDataJobItem = None
-            if args.changes_from_datatag is not None:
-                for jobItem in theseItems:
-                    if jobItem.normed_data == args.changes_from_datatag or jobItem.datatag == args.changes_from_datatag:
-                        referenceDataJobItem = copy.deepcopy(jobItem)
-                        referenceDataJobItem.loadJobItemResults(paramNameFile=args.paramNameFile,
-                                                                bestfit=args.bestfitonly)
-            if args.changes_adding_data is not None:
-                baseJobItems = dict()
-                refItems = []
-                for jobItem in theseItems:
-                    if jobItem.data_set.hasName(args.changes_adding_data):
-                        jobItem.normed_without = "_".join(
-                            sorted([x for x in jobItem.data_set.names if not x in args.changes_adding_data]))
-                        refItems.append(jobItem.normed_without)
-                    else:
-                        jobItem.normed_without = None
-                for jobItem in theseItems:
-                    if jobItem.normed_data in refItems:
-                        referenceJobItem = copy.deepcopy(jobItem)
-                        referenceJobItem.loadJobItemResults(paramNameFile=args.paramNameFile, bestfit=args.bestfitonly)
-                        baseJobItems[jobItem.normed_data] = referenceJobItem
-            if args.changes_replacing is not None:
-                origCompare = [item for item in theseItems if args.changes_replacing[0] in item.data_set.names]
-                baseJobItems = dict()
-                for jobItem in origCompare:
-                    referenceJobItem = copy.deepcopy(jobItem)
-                    referenceJobItem.loadJobItemResults(paramNameFile=args.paramNameFile, bestfit=args.bestfitonly)
-                    baseJobItems[jobItem.normed_data] = referenceJobItem
-
-            for jobItem in theseItems:
-                if args.changes_adding_data is not None:
-                    if jobItem.normed_without is not None:
-                        referenceDataJobItem = baseJobItems.get(jobItem.normed_without, None)
-                    else:
-                        referenceDataJobItem = None
-                    referenceJobItem = referenceDataJobItem
-                    if args.changes_only and not referenceDataJobItem: continue
-                elif args.changes_replacing is not None:
-                    referenceDataJobItem = None
-                    for replace in args.changes_replacing[1:]:
-                        if replace in jobItem.data_set.names:
-                            referenceDataJobItem = baseJobItems.get(
-                                batch.normalizeDataTag(
-                                    jobItem.data_set.tagReplacing(replace, args.changes_replacing[0])), None)
-                            break
-                    referenceJobItem = referenceDataJobItem
-                    if args.changes_only and not referenceDataJobItem: continue
+    for section, compares, tableItems in sections:
+        lines.append(section)
+        if compares is not None:
+            lines += compareTable(compares, args.titles)
+            continue
+        for jobItem, referenceJobItem, referenceDataJobItem in tableItems:
+            if not args.forpaper:
+                if args.systematic_average:
+                    lines.append('\\subsection{ ' + texEscapeText(jobItem.name) + '/' + texEscapeText(
+                        referenceDataJobItem.name) + '}')
                 else:
-                    referenceJobItem = baseJobItems.get(dataIndex(jobItem), None)
-                if args.changes_from_paramtag is not None:
-                    referenceDataJobItem = referenceJobItem
-                if args.systematic_average and referenceDataJobItem is None: continue
-                if not args.forpaper:
-                    if args.systematic_average:
-                        lines.append('\\subsection{ ' + texEscapeText(jobItem.name) + '/' + texEscapeText(
-                            referenceDataJobItem.name) + '}')
-                    else:
-                        lines.append('\\subsection{ ' + texEscapeText(jobItem.name) + '}')
-                try:
-                    tableLines = paramResultTable(jobItem, referenceJobItem, referenceDataJobItem)
-                    if args.separate_tex: types.TextFile(tableLines).write(jobItem.distRoot + '.tex')
-                    lines += tableLines
-                except Exception as e:
-                    print('ERROR: ' + jobItem.name)
-                    print("Index Error:" + str(e))
+                    lines.append('\\subsection{ ' + texEscapeText(jobItem.name) + '}')
+            try:
+                tableLines = paramResultTable(jobItem, referenceJobItem, referenceDataJobItem)
+                if args.separate_tex: types.TextFile(tableLines).write(jobItem.distRoot + '.tex')
+                lines += tableLines
+            except Exception as e:
+                print('ERROR: ' + jobItem.name)
+                print("Index Error:" + str(e))
 
     if not args.forpaper: lines.append('\\end{document}')
 
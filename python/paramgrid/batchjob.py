@@ -9,29 +9,43 @@ import time
 import six
 from getdist import types, IniFile
 from getdist.mcsamples import loadMCSamples
+from paramgrid import resultsdb, gridstatus
 
 
 def resetGrid(directory):
     fname = os.path.abspath(directory) + os.sep + 'batch.pyobj'
     if os.path.exists(fname): os.remove(fname)
+    from paramgrid import gridmanifest
 
+    gridmanifest.removeManifest(directory)
 
-def readobject(directory=None):
+
+def readobject(directory=None, useManifest=True):
     # load this here to prevent circular
-    from paramgrid import gridconfig
+    from paramgrid import gridconfig, gridmanifest
 
     if directory is None:
         directory = sys.argv[1]
+    config_dir = os.path.abspath(directory) + os.sep + 'config'
+    if os.path.exists(config_dir):
+        # set path in case using functions defined and hene imported from in settings file
+        sys.path.insert(0, config_dir)
+    if useManifest:
+        batch = gridmanifest.loadManifest(directory)
+        if batch is not None: return batch
+    batch = _readobject(directory, gridconfig)
+    if useManifest and batch is not None:
+        gridmanifest.writeManifest(batch, directory)
+    return batch
+
+
+def _readobject(directory, gridconfig):
     fname = os.path.abspath(directory) + os.sep + 'batch.pyobj'
     if not os.path.exists(fname):
         if gridconfig.pathIsGrid(directory):
             return gridconfig.makeGrid(directory, readOnly=True, interactive=False)
         return None
     try:
-        config_dir = os.path.abspath(directory) + os.sep + 'config'
-        if os.path.exists(config_dir):
-            # set path in case using functions defined and hene imported from in settings file
-            sys.path.insert(0, config_dir)
         with open(fname, 'rb') as inp:
             return pickle.load(inp)
     except Exception as e:
@@ -52,7 +66,8 @@ def makePath(s):
 
 
 def nonEmptyFile(fname):
-    return os.path.exists(fname) and os.path.getsize(fname) > 0
+    # uses the active gridstatus.gridStatus snapshot, if any
+    return gridstatus.nonEmptyFile(fname)
 
 
 def getCodeRootPath():
@@ -61,7 +76,7 @@ def getCodeRootPath():
 
 class propertiesItem(object):
     def propertiesIni(self):
-        if os.path.exists(self.propertiesIniFile()):
+        if gridstatus.fileExists(self.propertiesIniFile()):
             return IniFile(self.propertiesIniFile())
         else:
             ini = IniFile()
@@ -335,15 +350,15 @@ class jobItem(propertiesItem):
         return all([self.chainExists(i + 1) for i in range(num_chains)])
 
     def chainFileDate(self, chain=1):
-        return os.path.getmtime(self.chainName(chain))
+        return gridstatus.fileMtime(self.chainName(chain))
 
     def chainsDodgy(self, interval=600):
         dates = []
         i = 1
-        while os.path.exists(self.chainName(i)):
-            dates.append(os.path.getmtime(self.chainName(i)))
+        while gridstatus.fileExists(self.chainName(i)):
+            dates.append(gridstatus.fileMtime(self.chainName(i)))
             i += 1
-        return os.path.exists(self.chainName(i + 1)) or max(dates) - min(dates) > interval
+        return gridstatus.fileExists(self.chainName(i + 1)) or max(dates) - min(dates) > interval
 
     def notRunning(self):
         if not self.chainExists(): return False  # might be in queue
@@ -354,7 +369,9 @@ class jobItem(propertiesItem):
         fname = self.chainRoot + '.minimum'
         return nonEmptyFile(fname)
 
-    def chainBestfit(self, paramNameFile=None):
+    def chainBestfit(self, paramNameFile=None, db=None):
+        if db is not None:
+            return db.labelled(db.result(self, 'bestfit'), paramNameFile)
         bf_file = self.chainRoot + '.minimum'
         if nonEmptyFile(bf_file):
             return types.BestFit(bf_file, paramNameFile)
@@ -368,9 +385,7 @@ class jobItem(propertiesItem):
     def convergeStat(self):
         fname = self.chainRoot + '.converge_stat'
         if not nonEmptyFile(fname): return None, None
-        textFileHandle = open(fname)
-        textFileLines = textFileHandle.readlines()
-        textFileHandle.close()
+        textFileLines = gridstatus.readLines(fname)
         return float(textFileLines[0].strip()), len(textFileLines) > 1 and textFileLines[1].strip() == 'Done'
 
     def chainFinished(self):
@@ -385,46 +400,56 @@ class jobItem(propertiesItem):
     def wantCheckpointContinue(self, minR=0):
         R, done = self.convergeStat()
         if R is None: return False
-        if not os.path.exists(self.chainRoot + '_1.chk'): return False
+        if not gridstatus.fileExists(self.chainRoot + '_1.chk'): return False
         return not done and R > minR
 
     def getDistExists(self):
-        return os.path.exists(self.distRoot + '.margestats')
+        return gridstatus.fileExists(self.distRoot + '.margestats')
 
     def getDistNeedsUpdate(self):
         return self.chainExists() and (
-                not self.getDistExists() or self.chainFileDate() > os.path.getmtime(self.distRoot + '.margestats'))
+                not self.getDistExists() or self.chainFileDate() > gridstatus.fileMtime(self.distRoot + '.margestats'))
 
     def parentChanged(self):
         return not self.chainExists() or self.chainFileDate() < self.parent.chainFileDate()
 
-    def R(self):
+    def R(self, db=None):
         if self.result_converge is None:
-            fname = self.distRoot + '.converge'
-            if not nonEmptyFile(fname): return None
-            self.result_converge = types.ConvergeStats(fname)
+            if db is not None:
+                self.result_converge = db.result(self, 'converge')
+                if self.result_converge is None: return None
+            else:
+                fname = self.distRoot + '.converge'
+                if not nonEmptyFile(fname): return None
+                self.result_converge = types.ConvergeStats(fname)
         return float(self.result_converge.worstR())
 
-    def hasConvergeBetterThan(self, R, returnNotExist=False):
+    def hasConvergeBetterThan(self, R, returnNotExist=False, db=None):
         try:
-            chainR = self.R()
+            chainR = self.R(db)
             if chainR is None: return returnNotExist
             return chainR <= R
         except:
             print('WARNING: Bad .converge for ' + self.name)
             return returnNotExist
 
-    def loadJobItemResults(self, paramNameFile=None, bestfit=True, bestfitonly=False, noconverge=False, silent=False):
+    def loadJobItemResults(self, paramNameFile=None, bestfit=True, bestfitonly=False, noconverge=False, silent=False,
+                           db=None):
         self.result_converge = None
         self.result_marge = None
         self.result_likemarge = None
-        self.result_bestfit = self.chainBestfit(paramNameFile)
+        self.result_bestfit = self.chainBestfit(paramNameFile, db=db)
         if not bestfitonly:
             marge_root = self.distRoot
             if self.getDistExists():
-                if not noconverge: self.result_converge = types.ConvergeStats(marge_root + '.converge')
-                self.result_marge = types.MargeStats(marge_root + '.margestats', paramNameFile)
-                self.result_likemarge = types.LikeStats(marge_root + '.likestats')
+                if db is not None:
+                    if not noconverge: self.result_converge = db.result(self, 'converge')
+                    self.result_marge = db.labelled(db.result(self, 'marge'), paramNameFile)
+                    self.result_likemarge = db.result(self, 'like')
+                else:
+                    if not noconverge: self.result_converge = types.ConvergeStats(marge_root + '.converge')
+                    self.result_marge = types.MargeStats(marge_root + '.margestats', paramNameFile)
+                    self.result_likemarge = types.LikeStats(marge_root + '.likestats')
                 if self.result_bestfit is not None and bestfit: self.result_marge.addBestFit(self.result_bestfit)
             elif not silent:
                 print('missing: ' + marge_root)
@@ -442,12 +467,14 @@ class batchJob(propertiesItem):
         self.subBatches = []
         self.jobItems = None
         self.getdist_options = {}
+        self._item_index = None
 
     def propertiesIniFile(self):
         return os.path.join(self.batchPath, 'config', 'config.ini')
 
     def makeItems(self, settings, messages=True):
         self.jobItems = []
+        self.resetIndex()
         self.getdist_options = getattr(settings, 'getdist_options', self.getdist_options)
         allImportance = getattr(settings, 'importanceRuns', [])
         for group in settings.groups:
@@ -475,12 +502,12 @@ class batchJob(propertiesItem):
             for x in [imp for imp in item.importanceJobsRecursive()]:
                 if self.has_normed_name(x.normed_name):
                     if messages: print('replacing importance sampling run with full run: ' + x.name)
-                    item.removeImportance(x)
+                    self.removeImportance(item, x)
         for item in list(self.items()):
             for x in [imp for imp in item.importanceJobsRecursive()]:
                 if self.has_normed_name(x.normed_name, wantImportance=True, exclude=x):
                     if messages: print('removing duplicate importance sampling run: ' + x.name)
-                    item.removeImportance(x)
+                    self.removeImportance(item, x)
 
     def items(self, wantSubItems=True, wantImportance=False):
         for item in self.jobItems:
@@ -493,17 +520,43 @@ class batchJob(propertiesItem):
             for subBatch in self.subBatches:
                 for item in subBatch.items(wantSubItems, wantImportance): yield (item)
 
+    def resetIndex(self):
+        # call if items are added or removed other than via makeItems/removeImportance
+        self._item_index = None
+
+    def itemIndex(self, wantSubItems=True, wantImportance=False):
+        # dictionaries of lists of items (in items() order) by name and normed name, built on first use
+        index = getattr(self, '_item_index', None)
+        if index is None: index = self._item_index = dict()
+        key = (wantSubItems, wantImportance)
+        if key not in index:
+            names = dict()
+            normed_names = dict()
+            for jobItem in self.items(wantSubItems, wantImportance):
+                names.setdefault(jobItem.name, []).append(jobItem)
+                normed_names.setdefault(jobItem.normed_name, []).append(jobItem)
+            index[key] = (names, normed_names)
+        return index[key]
+
+    def removeImportance(self, jobItem, importanceItem):
+        jobItem.removeImportance(importanceItem)
+        removed = [importanceItem] + importanceItem.importanceJobsRecursive()
+        for names, normed_names in (getattr(self, '_item_index', None) or {}).values():
+            for item in removed:
+                for index, name in [(names, item.name), (normed_names, item.normed_name)]:
+                    if name in index:
+                        index[name] = [x for x in index[name] if x is not item]
+                        if not index[name]: del index[name]
+
     def hasName(self, name, wantSubItems=True):
-        for jobItem in self.items(wantSubItems):
-            if jobItem.name == name: return True
-        return False
+        return name in self.itemIndex(wantSubItems)[0]
 
     def has_normed_name(self, name, wantSubItems=True, wantImportance=False, exclude=None):
         return self.normed_name_item(name, wantSubItems, wantImportance, exclude) is not None
 
     def normed_name_item(self, name, wantSubItems=True, wantImportance=False, exclude=None):
-        for jobItem in self.items(wantSubItems, wantImportance):
-            if jobItem.normed_name == name and not jobItem is exclude: return jobItem
+        for jobItem in self.itemIndex(wantSubItems, wantImportance)[1].get(name, []):
+            if not jobItem is exclude: return jobItem
         return None
 
     def normalizeDataTag(self, tag):
@@ -526,10 +579,13 @@ class batchJob(propertiesItem):
             return None
 
     def resolveRoot(self, root):
-        for jobItem in self.items(True, True):
-            if jobItem.name == root: return jobItem
+        items = self.itemIndex(True, True)[0].get(root)
+        if items: return items[0]
         return self.normed_name_item(root, True, True)
 
+    def resultsDB(self):
+        return resultsdb.resultsDB(self.batchPath + 'results.sqlite')
+
     def save(self, filename=''):
         saveobject(self, (self.batchPath + 'batch.pyobj', filename)[filename != ''])
 
@@ -9,7 +9,7 @@ try:
 except:
     print('use "module load" to load python 2.7+')
     sys.exit()
-from paramgrid import batchjob
+from paramgrid import batchjob, gridstatus
 
 
 def argParser(desc=''):
@@ -18,7 +18,7 @@ def argParser(desc=''):
 
 class batchArgs(object):
     def __init__(self, desc='', importance=True, noBatchPath=False, notExist=False, notall=False, converge=False,
-                 plots=False, batchPathOptional=False):
+                 plots=False, batchPathOptional=False, statusSnapshot=False):
         self.parser = argparse.ArgumentParser(description=desc)
         if not noBatchPath:
             if batchPathOptional:
@@ -26,6 +26,10 @@ class batchArgs(object):
             else:
                 self.parser.add_argument('batchPath', help='directory containing the grid')
         if converge: self.parser.add_argument('--converge', type=float, default=0, help='minimum R-1 convergence')
+        if statusSnapshot:
+            self.parser.add_argument('--status_max_age', type=float, default=60,
+                                     help='seconds to cache listings of chain directories for file status checks '
+                                          '(0 to check each file directly)')
         self.importanceParameter = importance
         self.notExist = notExist
         self.notall = notall
@@ -77,6 +81,8 @@ class batchArgs(object):
 
         args = self.parser.parse_args(vals)
         self.args = args
+        if getattr(args, 'status_max_age', 0) > 0:
+            gridstatus.gridStatus(args.status_max_age).activate()
         if args.batchPath:
             self.batch = batchjob.readobject(args.batchPath)
             if self.batch is None: raise Exception('batchPath %s does not exist or is not initialized with makeGrid.py'%args.batchPath)
@@ -5,7 +5,7 @@ import copy
 import sys
 import six
 from getdist import IniFile
-from paramgrid import batchjob, batchjob_args
+from paramgrid import batchjob, batchjob_args, gridstatus
 
 default_params = dict()
 default_params['mnu'] = '0.02 0 5 0.1 0.03'
@@ -91,9 +91,11 @@ def makeGrid(batchPath, settingName=None, settings=None, readOnly=False, interac
     if hasattr(settings, 'skip'): batch.skip = settings.skip
     batch.makeItems(settings, messages=not readOnly)
     if readOnly:
-        for jobItem in [b for b in batch.jobItems]:
-            if not jobItem.chainExists():
-                batch.jobItems.remove(jobItem)
+        with gridstatus.gridStatus():
+            for jobItem in [b for b in batch.jobItems]:
+                if not jobItem.chainExists():
+                    batch.jobItems.remove(jobItem)
+        batch.resetIndex()
         batch.save()
         print('OK, configured grid with %u existing chains' % (len(batch.jobItems)))
         return batch
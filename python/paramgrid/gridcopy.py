@@ -0,0 +1,276 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import json
+import shutil
+import tempfile
+import zipfile
+import multiprocessing
+
+"""
+File transfers for copyGridFiles.py. Chain burn in is removed while streaming (counting and skipping lines
+without parsing any numbers), job items can be transferred by a pool of worker processes, and completed files
+are recorded in a manifest so that interrupted runs can be resumed.
+"""
+
+_chunk_size = 1024 * 1024
+
+_worker_options = None
+
+
+def countLines(fname):
+    """
+    Count lines in a text file by scanning for newline characters
+
+    :param fname: file name
+    :return: number of lines (including any final line without a newline)
+    """
+    lines = 0
+    last = b'\n'
+    with open(fname, 'rb') as f:
+        while True:
+            chunk = f.read(_chunk_size)
+            if not chunk: break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n': lines += 1
+    return lines
+
+
+def burnLines(fname, burn_fraction):
+    """
+    :param fname: chain file name
+    :param burn_fraction: fraction of lines at the start to remove
+    :return: number of lines to skip at the start of the file
+    """
+    if not burn_fraction: return 0
+    return int(countLines(fname) * burn_fraction)
+
+
+def copyTrimmed(source, dest, skip_lines=0):
+    """
+    Copy a text file, skipping a number of lines at the start
+
+    :param source: source file name
+    :param dest: destination file name
+    :param skip_lines: number of lines to skip
+    """
+    with open(source, 'rb') as f:
+        for _ in range(skip_lines):
+            if not f.readline(): break
+        with open(dest, 'wb') as out:
+            shutil.copyfileobj(f, out, _chunk_size)
+
+
+class copyOperation(object):
+    def __init__(self, source, dest, burn_fraction=0.0):
+        """
+        :param source: source file name
+        :param dest: destination name, relative to the output directory or zip file root
+        :param burn_fraction: fraction of the file to remove as burn in
+        """
+        self.source = source
+        self.dest = dest
+        self.burn_fraction = burn_fraction
+
+    def needsProcessing(self):
+        return bool(self.burn_fraction)
+
+    def stamp(self):
+        # identifies the state of the source and the options used, to decide whether it needs copying again
+        stat = os.stat(self.source)
+        return [stat.st_size, stat.st_mtime, self.burn_fraction]
+
+    def sizeMB(self):
+        return os.path.getsize(self.source) / 1024. ** 2 * (1 - self.burn_fraction)
+
+    def write(self, dest_file):
+        """
+        Write the (trimmed) source to a given file
+
+        :param dest_file: output file name
+        """
+        skip = burnLines(self.source, self.burn_fraction)
+        if skip:
+            copyTrimmed(self.source, dest_file, skip)
+        else:
+            shutil.copyfile(self.source, dest_file)
+
+
+class copyManifest(object):
+    def __init__(self, filename, resume=False):
+        """
+        Append-only record of completed transfers (one JSON line per file)
+
+        :param filename: manifest file name
+        :param resume: if True keep existing entries, otherwise start a new manifest
+        """
+        self.filename = filename
+        self.entries = dict()
+        if resume and os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        dest, stamp = json.loads(line)
+                        self.entries[dest] = stamp
+                    except ValueError:
+                        # incomplete last line from interrupted run
+                        pass
+        self.f = open(filename, 'a' if resume else 'w')
+
+    def done(self, dest, stamp):
+        return self.entries.get(dest) == stamp
+
+    def add(self, dest, stamp):
+        self.entries[dest] = stamp
+        self.f.write(json.dumps([dest, stamp]) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def _transfer(op, options):
+    # transfer a single file; for zip output, return the name of a processed temporary file to add (or None)
+    if options['zip']:
+        if not op.needsProcessing(): return None
+        fd, staged = tempfile.mkstemp(dir=options['tmp_dir'])
+        os.close(fd)
+        op.write(staged)
+        return staged
+    dest_file = options['target_dir'] + op.dest
+    if options['sym_link']:
+        if os.path.islink(dest_file): os.unlink(dest_file)
+        os.symlink(os.path.realpath(op.source), dest_file)
+    else:
+        op.write(dest_file)
+    return None
+
+
+def _initWorker(options):
+    global _worker_options
+    _worker_options = options
+
+
+def _transferGroup(ops):
+    results = []
+    for op in ops:
+        try:
+            results.append((op, _transfer(op, _worker_options), None))
+        except Exception as e:
+            results.append((op, None, '%s: %s' % (type(e).__name__, e)))
+    return results
+
+
+class gridCopier(object):
+    def __init__(self, target, zip=False, sym_link=False, resume=False, verbose=False):
+        """
+        :param target: output directory, or zip file name
+        :param zip: make a zip file
+        :param sym_link: just make symbolic links to the source files
+        :param resume: skip files already transferred (unchanged) according to the manifest from a previous run.
+                       Entries in a zip file cannot be replaced, so this fails if any file in it has changed
+        :param verbose: print each file name
+        """
+        self.zip = zip
+        self.verbose = verbose
+        self.tmp_dir = None
+        if zip:
+            self.target_dir = None
+            manifest_name = target + '.copy_manifest'
+            self.zipper = None
+            if resume and os.path.exists(target):
+                try:
+                    self.zipper = zipfile.ZipFile(target, 'a', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+                except zipfile.BadZipfile:
+                    print('Cannot resume: %s is incomplete; starting again' % target)
+                    resume = False
+            if self.zipper is None:
+                self.zipper = zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+            self.zipped = set(self.zipper.namelist())
+            self.tmp_dir = tempfile.mkdtemp()
+        else:
+            self.zipper = None
+            self.target_dir = os.path.abspath(target) + os.sep
+            if not os.path.exists(self.target_dir): os.makedirs(self.target_dir)
+            manifest_name = self.target_dir + '.copy_manifest'
+        self.manifest = copyManifest(manifest_name, resume)
+        self.options = {'zip': zip, 'sym_link': sym_link, 'target_dir': self.target_dir,
+                        'tmp_dir': self.tmp_dir}
+
+    def makePath(self, dest):
+        if not self.zip and not os.path.exists(self.target_dir + dest): os.makedirs(self.target_dir + dest)
+
+    def _checkNotZipped(self, names):
+        # zip entries cannot be replaced, and appending another with the same name would make a duplicate entry
+        stale = [name for name in names if name in self.zipped]
+        if stale:
+            raise Exception('Cannot resume: %s file(s) changed since added to the zip file (e.g. %s); run again without '
+                            '--resume' % (len(stale), stale[0]))
+
+    def writeString(self, dest, text):
+        if self.zip:
+            # no need to add again when resuming
+            if dest in self.zipped and self.zipper.read(dest).decode() == text: return
+            self._checkNotZipped([dest])
+            self.zipper.writestr(dest, text)
+            self.zipped.add(dest)
+        else:
+            with open(self.target_dir + dest, 'w') as f:
+                f.write(text)
+
+    def isDone(self, op):
+        dest = op.dest
+        if not self.manifest.done(dest, op.stamp()): return False
+        if self.zip: return dest in self.zipped
+        return os.path.lexists(self.target_dir + dest)
+
+    def _finish(self, op, staged, error):
+        dest = op.dest
+        if error:
+            print('FAILED %s: %s' % (op.source, error))
+            return
+        if self.zip:
+            self.zipper.write(staged or op.source, dest)
+            self.zipped.add(dest)
+            if staged: os.remove(staged)
+        self.manifest.add(dest, op.stamp())
+        if self.verbose: print(op.source)
+
+    def transfer(self, groups, procs=1):
+        """
+        Transfer files, skipping any already done according to the manifest
+
+        :param groups: list of lists of :class:`copyOperation` (e.g. one list per job item)
+        :param procs: number of worker processes
+        :return: number of files skipped as already done
+        """
+        todo = []
+        for ops in groups:
+            ops = [op for op in ops if not self.isDone(op)]
+            if ops: todo.append(ops)
+        skipped = sum(len(ops) for ops in groups) - sum(len(ops) for ops in todo)
+        if self.zip: self._checkNotZipped([op.dest for ops in todo for op in ops])
+        if procs > 1 and len(todo) > 1:
+            pool = multiprocessing.Pool(procs, initializer=_initWorker, initargs=(self.options,))
+            try:
+                for results in pool.imap_unordered(_transferGroup, todo):
+                    for res in results:
+                        self._finish(*res)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            _initWorker(self.options)
+            for ops in todo:
+                for res in _transferGroup(ops):
+                    self._finish(*res)
+        return skipped
+
+    def close(self):
+        if self.zipper: self.zipper.close()
+        self.manifest.close()
+        if self.tmp_dir: shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,323 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import json
+import pickle
+import base64
+import six
+from paramgrid import batchjob
+
+"""
+Compact JSON manifest of a grid (item names, tags, paths and parent/importance links), written next to batch.pyobj.
+Loading the manifest avoids unpickling (or rebuilding) the full grid: the returned :class:`manifestBatchJob`
+only makes :class:`~paramgrid.batchjob.jobItem` objects for an item (and its importance-sampling family)
+when it is first used, and name lookups are answered directly from the manifest.
+
+The manifest is regenerated whenever the grid settings file, config.ini or batch.pyobj change.
+"""
+
+# increment if the stored format changes incompatibly
+manifest_version = 1
+
+manifest_name = 'batch.json'
+
+# batchJob attributes stored separately from the general attribute dictionary
+_batch_special = ('jobItems', 'subBatches', '_item_index')
+
+# jobItem attributes stored as links to other records, or separately in the record
+_item_special = ('data_set', 'parent', 'importanceItems', 'name', 'normed_name')
+
+
+# positions of fields in each item record
+_name, _normed_name, _parent, _children, _payload = range(5)
+
+
+def _derivedPaths(batchPath, relativePath, name):
+    # standard jobItem paths, only stored explicitly if an item's paths differ from these
+    chainPath = batchPath + relativePath
+    distPath = chainPath + 'dist' + os.sep
+    return {'batchPath': batchPath, 'chainPath': chainPath, 'chainRoot': chainPath + name,
+            'distPath': distPath, 'distRoot': distPath + name}
+
+
+def manifestFileName(directory):
+    return os.path.join(os.path.abspath(directory), manifest_name)
+
+
+def _configFiles(directory):
+    directory = os.path.abspath(directory)
+    files = [os.path.join(directory, 'batch.pyobj')]
+    config = os.path.join(directory, 'config', 'config.ini')
+    if os.path.exists(config):
+        files.append(config)
+        setting_file = batchjob.IniFile(config).params.get('setting_file')
+        if setting_file: files.append(os.path.join(directory, 'config', setting_file))
+    return files
+
+
+def _fileStamps(directory):
+    stamps = dict()
+    for fname in _configFiles(directory):
+        try:
+            stat = os.stat(fname)
+            stamps[os.path.basename(fname)] = [stat.st_mtime, stat.st_size]
+        except OSError:
+            stamps[os.path.basename(fname)] = None
+    return stamps
+
+
+class _encoder(object):
+    # convert attribute values to JSON, collecting anything else (e.g. importanceFilter instances)
+    # into a list that is pickled once per item, so shared references stay shared
+
+    def __init__(self):
+        self.objects = []
+
+    def encode(self, value):
+        if value is None or isinstance(value, (bool, float) + six.string_types + six.integer_types):
+            return value
+        if type(value) is list:
+            return [self.encode(v) for v in value]
+        if type(value) is dict and all(isinstance(k, six.string_types) for k in value):
+            return dict((k, self.encode(v)) for k, v in value.items())
+        for i, obj in enumerate(self.objects):
+            if obj is value: return {'__obj__': i}
+        self.objects.append(value)
+        return {'__obj__': len(self.objects) - 1}
+
+    def encodeAttributes(self, obj, exclude=()):
+        return dict((k, self.encode(v)) for k, v in obj.__dict__.items() if k not in exclude)
+
+    def pickled(self):
+        if not self.objects: return None
+        return base64.b64encode(pickle.dumps(self.objects, 2)).decode('ascii')
+
+
+def _decode(value, objects):
+    if isinstance(value, list):
+        return [_decode(v, objects) for v in value]
+    if isinstance(value, dict):
+        if len(value) == 1 and '__obj__' in value: return objects[value['__obj__']]
+        return dict((str(k), _decode(v, objects)) for k, v in value.items())
+    if six.PY2 and isinstance(value, six.text_type):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    return value
+
+
+def _batchManifest(batch):
+    records = []
+    indices = dict()
+
+    def addItem(jobItem, parent):
+        index = len(records)
+        indices[id(jobItem)] = index
+        enc = _encoder()
+        exclude = _item_special + tuple(k for k, v in _derivedPaths(batch.batchPath, jobItem.relativePath,
+                                                                     jobItem.name).items()
+                                        if getattr(jobItem, k, None) == v)
+        payload = {'attrs': enc.encodeAttributes(jobItem, exclude),
+                   'data_set': enc.encodeAttributes(jobItem.data_set),
+                   'objects': enc.pickled()}
+        # only the fields needed for lookups are parsed on load, the rest is decoded when the item is made
+        record = [jobItem.name, getattr(jobItem, 'normed_name', None), parent, [],
+                  json.dumps(payload, separators=(',', ':'))]
+        records.append(record)
+        record[_children] = [addItem(imp, index) for imp in jobItem.importanceItems]
+        return index
+
+    top = [addItem(jobItem, None) for jobItem in batch.jobItems]
+    enc = _encoder()
+    manifest = {'attrs': enc.encodeAttributes(batch, _batch_special),
+                'jobItems': top,
+                'items': records,
+                'order': [indices[id(item)] for item in batch.items(False, True)],
+                'subBatches': [_batchManifest(sub) for sub in batch.subBatches]}
+    manifest['objects'] = enc.pickled()
+    return manifest
+
+
+def writeManifest(batch, directory):
+    """
+    Write the manifest for a grid
+
+    :param batch: the :class:`~paramgrid.batchjob.batchJob`
+    :param directory: the grid directory
+    :return: True if written, False if the directory is not writable
+    """
+    manifest = _batchManifest(batch)
+    manifest['version'] = manifest_version
+    manifest['stamps'] = _fileStamps(directory)
+    fname = manifestFileName(directory)
+    try:
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.rename(fname + '.tmp', fname)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def removeManifest(directory):
+    fname = manifestFileName(directory)
+    if os.path.exists(fname): os.remove(fname)
+
+
+def loadManifest(directory):
+    """
+    Load a grid from its manifest, if it exists and is up to date
+
+    :param directory: the grid directory
+    :return: a :class:`manifestBatchJob`, or None if there is no valid up to date manifest
+    """
+    fname = manifestFileName(directory)
+    if not os.path.exists(fname): return None
+    try:
+        with open(fname) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if manifest.get('version') != manifest_version or manifest.get('stamps') != _fileStamps(directory):
+        return None
+    return manifestBatchJob(manifest)
+
+
+def _unpickle(data):
+    if not data: return []
+    return pickle.loads(base64.b64decode(data))
+
+
+class manifestBatchJob(batchjob.batchJob):
+    """
+    A :class:`~paramgrid.batchjob.batchJob` read from a manifest, making jobItem objects only as needed.
+    Behaves as a normal batchJob once all items have been made (e.g. when iterating over all items).
+    """
+
+    def __init__(self, manifest):
+        self.__dict__.update(_decode(manifest['attrs'], _unpickle(manifest.get('objects'))))
+        self._records = manifest['items']
+        self._order = manifest['order']
+        self._top = manifest['jobItems']
+        self._objects = [None] * len(self._records)
+        self._jobItems = None
+        self._lazy = True
+        self._record_index = None
+        self._item_index = None
+        self.subBatches = [manifestBatchJob(sub) for sub in manifest['subBatches']]
+
+    @property
+    def jobItems(self):
+        if self._jobItems is None:
+            self._jobItems = [self._item(i) for i in self._top]
+        return self._jobItems
+
+    @jobItems.setter
+    def jobItems(self, jobItems):
+        self._jobItems = jobItems
+        self._lazy = False
+
+    def _makeItem(self, index, parent):
+        record = self._records[index]
+        payload = json.loads(record[_payload])
+        objects = _unpickle(payload['objects'])
+        attrs = _decode(payload['attrs'], objects)
+        jobItem = batchjob.jobItem.__new__(batchjob.jobItem)
+        jobItem.name = str(record[_name])
+        if record[_normed_name] is not None: jobItem.normed_name = str(record[_normed_name])
+        jobItem.__dict__.update(_derivedPaths(self.batchPath, attrs['relativePath'], jobItem.name))
+        jobItem.__dict__.update(attrs)
+        jobItem.data_set = batchjob.dataSet.__new__(batchjob.dataSet)
+        jobItem.data_set.__dict__.update(_decode(payload['data_set'], objects))
+        if parent is not None: jobItem.parent = parent
+        self._objects[index] = jobItem
+        jobItem.importanceItems = [self._makeItem(i, jobItem) for i in record[_children]]
+        return jobItem
+
+    def _item(self, index):
+        if self._objects[index] is None:
+            root = index
+            while self._records[root][_parent] is not None:
+                root = self._records[root][_parent]
+            self._makeItem(root, None)
+        return self._objects[index]
+
+    def materialise(self):
+        """
+        Make all items, after which this behaves exactly as a batchJob
+        """
+        for sub in self.subBatches:
+            if isinstance(sub, manifestBatchJob): sub.materialise()
+        for i in range(len(self._records)):
+            self._item(i)
+        self._lazy = False
+        return self
+
+    def _recordIndex(self, wantImportance):
+        if self._record_index is None:
+            self._record_index = dict()
+        if wantImportance not in self._record_index:
+            names = dict()
+            normed_names = dict()
+            order = self._order if wantImportance else self._top
+            for i in order:
+                record = self._records[i]
+                names.setdefault(record[_name], []).append(i)
+                normed_names.setdefault(record[_normed_name], []).append(i)
+            self._record_index[wantImportance] = (names, normed_names)
+        return self._record_index[wantImportance]
+
+    def _lookup(self, which, name, wantSubItems, wantImportance, exclude=None):
+        for i in self._recordIndex(wantImportance)[which].get(name, []):
+            jobItem = self._item(i)
+            if jobItem is not exclude: return jobItem
+        if wantSubItems:
+            for sub in self.subBatches:
+                if isinstance(sub, manifestBatchJob) and sub._lazy:
+                    jobItem = sub._lookup(which, name, True, wantImportance, exclude)
+                else:
+                    jobItem = None
+                    for x in sub.itemIndex(True, wantImportance)[which].get(name, []):
+                        if x is not exclude:
+                            jobItem = x
+                            break
+                if jobItem is not None: return jobItem
+        return None
+
+    def resetIndex(self):
+        batchjob.batchJob.resetIndex(self)
+        self.materialise()
+
+    def removeImportance(self, jobItem, importanceItem):
+        self.materialise()
+        batchjob.batchJob.removeImportance(self, jobItem, importanceItem)
+
+    def hasName(self, name, wantSubItems=True):
+        if not self._lazy: return batchjob.batchJob.hasName(self, name, wantSubItems)
+        return self._lookup(0, name, wantSubItems, False) is not None
+
+    def normed_name_item(self, name, wantSubItems=True, wantImportance=False, exclude=None):
+        if not self._lazy:
+            return batchjob.batchJob.normed_name_item(self, name, wantSubItems, wantImportance, exclude)
+        return self._lookup(1, name, wantSubItems, wantImportance, exclude)
+
+    def resolveRoot(self, root):
+        if not self._lazy: return batchjob.batchJob.resolveRoot(self, root)
+        return self._lookup(0, root, True, True) or self._lookup(1, root, True, True)
+
+    def fullBatch(self):
+        """
+        :return: an equivalent plain :class:`~paramgrid.batchjob.batchJob`
+        """
+        self.materialise()
+        batch = batchjob.batchJob.__new__(batchjob.batchJob)
+        batch.__dict__.update(dict((k, v) for k, v in self.__dict__.items() if not k.startswith('_')))
+        batch.jobItems = self.jobItems
+        batch.subBatches = [sub.fullBatch() if isinstance(sub, manifestBatchJob) else sub for sub in
+                            self.subBatches]
+        batch._item_index = None
+        return batch
+
+    def save(self, filename=''):
+        self.fullBatch().save(filename)
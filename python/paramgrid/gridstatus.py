@@ -0,0 +1,177 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+"""
+Snapshot of file sizes and modification times in grid chain directories, so that the many per-item status
+queries (chainExists, chainFileDate, getDistExists, convergeStat...) need one directory scan per chain directory
+rather than separate exists/getmtime/open calls for every file (slow on e.g. Lustre file systems).
+
+Use as a context manager (or call activate()) to make :mod:`~paramgrid.batchjob` use the snapshot::
+
+    with gridstatus.gridStatus(max_age=60):
+        for jobItem in batch.items():
+            ...
+"""
+
+# only stat files with these endings (including the .ini in .properties.ini)
+status_extensions = ('.txt', '.chk', '.converge_stat', '.minimum', '.margestats', '.likestats', '.converge', '.ini')
+
+_active = None
+
+
+def activeStatus():
+    """
+    :return: the currently active :class:`gridStatus`, or None
+    """
+    return _active
+
+
+class gridStatus(object):
+    def __init__(self, max_age=60, extensions=status_extensions):
+        """
+        :param max_age: time in seconds after which a directory listing is considered stale and re-scanned
+        :param extensions: file name endings to record
+        """
+        self.max_age = max_age
+        self.extensions = tuple(extensions)
+        self.dirs = dict()
+        self.contents = dict()
+        self._previous = None
+
+    def activate(self):
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def deactivate(self):
+        global _active
+        _active = self._previous
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, *args):
+        self.deactivate()
+
+    def reset(self, path=None):
+        """
+        Discard cached listings, e.g. after writing files
+
+        :param path: directory to reset, or None to reset all
+        """
+        if path is None:
+            self.dirs.clear()
+        else:
+            self.dirs.pop(os.path.normpath(path), None)
+
+    def _scan(self, path):
+        files = dict()
+        if scandir is not None:
+            try:
+                for entry in scandir(path):
+                    if entry.name.endswith(self.extensions):
+                        try:
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_size, stat.st_mtime)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+        elif os.path.isdir(path):
+            for name in os.listdir(path):
+                if name.endswith(self.extensions):
+                    try:
+                        stat = os.stat(os.path.join(path, name))
+                        files[name] = (stat.st_size, stat.st_mtime)
+                    except OSError:
+                        pass
+        return files
+
+    def listing(self, path):
+        """
+        Get (cached) dictionary of file name: (size, mtime) for files in a directory
+
+        :param path: directory name
+        :return: dictionary
+        """
+        path = os.path.normpath(path)
+        entry = self.dirs.get(path)
+        now = time.time()
+        if entry is None or now - entry[0] > self.max_age:
+            entry = (now, self._scan(path))
+            self.dirs[path] = entry
+        return entry[1]
+
+    def stat(self, fname):
+        """
+        :param fname: file name
+        :return: (size, mtime) or None if the file does not exist
+        """
+        path, name = os.path.split(fname)
+        if not name.endswith(self.extensions):
+            try:
+                stat = os.stat(fname)
+                return stat.st_size, stat.st_mtime
+            except OSError:
+                return None
+        return self.listing(path or os.curdir).get(name)
+
+    def exists(self, fname):
+        return self.stat(fname) is not None
+
+    def nonEmpty(self, fname):
+        stat = self.stat(fname)
+        return stat is not None and stat[0] > 0
+
+    def getmtime(self, fname):
+        stat = self.stat(fname)
+        if stat is None: raise OSError('No such file: %s' % fname)
+        return stat[1]
+
+    def readLines(self, fname):
+        """
+        Read lines of a (small) text file, cached while its size and mtime are unchanged
+
+        :param fname: file name
+        :return: list of lines, or None if the file does not exist
+        """
+        stat = self.stat(fname)
+        if stat is None: return None
+        cached = self.contents.get(fname)
+        if cached is None or cached[0] != stat:
+            with open(fname) as f:
+                cached = (stat, f.readlines())
+            self.contents[fname] = cached
+        return cached[1]
+
+
+def fileExists(fname):
+    if _active is not None: return _active.exists(fname)
+    return os.path.exists(fname)
+
+
+def nonEmptyFile(fname):
+    if _active is not None: return _active.nonEmpty(fname)
+    return os.path.exists(fname) and os.path.getsize(fname) > 0
+
+
+def fileMtime(fname):
+    if _active is not None: return _active.getmtime(fname)
+    return os.path.getmtime(fname)
+
+
+def readLines(fname):
+    if _active is not None: return _active.readLines(fname)
+    with open(fname) as f:
+        return f.readlines()
@@ -0,0 +1,222 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import itertools
+import multiprocessing
+import numpy as np
+from getdist.chains import chainFiles, ParSamples
+from getdist.paramnames import ParamNames, ParamInfo
+from paramgrid import batchjob
+
+"""
+Importance sampling of grid chains with likelihoods that can be evaluated in python (e.g. Gaussian priors,
+BAO or H0 constraints), without running CosmoMC. The likelihood is evaluated for chunks of samples at a time,
+optionally across a pool of processes, and the new chains are written with updated weights, likelihoods and
+added chi-squared columns.
+
+A likelihood function takes a :class:`~getdist.chains.ParSamples` object with vectors for each parameter
+(params.H0 etc.) and returns a vector of -log(likelihood) values, or a dictionary of vectors for named
+separate likelihood components. Use -log(likelihood) = inf for samples that are excluded.
+"""
+
+_worker_likelihood = None
+
+default_chunk_size = 50000
+
+# largest log weight allowed before the weights written so far are rescaled
+_max_log_weight = 500
+
+
+class importanceLikelihood(batchjob.importanceFilter):
+    """
+    Importance sampling filter for grid settings, using a python likelihood function. Run using
+    "runbatch.py --filters". Since the grid settings are saved with the grid, the likelihood function must be
+    picklable (e.g. defined at module level, not a lambda).
+    """
+
+    def __init__(self, names, logLike, procs=1, chunk_size=default_chunk_size, dist_settings=None,
+                 minimize=False):
+        """
+        :param names: list of names for the new data (as for other importance sampling runs)
+        :param logLike: function of :class:`~getdist.chains.ParSamples` returning -log(likelihood)
+                        (or a dictionary of -log(likelihood) for separate components)
+        :param procs: number of processes to use
+        :param chunk_size: number of samples in each chunk
+        :param dist_settings: any specific analysis settings for the importance sampled chains
+        :param minimize: whether to run best-fits (not done in python)
+        """
+        if not callable(logLike): raise TypeError('importanceLikelihood logLike must be a function')
+        batchjob.importanceFilter.__init__(self, names, dist_settings, minimize)
+        self.logLike = logLike
+        self.procs = procs
+        self.chunk_size = chunk_size
+
+    def filter(self, batch, jobItem):
+        importanceSampleJobItem(jobItem, self.logLike, procs=self.procs, chunk_size=self.chunk_size,
+                                name="_".join(self.names))
+
+
+def _parSamples(paramNames, samples):
+    pars = ParSamples()
+    for i, par in enumerate(paramNames.names):
+        path = par.name.split('.')
+        ob = pars
+        for p in path[:-1]:
+            if not hasattr(ob, p): setattr(ob, p, ParSamples())
+            ob = getattr(ob, p)
+        setattr(ob, path[-1], samples[:, i])
+    return pars
+
+
+def _readChunks(fname, chunk_size):
+    # read a chain file sequentially, as lists of up to chunk_size lines
+    with open(fname) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines: break
+            yield lines
+
+
+def _chunkLogLikes(lines, paramNames, likelihood, name):
+    data = np.loadtxt(lines, ndmin=2)
+    result = likelihood(_parSamples(paramNames, data[:, 2:]))
+    if not isinstance(result, dict): result = {name: result}
+    components = [(key, np.broadcast_to(np.asarray(value, dtype=np.float64), (data.shape[0],)))
+                  for key, value in sorted(result.items())]
+    return data, components
+
+
+def _initWorker(likelihood):
+    global _worker_likelihood
+    _worker_likelihood = likelihood
+
+
+def _chunkTask(task):
+    lines, paramNames, name = task
+    return _chunkLogLikes(lines, paramNames, _worker_likelihood, name)
+
+
+def _chunkResults(files, paramNames, likelihood, procs, chunk_size, name):
+    # yield (file index, data, likelihood components) for each chunk of the chains in order, reading the files
+    # sequentially and only keeping a few chunks in memory at once
+    tasks = ((i, (lines, paramNames, name)) for i, fname in enumerate(files)
+             for lines in _readChunks(fname, chunk_size))
+    if procs < 2:
+        for i, task in tasks:
+            yield (i,) + _chunkLogLikes(task[0], paramNames, likelihood, name)
+        return
+    pool = multiprocessing.Pool(procs, initializer=_initWorker, initargs=(likelihood,))
+    try:
+        while True:
+            batch = list(itertools.islice(tasks, 2 * procs))
+            if not batch: break
+            for (i, _), result in zip(batch, pool.imap(_chunkTask, [task for _, task in batch])):
+                yield (i,) + result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _rescaleWeights(fname, factor, chunk_size, fmt):
+    # multiply the weights in an output chain file by factor (removing samples with zero weight)
+    tmp_name = fname + '.tmp'
+    with open(tmp_name, 'wb') as out:
+        for lines in _readChunks(fname, chunk_size):
+            data = np.loadtxt(lines, ndmin=2)
+            data[:, 0] *= factor
+            np.savetxt(out, data[data[:, 0] > 0], fmt=fmt)
+    os.rename(tmp_name, fname)
+
+
+def importanceSample(parent_root, root, likelihood, procs=1, chunk_size=default_chunk_size, name='new',
+                     fmt='%16.7E'):
+    """
+    Importance sample chains, writing new chain files, .paramnames, and copying any .ranges and .properties.ini.
+    Chains are read and written sequentially, so only a few chunks are held in memory at once.
+
+    :param parent_root: root name of the chains to importance sample (files parent_root_1.txt etc.)
+    :param root: root name of the output chains
+    :param likelihood: function of :class:`~getdist.chains.ParSamples` returning -log(likelihood) vector,
+                       or dictionary of -log(likelihood) vectors for separate named components
+    :param procs: number of processes to use to evaluate the likelihood. With procs>1 the function should
+                  be picklable unless using fork multiprocessing (default on Linux).
+    :param chunk_size: number of samples to evaluate at once
+    :param name: name of the new likelihood (used for the chi-squared parameter if not returning a dictionary)
+    :param fmt: number format for the output chain files
+    :return: list of names of chain files written
+    """
+    files = chainFiles(parent_root)
+    if not files: raise Exception('No chains found for %s' % parent_root)
+    paramNames = ParamNames(parent_root + '.paramnames')
+    chi2_index = [i for i, par in enumerate(paramNames.names) if par.name == 'chi2']
+    out_dir = os.path.dirname(root)
+    if out_dir and not os.path.exists(out_dir): os.makedirs(out_dir)
+    outputs = [root + fname[len(parent_root):] for fname in files]
+
+    # common scale across all chains so relative weights of chains are consistent. The scale is taken from the
+    # first samples, and only if much larger weights are found later are the outputs so far rescaled.
+    scale = None
+    keys = None
+    out = None
+    current = -1
+    try:
+        for i, data, comps in _chunkResults(files, paramNames, likelihood, procs, chunk_size, name):
+            while current < i:
+                if out: out.close()
+                current += 1
+                out = open(outputs[current], 'wb')
+            if keys is None: keys = [key for key, _ in comps]
+            total = sum(component for _, component in comps)
+            keep = np.isfinite(total)
+            data = data[keep]
+            total = total[keep]
+            if not total.size: continue
+            if scale is None:
+                scale = np.min(total)
+            elif scale - np.min(total) > _max_log_weight:
+                out.close()
+                for outname in outputs[:i + 1]:
+                    _rescaleWeights(outname, np.exp(np.min(total) - scale), chunk_size, fmt)
+                out = open(outputs[i], 'ab')
+                scale = np.min(total)
+            data[:, 0] *= np.exp(-(total - scale))
+            data[:, 1] += total
+            if chi2_index: data[:, 2 + chi2_index[0]] += 2 * total
+            data = np.hstack([data] + [2 * comp[keep].reshape(-1, 1) for _, comp in comps])
+            np.savetxt(out, data[data[:, 0] > 0], fmt=fmt)
+        # any remaining (empty) chains
+        while current < len(files) - 1:
+            if out: out.close()
+            current += 1
+            out = open(outputs[current], 'wb')
+    finally:
+        if out: out.close()
+
+    newNames = ParamNames()
+    newNames.names = list(paramNames.names)
+    for key in keys or []:
+        tag = 'chi2_' + key
+        newNames.names.append(ParamInfo(name=tag, label=r'\chi^2_{\rm ' + key.replace('_', '-') + '}',
+                                        derived=True))
+    newNames.saveAsText(root + '.paramnames')
+    for ext in ['.ranges', '.properties.ini']:
+        if os.path.exists(parent_root + ext): shutil.copyfile(parent_root + ext, root + ext)
+    return outputs
+
+
+def importanceSampleJobItem(jobItem, likelihood, **kwargs):
+    """
+    Importance sample the parent chains of an importance sampling grid item, writing the jobItem's chains.
+
+    :param jobItem: the importance sampling :class:`~paramgrid.batchjob.jobItem`
+    :param likelihood: -log(likelihood) function, as for :func:`importanceSample`
+    :param kwargs: other arguments for :func:`importanceSample`
+    :return: list of chain file names written
+    """
+    if not jobItem.isImportanceJob: raise Exception('Not an importance sampling item: %s' % jobItem.name)
+    kwargs.setdefault('name', getattr(jobItem, 'importanceTag', 'new'))
+    return importanceSample(jobItem.parent.chainRoot, jobItem.chainRoot, likelihood, **kwargs)
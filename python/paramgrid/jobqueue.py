@@ -7,11 +7,37 @@ import re
 import pickle
 import time
 import shutil
+import signal
+import sys
 import multiprocessing
 
 from distutils import spawn
 import six
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# shell variable giving the index of a job array task, for the various grid engines
+array_index_var = '${SLURM_ARRAY_TASK_ID:-${PBS_ARRAYID:-${PBS_ARRAY_INDEX:-${SGE_TASK_ID:-$MOAB_JOBARRAYINDEX}}}}'
+
+# default seconds for which queue status (qstat/showq output) is cached
+queue_status_max_age = 20
+
+# job script used for jobs run by the local scheduler (the RUN command is still taken from the job template, if any)
+local_job_template = """#!/bin/bash
+cd ##ROOTDIR##
+export OMP_NUM_THREADS=##OMP##
+status=0
+pids=()
+##COMMAND##
+for pid in "${pids[@]}"; do
+    wait $pid || status=$?
+done
+exit $status
+"""
+
 
 def addArguments(parser, combinedJobs=False):
     parser.add_argument('--nodes', type=int)
@@ -24,6 +50,10 @@ def addArguments(parser, combinedJobs=False):
                             help='run all one after another, under one job submission (good for many fast operations)')
         parser.add_argument('--runsPerJob', type=int, default=int(os.environ.get('COSMOMC_runsPerJob', '1')),
                             help='submit multiple mpi runs at once from each job script (e.g. to get more than one run per node)')
+        parser.add_argument('--job_array', action='store_true',
+                            help='submit all runs with one submission as a job array, each array task doing runsPerJob runs')
+        parser.add_argument('--qsub_array',
+                            help='qsub option to make a job array, with ##ARRAY## (e.g. 1-10) or ##NUMARRAY## placeholders')
 
     parser.add_argument('--job_template', help="template file for the job submission script")
     parser.add_argument('--program', help='actual program to run (default: ./cosmomc)')
@@ -31,6 +61,12 @@ def addArguments(parser, combinedJobs=False):
     parser.add_argument('--jobclass', help='any class name of the job')
 
     parser.add_argument('--qsub', help='option to change qsub command to something else')
+    parser.add_argument('--local', action='store_true',
+                        help='run jobs on this machine with the built-in local scheduler rather than a batch queue')
+    parser.add_argument('--local_cores', type=int,
+                        help='number of cores the local scheduler can use (default: all)')
+    parser.add_argument('--omp', type=int,
+                        help='OpenMP threads per chain for local jobs (default: 1; ignored if coresPerNode is set)')
 
     parser.add_argument('--dryrun', action='store_true')
     parser.add_argument('--no_sub', action='store_true')
@@ -67,8 +103,19 @@ def checkArguments(**kwargs):
 class jobSettings(object):
     def __init__(self, jobName, msg=False, **kwargs):
         self.jobName = jobName
+        self.job_template = getDefaulted('job_template', 'job_script', **kwargs)
+        local = kwargs.get('local') or getDefaulted('GridEngine', **kwargs) == 'LOCAL'
+        if local and not os.path.exists(self.job_template):
+            template = local_job_template
+        else:
+            with open(self.job_template, 'r') as f:
+                template = f.read()
+            local = local or extractValue(template, 'DEFAULT_GridEngine') == 'LOCAL'
+
         grid_engine = 'PBS'
-        if spawn.find_executable("msub") is not None:
+        if local:
+            grid_engine = 'LOCAL'
+        elif spawn.find_executable("msub") is not None:
             grid_engine = 'MOAB'
         else:
             try:
@@ -77,19 +124,25 @@ class jobSettings(object):
             except:
                 pass
 
-        self.job_template = getDefaulted('job_template', 'job_script', **kwargs)
-        with open(self.job_template, 'r') as f:
-            template = f.read()
         try:
             cores = multiprocessing.cpu_count()
-            if cores > 64:
+            if cores > 64 and not local:
                 # probably shared memory machine, e.g. Cosmos
                 cores = 8
         except:
             cores = 8
+        self.localOmp = None
+        if local:
+            cores = getDefaulted('local_cores', cores, tp=int, **kwargs)
+            if getDefaulted('coresPerNode', template=template, **kwargs) is None:
+                # a local job only takes the cores its chains use (not the whole machine),
+                # so that the local scheduler can run several jobs at once
+                self.localOmp = getDefaulted('omp', 1, tp=int, template=template, **kwargs)
 
         self.coresPerNode = getDefaulted('coresPerNode', cores, tp=int, template=template, **kwargs)
-        if cores == 4:
+        if local:
+            perNode = min(4, cores)
+        elif cores == 4:
             perNode = 2
         elif cores % 4 == 0:
             perNode = cores // 4
@@ -98,11 +151,13 @@ class jobSettings(object):
         else:
             perNode = 1
         self.chainsPerNode = getDefaulted('chainsPerNode', perNode, tp=int, template=template, **kwargs)
-        self.nodes = getDefaulted('nodes', max(1, 4 // perNode), tp=int, template=template, **kwargs)
+        # the local scheduler runs everything on one "node"
+        self.nodes = getDefaulted('nodes', 1 if local else max(1, 4 // perNode), tp=int, template=template, **kwargs)
         self.nchains = self.nodes * self.chainsPerNode
 
         self.runsPerJob = getDefaulted('runsPerJob', 1, tp=int, template=template, **kwargs)
         # also defaulted at input so should be set here unless called programmatically
+        if self.localOmp: self.coresPerNode = self.chainsPerNode * self.runsPerJob * self.localOmp
 
         self.omp = self.coresPerNode / (self.chainsPerNode * self.runsPerJob)
         if self.omp != np.floor(self.omp): raise Exception('Chains must each have equal number of cores')
@@ -116,7 +171,8 @@ class jobSettings(object):
         self.queue = getDefaulted('queue', '', template=template, **kwargs)
         self.jobclass = getDefaulted('jobclass', '', template=template, **kwargs)
 
-        self.gridEngine = getDefaulted('GridEngine', grid_engine, template=template, **kwargs)
+        self.gridEngine = grid_engine if local else getDefaulted('GridEngine', grid_engine, template=template,
+                                                                 **kwargs)
         if grid_engine == 'OGS' and os.getenv('SGE_CLUSTER_NAME', '') == 'starcluster':
             self.qsub = 'qsub -pe orte ##NUMSLOTS##'
         else:
@@ -124,6 +180,8 @@ class jobSettings(object):
                                      **kwargs)
         self.qdel = getDefaulted('qdel', 'canceljob' if self.gridEngine == 'MOAB' else 'qdel', template=template,
                                  **kwargs)
+        self.qsub_array = getDefaulted('qsub_array', '-t ##JOBNAME##[##ARRAY##]' if self.gridEngine == 'MOAB' else
+                                       '-t ##ARRAY##', template=template, **kwargs)
         self.runCommand = extractValue(template, 'RUN')
 
 
@@ -177,23 +235,49 @@ def saveJobIndex(obj, batchPath=None):
     shutil.move(fname + '_tmp', fname)
 
 
+class jobIndexLock(object):
+    """
+    Exclusive lock on the job index, held while loading, modifying and saving it
+    (so updates from the local scheduler and from submission/deletion scripts are not lost)
+    """
+
+    def __init__(self, batchPath=None):
+        if batchPath is None: batchPath = './scripts/'
+        self.fileName = os.path.join(batchPath, 'jobIndex.lock')
+
+    def __enter__(self):
+        self.file = open(self.fileName, 'a')
+        if fcntl: fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl: fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
 def addJobIndex(batchPath, j):
     if batchPath is None: batchPath = './scripts/'
-    index = loadJobIndex(batchPath)
-    index.addJob(j)
-    saveJobIndex(index, batchPath)
+    with jobIndexLock(batchPath):
+        index = loadJobIndex(batchPath)
+        if j.jobId is None:
+            # local job, number sequentially
+            j.jobId = 'local.%u' % (max([0] + [int(jobId.split('.')[1]) for jobId in index.jobSettings
+                                               if jobId.startswith('local.')]) + 1)
+        index.addJob(j)
+        saveJobIndex(index, batchPath)
 
 
 def deleteJobNames(batchPath, jobNames):
     if batchPath is None: batchPath = './scripts/'
-    index = loadJobIndex(batchPath)
-    if not index:
-        raise Exception('No existing job index found')
-    if isinstance(jobNames, six.string_types): jobNames = [jobNames]
-    for name in jobNames:
-        jobId = index.jobNames.get(name)
-        index.delId(jobId)
-    saveJobIndex(index, batchPath)
+    with jobIndexLock(batchPath):
+        index = loadJobIndex(batchPath)
+        if not index:
+            raise Exception('No existing job index found')
+        if isinstance(jobNames, six.string_types): jobNames = [jobNames]
+        for name in jobNames:
+            jobId = index.jobNames.get(name)
+            index.delId(jobId)
+        saveJobIndex(index, batchPath)
 
 
 def deleteRootNames(batchPath, rootNames):
@@ -203,6 +287,11 @@ def deleteRootNames(batchPath, rootNames):
 def deleteJobs(batchPath, jobIds=None, rootNames=None, jobNames=None, jobId_minmax=None, jobId_min=None, confirm=True,
                running=False, queued=False):
     if batchPath is None: batchPath = './scripts/'
+    with jobIndexLock(batchPath):
+        return _deleteJobs(batchPath, jobIds, rootNames, jobNames, jobId_minmax, jobId_min, confirm, running, queued)
+
+
+def _deleteJobs(batchPath, jobIds, rootNames, jobNames, jobId_minmax, jobId_min, confirm, running, queued):
     index = loadJobIndex(batchPath)
     if not index:
         raise Exception('No existing job index found')
@@ -236,16 +325,21 @@ def deleteJobs(batchPath, jobIds=None, rootNames=None, jobNames=None, jobId_minm
             if confirm:
                 if jobId in validIds:
                     print('Cancelling: ', j.jobName, jobId)
-                    if hasattr(j, 'qdel'):
-                        qdel = j.qdel
+                    if getattr(j, 'gridEngine', None) == 'LOCAL':
+                        cancelLocalJob(j)
                     else:
-                        qdel = 'qdel'
-                    subprocess.check_output(qdel + ' ' + str(jobId), shell=True)
+                        if hasattr(j, 'qdel'):
+                            qdel = j.qdel
+                        else:
+                            qdel = 'qdel'
+                        subprocess.check_output(qdel + ' ' + str(getattr(j, 'qdelId', jobId)), shell=True)
                 index.delId(jobId)
             elif jobId in validIds:
                 print('...', j.jobName, jobId)
 
-    if confirm: saveJobIndex(index, batchPath)
+    if confirm:
+        saveJobIndex(index, batchPath)
+        resetQueueStatus(batchPath)
     return jobIds
 
 
@@ -256,12 +350,19 @@ def submitJob(jobName, paramFiles, sequential=False, msg=False, **kwargs):
     if isinstance(paramFiles, six.string_types): paramFiles = [paramFiles]
     paramFiles = [ini.replace('.ini', '') for ini in paramFiles]
 
-    j.runsPerJob = (len(paramFiles), 1)[sequential]
+    # job array, with each array task running runsPerJob of the runs
+    array = bool(kwargs.get('job_array')) and not sequential and len(paramFiles) > 1 and j.gridEngine != 'LOCAL'
+    if array:
+        j.runsPerJob = max(1, min(j.runsPerJob, len(paramFiles)))
+        numArray = (len(paramFiles) + j.runsPerJob - 1) // j.runsPerJob
+    else:
+        j.runsPerJob = (len(paramFiles), 1)[sequential]
+    if j.localOmp: j.coresPerNode = j.chainsPerNode * j.runsPerJob * j.localOmp
     # adjust omp for the actual number (may not be equal to input runsPerJob because of non-integer multiple)
     j.omp = j.coresPerNode // (j.chainsPerNode * j.runsPerJob)
 
     j.path = os.getcwd()
-    j.onerun = (0, 1)[len(paramFiles) == 1 or sequential]
+    j.onerun = (0, 1)[len(paramFiles) == 1 or sequential or array and j.runsPerJob == 1]
     vals = dict()
     vals['JOBNAME'] = jobName
     vals['OMP'] = j.omp
@@ -284,68 +385,129 @@ def submitJob(jobName, paramFiles, sequential=False, msg=False, **kwargs):
 
     j.names = [os.path.basename(param) for param in paramFiles]
 
+    scriptRoot = './scripts/' + jobName
     commands = []
-    for param, name in zip(paramFiles, j.names):
-        ini = param + '.ini'
+    if array:
+        # each task looks up its ini files from the .batch file
+        vals['ARRAY'] = '1-%u' % numArray
+        vals['NUMARRAY'] = numArray
+        vals['INI'] = '$INI.ini'
+        vals['INIBASE'] = '$INIBASE'
         if j.runCommand is not None:
-            vals['INI'] = ini
-            vals['INIBASE'] = name
-            command = replacePlaceholders(j.runCommand, vals) + (' &', '')[sequential]
+            command = replacePlaceholders(j.runCommand, vals)
         else:
-            command = ('time mpirun -np %i %s %s > ./scripts/%s.log 2>&1 %s' %
-                       (j.nchains, j.program, ini, os.path.basename(ini), ('&', '')[sequential]))
-        commands.append(command)
+            command = 'time mpirun -np %i %s $INI.ini > ./scripts/$INIBASE.ini.log 2>&1' % (j.nchains, j.program)
+        commands.append('ARRAY_INDEX=' + array_index_var)
+        commands.append('for INI in $(sed -n "$(( (ARRAY_INDEX - 1) * %u + 1 )),$(( ARRAY_INDEX * %u ))p" %s.batch); do'
+                        % (j.runsPerJob, j.runsPerJob, scriptRoot))
+        commands.append('INIBASE=$(basename $INI)')
+        commands.append(command + ' &')
+        commands.append('done')
+        j.arrayTasks = [j.names[i:i + j.runsPerJob] for i in range(0, len(j.names), j.runsPerJob)]
+    else:
+        for param, name in zip(paramFiles, j.names):
+            ini = param + '.ini'
+            if j.runCommand is not None:
+                vals['INI'] = ini
+                vals['INIBASE'] = name
+                command = replacePlaceholders(j.runCommand, vals) + (' &', '')[sequential]
+            else:
+                command = ('time mpirun -np %i %s %s > ./scripts/%s.log 2>&1 %s' %
+                           (j.nchains, j.program, ini, os.path.basename(ini), ('&', '')[sequential]))
+            if j.gridEngine == 'LOCAL':
+                # keep each run's exit status, so that the local scheduler sees failed runs
+                command += ('\npids+=($!)', ' || status=$?')[sequential]
+            commands.append(command)
 
     vals['COMMAND'] = "\n".join(commands)
+    if j.gridEngine == 'LOCAL':
+        script = replacePlaceholders(local_job_template, vals)
+        j.scriptName = os.path.abspath(scriptRoot + '_subscript')
+        j.logName = os.path.abspath(scriptRoot + '.out')
+        open(j.scriptName, 'w').write(script)
+        if len(paramFiles) > 1:
+            open(scriptRoot + '.batch', 'w').write("\n".join(paramFiles))
+        if not kwargs.get('no_sub', False):
+            j.paramFiles = paramFiles
+            j.jobId = None
+            j.localCores = vals['NUMSLOTS']
+            j.localState = 'queued'
+            j.pid = None
+            j.subTime = time.time()
+            addJobIndex(kwargs.get('batchPath'), j)
+            open(scriptRoot + '.sub', 'w').write(j.jobId)
+            startLocalScheduler(kwargs.get('batchPath'), getDefaulted('local_cores', tp=int, **kwargs))
+        return
     with open(j.job_template, 'r') as f:
         template = f.read()
         script = replacePlaceholders(template, vals)
-        scriptRoot = './scripts/' + jobName
         scriptName = scriptRoot + '_subscript'
         open(scriptName, 'w').write(script)
         if len(paramFiles) > 1:
             open(scriptRoot + '.batch', 'w').write("\n".join(paramFiles))
         if not kwargs.get('no_sub', False):
-            res = str(subprocess.check_output(replacePlaceholders(j.qsub, vals) + ' ' + scriptName, shell=True)).strip()
+            qsub = replacePlaceholders(j.qsub, vals)
+            if array: qsub += ' ' + replacePlaceholders(j.qsub_array, vals)
+            res = subprocess.check_output(qsub + ' ' + scriptName, shell=True).decode('utf-8', 'replace').strip()
             if not res:
                 print('No qsub output')
             else:
                 j.paramFiles = paramFiles
-                if 'Your job ' in res:
-                    m = re.search('Your job (\d*) ', res)
+                if 'Your job' in res:
+                    m = re.search('Your job(?:-array)? (\d*)', res)
                     res = m.group(1)
+                if array:
+                    # index by the numeric id, which is how array tasks are listed (e.g. 123[4], 123_4)
+                    j.qdelId = res
+                    res = re.search(r'\d+', res).group(0)
                 j.jobId = res
                 j.subTime = time.time()
                 open(scriptRoot + '.sub', 'w').write(res)
                 addJobIndex(kwargs.get('batchPath'), j)
+                resetQueueStatus(kwargs.get('batchPath'))
 
 
-def queue_job_details(batchPath=None, running=True, queued=True, warnNotBatch=True):
+def queue_job_details(batchPath=None, running=True, queued=True, warnNotBatch=True, max_age=None):
     """
     Return: list of jobIds, list of jobNames, list of list names
+    (the queue listing is cached for max_age seconds, see :func:`queueStatus`)
     """
     index = loadJobIndex(batchPath)
     if not index:
         print('No existing job index found')
         return []
-    if spawn.find_executable("showq") is not None:
-        res = str(subprocess.check_output('showq -U $USER', shell=True)).strip()
-        runningTxt = ' Running '
-    else:
-        # e.g. Sun Grid Engine/OGS
-        res = str(subprocess.check_output('qstat -u $USER', shell=True)).strip()
-        runningTxt = ' r '
-    res = res.split("\n")
     names = []
     jobNames = []
     ids = []
     infos = []
+    for jobId in index.jobSequence:
+        j = index.jobSettings[jobId]
+        if getattr(j, 'gridEngine', None) == 'LOCAL':
+            state = localJobState(j)
+            if queued and state == 'queued' or running and state == 'running':
+                names += [j.names]
+                jobNames += [j.jobName]
+                ids += [jobId]
+                infos += ['%-10s %-8s %4u cores  %s' % (jobId, state, j.localCores,
+                                                        time.strftime('%c', time.localtime(j.subTime)))]
+    if all(getattr(j, 'gridEngine', None) == 'LOCAL' for j in index.jobSettings.values()):
+        return ids, jobNames, names, infos
+    res, runningTxt = queueStatus(batchPath, max_age)
     for line in res[2:]:
         if ' ' + os.environ.get('USER') + ' ' in line and (queued and not re.search(runningTxt, line, re.IGNORECASE)
                                                            or running and re.search(runningTxt, line, re.IGNORECASE)):
             items = line.split()
             jobId = items[0]
             j = index.jobSettings.get(jobId)
+            task = None
+            if j is None:
+                m = re.match(r'(\d+)(\[(\d*)\]|_(\d+)|_\[[^\]]*\])', jobId)
+                if m:
+                    # job array task
+                    j = index.jobSettings.get(m.group(1))
+                    if j is not None:
+                        jobId = m.group(1)
+                        task = m.group(3) or m.group(4)
             if j is None:
                 jobId = items[0].split('.')
                 if jobId[0].upper() == 'TOTAL': continue
@@ -358,13 +520,61 @@ def queue_job_details(batchPath=None, running=True, queued=True, warnNotBatch=Tr
                 if warnNotBatch: print('...Job ' + jobId + ' not in this batch, skipping')
                 continue
 
-            names += [j.names]
-            jobNames += [j.jobName]
+            if task and 0 < int(task) <= len(getattr(j, 'arrayTasks', [])):
+                names += [j.arrayTasks[int(task) - 1]]
+                jobNames += [j.jobName + '[%s]' % task]
+            else:
+                names += [j.names]
+                jobNames += [j.jobName]
             ids += [jobId]
             infos += [line]
     return ids, jobNames, names, infos
 
 
+def queueStatus(batchPath=None, max_age=None):
+    """
+    Get the lines of the grid engine's queue listing (showq or qstat) for this user. The result is cached in the
+    batch directory for max_age seconds, so repeated queries (e.g. from several scripts) call the scheduler only once.
+
+    :param batchPath: directory for the cache file
+    :param max_age: seconds to use a cached result for (default from COSMOMC_queue_status_max_age or
+                    queue_status_max_age; 0 to always query)
+    :return: list of lines, text identifying running jobs
+    """
+    if batchPath is None: batchPath = './scripts/'
+    if max_age is None: max_age = getDefaulted('queue_status_max_age', queue_status_max_age, tp=float)
+    fname = os.path.join(batchPath, 'queueStatus.pyobj')
+    if max_age > 0 and os.path.exists(fname) and time.time() - os.path.getmtime(fname) < max_age:
+        try:
+            with open(fname, 'rb') as inp:
+                return pickle.load(inp)
+        except Exception:
+            pass
+    if spawn.find_executable("showq") is not None:
+        res = subprocess.check_output('showq -U $USER', shell=True).decode('utf-8', 'replace').strip()
+        runningTxt = ' Running '
+    else:
+        # e.g. Sun Grid Engine/OGS
+        res = subprocess.check_output('qstat -u $USER', shell=True).decode('utf-8', 'replace').strip()
+        runningTxt = ' r '
+    status = (res.split("\n"), runningTxt)
+    if max_age > 0:
+        try:
+            with open(fname + '_tmp', 'wb') as output:
+                pickle.dump(status, output, pickle.HIGHEST_PROTOCOL)
+            shutil.move(fname + '_tmp', fname)
+        except (IOError, OSError):
+            pass
+    return status
+
+
+def resetQueueStatus(batchPath=None):
+    # call after submitting or deleting jobs
+    if batchPath is None: batchPath = './scripts/'
+    fname = os.path.join(batchPath, 'queueStatus.pyobj')
+    if os.path.exists(fname): os.remove(fname)
+
+
 def queue_job_names(batchPath=None, running=False, queued=True):
     lists = queue_job_details(batchPath, running, queued)[2]
     names = []
@@ -372,3 +582,150 @@ def queue_job_names(batchPath=None, running=False, queued=True):
         names += nameset
     return names
 
+
+
+def _pidRunning(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def localJobState(j):
+    """
+    State of a job submitted to the local scheduler: 'queued', 'running', 'done', 'failed' or 'lost'
+    ('lost' if it is marked as running but the process no longer exists, e.g. if the scheduler was killed)
+    """
+    state = getattr(j, 'localState', None)
+    if state == 'running' and not (j.pid and _pidRunning(j.pid)): return 'lost'
+    return state
+
+
+def cancelLocalJob(j):
+    if localJobState(j) == 'running':
+        try:
+            # jobs are started in their own process group, so this also stops the mpirun processes
+            os.killpg(j.pid, signal.SIGTERM)
+        except OSError:
+            pass
+    j.localState = 'cancelled'
+
+
+class localScheduler(object):
+    """
+    Runs jobs submitted with the LOCAL grid engine on this machine, starting queued jobs (in submission order,
+    but letting later jobs use any cores left over) whenever there are enough free cores for their
+    MPI chains x OpenMP threads. Job states are stored in the job index.
+    """
+
+    def __init__(self, batchPath=None, cores=None, poll=2, idle_exit=30):
+        """
+        :param batchPath: directory of the job index
+        :param cores: number of cores to use (default: all)
+        :param poll: seconds between checks for finished and newly queued jobs
+        :param idle_exit: exit after this many seconds with nothing running or queued
+        """
+        self.batchPath = batchPath or './scripts/'
+        self.cores = cores or multiprocessing.cpu_count()
+        self.poll = poll
+        self.idle_exit = idle_exit
+        self.processes = dict()
+
+    def lockFileName(self):
+        return os.path.join(self.batchPath, 'local_scheduler.lock')
+
+    def update(self, index):
+        """
+        Record finished jobs and start queued jobs that fit in the free cores
+
+        :param index: the :class:`jobIndex`, updated in place
+        :return: number of jobs still running or queued
+        """
+        for jobId, proc in list(self.processes.items()):
+            if proc.poll() is not None:
+                del self.processes[jobId]
+                j = index.jobSettings.get(jobId)
+                if j is not None and j.localState == 'running':
+                    j.localState = ('failed', 'done')[proc.returncode == 0]
+                    j.endTime = time.time()
+        used = sum(index.jobSettings[jobId].localCores for jobId in self.processes if jobId in index.jobSettings)
+        queued = 0
+        for jobId in index.jobSequence:
+            j = index.jobSettings[jobId]
+            if getattr(j, 'gridEngine', None) != 'LOCAL' or j.localState != 'queued': continue
+            # jobs needing more than all the cores are run on their own
+            if used + j.localCores <= self.cores or not self.processes:
+                with open(j.logName, 'a') as out:
+                    proc = subprocess.Popen(['bash', j.scriptName], cwd=j.path, stdout=out,
+                                            stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid)
+                self.processes[jobId] = proc
+                j.localState = 'running'
+                j.pid = proc.pid
+                j.startTime = time.time()
+                used += j.localCores
+                print('%s started %s (%u cores)' % (time.strftime('%c'), j.jobName, j.localCores))
+                sys.stdout.flush()
+            else:
+                queued += 1
+        return len(self.processes) + queued
+
+    def run(self):
+        """
+        Run until there is nothing left to do
+
+        :return: False if another scheduler is already running for this job index, True otherwise
+        """
+        with open(self.lockFileName(), 'a') as lock:
+            if fcntl:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return False
+            idle_start = None
+            while True:
+                with jobIndexLock(self.batchPath):
+                    index = loadJobIndex(self.batchPath)
+                    active = self.update(index)
+                    saveJobIndex(index, self.batchPath)
+                if active:
+                    idle_start = None
+                elif idle_start is None:
+                    idle_start = time.time()
+                elif time.time() - idle_start > self.idle_exit:
+                    return True
+                time.sleep(self.poll)
+
+
+def startLocalScheduler(batchPath=None, cores=None):
+    """
+    Start a local scheduler process in the background for the given job index, unless one is already running
+    """
+    scheduler = localScheduler(batchPath, cores)
+    if fcntl:
+        with open(scheduler.lockFileName(), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            except IOError:
+                return
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+                                        [p for p in [env.get('PYTHONPATH')] if p])
+    args = [sys.executable, '-m', 'paramgrid.jobqueue', os.path.abspath(scheduler.batchPath)]
+    if cores: args += ['--cores', str(cores)]
+    with open(os.path.join(scheduler.batchPath, 'local_scheduler.log'), 'a') as log:
+        subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, close_fds=True, env=env,
+                         preexec_fn=os.setsid)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run jobs submitted with --local')
+    parser.add_argument('batchPath', help='directory containing the job index')
+    parser.add_argument('--cores', type=int, help='number of cores to use')
+    parser.add_argument('--poll', type=float, default=2)
+    parser.add_argument('--idle_exit', type=float, default=30)
+    args = parser.parse_args()
+    localScheduler(args.batchPath, args.cores, args.poll, args.idle_exit).run()
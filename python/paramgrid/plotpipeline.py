@@ -0,0 +1,218 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import time
+import runpy
+import multiprocessing
+import six
+
+"""
+Pipeline for making many grid plots: plots are grouped by their main root, so that densities are mostly calculated
+once (by one worker's cached sample analyser), and groups are rendered and exported across a pool of worker
+processes.
+"""
+
+_worker_plotter = None
+_worker_plotter_args = None
+
+
+class plotTask(object):
+    def __init__(self, name, roots, outputs, kind='1D', **kwargs):
+        """
+        :param name: name used for progress and timing reports
+        :param roots: list of root names used in the plot
+        :param outputs: list of output file names to export the plot to
+        :param kind: type of plot: '1D', '2D' or 'tri'
+        :param kwargs: arguments for the plotter function making the plot
+        """
+        self.name = name
+        self.roots = list(roots)
+        self.outputs = list(outputs)
+        self.kind = kind
+        self.kwargs = kwargs
+
+
+def groupTasks(tasks, maxSize=None):
+    """
+    Partition tasks into groups of tasks with the same (first) root, so that each group can re-use the
+    densities cached by one plotter. Roots shared between groups (e.g. a baseline in every comparison) do not merge
+    groups, and large groups are split so that work can still be shared between workers.
+
+    :param tasks: list of :class:`plotTask` (or any object with a roots attribute)
+    :param maxSize: maximum number of tasks in each group (default no limit)
+    :return: list of lists of tasks, largest groups first
+    """
+    groups = dict()
+    order = []
+    for task in tasks:
+        key = task.roots[0] if task.roots else None
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(task)
+    result = []
+    for key in order:
+        group = groups[key]
+        size = maxSize or len(group)
+        result += [group[i:i + size] for i in range(0, len(group), size)]
+    return sorted(result, key=len, reverse=True)
+
+
+def makePlot(g, task):
+    """
+    Make and export the plot for a given task
+
+    :param g: a :class:`~getdist.plots.GetDistPlotter` instance
+    :param task: the :class:`plotTask`
+    :return: time in seconds taken
+    """
+    start = time.time()
+    g.newPlot()
+    if task.kind == '2D':
+        g.plots_2d(task.roots, **task.kwargs)
+    elif task.kind == 'tri':
+        g.triangle_plot(task.roots, **task.kwargs)
+    else:
+        g.plots_1d(task.roots, **task.kwargs)
+    for output in task.outputs:
+        g.export(output)
+    return time.time() - start
+
+
+def _initWorker(plotter_args):
+    global _worker_plotter_args
+    import matplotlib
+
+    matplotlib.use('Agg')
+    _worker_plotter_args = plotter_args
+
+
+def _getWorkerPlotter():
+    global _worker_plotter
+    if _worker_plotter is None:
+        import getdist.plots as plots
+
+        args = dict(_worker_plotter_args)
+        size_inch = args.pop('size_inch', None)
+        _worker_plotter = plots.GetDistPlotter(**args)
+        if size_inch is not None: _worker_plotter.settings.setWithSubplotSize(size_inch)
+    return _worker_plotter
+
+
+def _runTaskGroup(tasks):
+    g = _getWorkerPlotter()
+    results = []
+    for task in tasks:
+        try:
+            results.append((task.name, makePlot(g, task), None))
+        except Exception as e:
+            results.append((task.name, None, '%s: %s' % (type(e).__name__, e)))
+    return results
+
+
+def _runScript(script):
+    start = time.time()
+    try:
+        runpy.run_path(script, run_name='__main__')
+        import matplotlib.pyplot as plt
+
+        plt.close('all')
+        return script, time.time() - start, None
+    except Exception as e:
+        return script, None, '%s: %s' % (type(e).__name__, e)
+
+
+def _reportResult(name, seconds, error):
+    if error:
+        print('FAILED %s: %s' % (name, error))
+    else:
+        print('%7.2fs  %s' % (seconds, name))
+
+
+def _runPool(func, items, procs, initargs=None):
+    results = []
+    pool = multiprocessing.Pool(procs, initializer=_initWorker, initargs=(initargs or {},))
+    try:
+        for res in pool.imap_unordered(func, items):
+            for name, seconds, error in res if isinstance(res, list) else [res]:
+                _reportResult(name, seconds, error)
+                results.append((name, seconds, error))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def _summary(results, start):
+    times = [r[1] for r in results if r[2] is None]
+    failed = len(results) - len(times)
+    print('Made %u figures in %.1fs (total render time %.1fs)%s' % (
+        len(times), time.time() - start, sum(times), (', %u failed' % failed) if failed else ''))
+
+
+def runTasks(tasks, plotter_args, procs=1, g=None):
+    """
+    Make plots for all tasks, grouped by roots, in parallel across a process pool
+
+    :param tasks: list of :class:`plotTask`
+    :param plotter_args: dict of arguments to make a :class:`~getdist.plots.GetDistPlotter` in each worker
+                         (plus optional size_inch for the subplot size)
+    :param procs: number of worker processes; if 1 run serially in this process
+    :param g: optional existing plotter to use if running serially
+    :return: list of (name, seconds, error) for each task
+    """
+    global _worker_plotter
+    start = time.time()
+    if procs > 1 and len(tasks) > 1:
+        # enough groups to keep all workers busy to the end
+        maxSize = max(1, len(tasks) // (procs * 4))
+        results = _runPool(_runTaskGroup, groupTasks(tasks, maxSize), procs, plotter_args)
+    else:
+        _initWorker(plotter_args)
+        if g is None:
+            g = _getWorkerPlotter()
+        results = []
+        for group in groupTasks(tasks):
+            _worker_plotter = g
+            for res in _runTaskGroup(group):
+                _reportResult(*res)
+                results.append(res)
+    _summary(results, start)
+    return results
+
+
+def runScripts(scripts, procs=1):
+    """
+    Run a set of standalone plot scripts (e.g. as produced by GetDist) across a process pool
+
+    :param scripts: list of python script file names
+    :param procs: number of worker processes
+    :return: list of (script, seconds, error) for each script
+    """
+    start = time.time()
+    if isinstance(scripts, six.string_types): scripts = [scripts]
+    if procs > 1 and len(scripts) > 1:
+        results = _runPool(_runScript, scripts, procs)
+    else:
+        results = []
+        for script in scripts:
+            res = _runScript(script)
+            _reportResult(*res)
+            results.append(res)
+    _summary(results, start)
+    return results
+
+
+def distPlotScripts(jobItem, ext='py'):
+    """
+    Get the plot scripts written by GetDist for a grid item
+
+    :param jobItem: a :class:`~paramgrid.batchjob.jobItem`
+    :param ext: script extension
+    :return: list of existing script file names
+    """
+    return [jobItem.distRoot + tag + '.' + ext for tag in ['', '_2D', '_tri', '_3D']
+            if os.path.exists(jobItem.distRoot + tag + '.' + ext)]
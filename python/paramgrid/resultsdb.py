@@ -0,0 +1,261 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import pickle
+import hashlib
+import sqlite3
+import multiprocessing
+from getdist import types
+from getdist.paramnames import ParamNames
+
+"""
+SQLite index of parsed grid results (.margestats, .likestats, .converge and .minimum files), so that tools
+querying many job items do not need to re-parse thousands of text files. Entries are refreshed incrementally
+whenever the modification time or size of the underlying file changes.
+"""
+
+# increment if the stored format (or the pickled result classes) change incompatibly
+schema_version = 1
+
+# kind: (file extension, root attribute of the jobItem, result class)
+result_kinds = {'marge': ('.margestats', 'distRoot', types.MargeStats),
+                'like': ('.likestats', 'distRoot', types.LikeStats),
+                'converge': ('.converge', 'distRoot', types.ConvergeStats),
+                'bestfit': ('.minimum', 'chainRoot', types.BestFit)}
+
+
+def resultFileName(jobItem, kind):
+    ext, root, _ = result_kinds[kind]
+    return getattr(jobItem, root) + ext
+
+
+def _parseTask(task):
+    # parse a result file (in a worker process)
+    jobItem, kind, state = task
+    try:
+        return jobItem, kind, state, result_kinds[kind][2](resultFileName(jobItem, kind)), None
+    except Exception as e:
+        return jobItem, kind, state, None, e
+
+
+def _combinedTask(task):
+    # marginalized statistics for the combined samples of two job items (in a worker process)
+    jobItem1, jobItem2, kind, state, settings = task
+    try:
+        samps = jobItem1.getMCSamples(settings=settings).getCombinedSamplesWithSamples(
+            jobItem2.getMCSamples(settings=settings))
+        return jobItem1, jobItem2, kind, state, samps.getMargeStats(), None
+    except Exception as e:
+        return jobItem1, jobItem2, kind, state, None, e
+
+
+def _runTasks(func, tasks, procs):
+    if procs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(procs, len(tasks)))
+        try:
+            for res in pool.imap_unordered(func, tasks, chunksize=max(1, len(tasks) // (procs * 8))):
+                yield res
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for task in tasks:
+            yield func(task)
+
+
+class resultsDB(object):
+    def __init__(self, filename):
+        """
+        :param filename: SQLite database file name (created if it does not exist)
+        """
+        self.filename = filename
+        self.readOnly = False
+        self.paramNames = dict()
+        try:
+            self.conn = sqlite3.connect(filename, timeout=60)
+        except sqlite3.OperationalError:
+            # cannot create the file, just cache in memory for this session
+            self.conn = sqlite3.connect(':memory:')
+        try:
+            if self.conn.execute('PRAGMA user_version').fetchone()[0] != schema_version:
+                self.conn.execute('DROP TABLE IF EXISTS results')
+                self.conn.execute('PRAGMA user_version = %u' % schema_version)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS results (name TEXT NOT NULL, kind TEXT NOT NULL, '
+                              'paramtag TEXT, datatag TEXT, mtime REAL, size INTEGER, data BLOB, '
+                              'PRIMARY KEY (name, kind))')
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            # e.g. read-only grid; can still use any existing entries
+            self.readOnly = True
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _fileState(self, fname):
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            return None
+        if not stat.st_size: return None
+        return stat.st_mtime, stat.st_size
+
+    def _parse(self, jobItem, kind):
+        return result_kinds[kind][2](resultFileName(jobItem, kind))
+
+    def _store(self, rows):
+        if self.readOnly or not rows: return
+        try:
+            self.conn.executemany('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?)', rows)
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.readOnly = True
+
+    def _delete(self, keys):
+        if self.readOnly or not keys: return
+        try:
+            self.conn.executemany('DELETE FROM results WHERE name=? AND kind=?', keys)
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.readOnly = True
+
+    def _row(self, jobItem, kind, state, result):
+        return (jobItem.name, kind, jobItem.paramtag, jobItem.datatag, state[0], state[1],
+                sqlite3.Binary(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+
+    def update(self, jobItems, kinds=None, force=False, procs=1):
+        """
+        Bring the stored results for the given job items up to date with the files on disk
+
+        :param jobItems: iterable of :class:`~paramgrid.batchjob.jobItem` instances
+        :param kinds: list of result kinds to update (default all, keys of result_kinds)
+        :param force: re-parse all files even if they appear unchanged
+        :param procs: number of processes to use for parsing files
+        :return: number of results (re)parsed
+        """
+        kinds = kinds or list(result_kinds)
+        tasks = []
+        deletes = []
+        for jobItem in jobItems:
+            stored = dict((kind, (mtime, size)) for kind, mtime, size in self.conn.execute(
+                'SELECT kind, mtime, size FROM results WHERE name=?', (jobItem.name,)))
+            for kind in kinds:
+                state = self._fileState(resultFileName(jobItem, kind))
+                if state is None:
+                    if kind in stored: deletes.append((jobItem.name, kind))
+                elif force or stored.get(kind) != state:
+                    tasks.append((jobItem, kind, state))
+        rows = []
+        for jobItem, kind, state, result, error in _runTasks(_parseTask, tasks, procs):
+            if error is not None:
+                print('Error reading %s: %s' % (resultFileName(jobItem, kind), error))
+            else:
+                rows.append(self._row(jobItem, kind, state, result))
+        self._store(rows)
+        self._delete(deletes)
+        return len(rows)
+
+    def result(self, jobItem, kind):
+        """
+        Get a result for a job item, from the database if up to date, otherwise re-parsing (and storing)
+        the file.
+
+        :param jobItem: a :class:`~paramgrid.batchjob.jobItem`
+        :param kind: 'marge', 'like', 'converge' or 'bestfit'
+        :return: :class:`~getdist.types.MargeStats`, :class:`~getdist.types.LikeStats`,
+                 :class:`~getdist.types.ConvergeStats` or :class:`~getdist.types.BestFit` instance,
+                 or None if the file does not exist
+        """
+        state = self._fileState(resultFileName(jobItem, kind))
+        if state is None: return None
+        result = self._storedResult(jobItem.name, kind, state)
+        if result is not None: return result
+        result = self._parse(jobItem, kind)
+        self._store([self._row(jobItem, kind, state, result)])
+        return result
+
+    def _combinedKey(self, jobItem1, jobItem2, settings):
+        # results depend on the analysis settings, so include a hash of them in the kind
+        kind = 'combined_' + hashlib.md5(repr(sorted((settings or {}).items())).encode('utf-8')).hexdigest()[:12]
+        files = [name for jobItem in [jobItem1, jobItem2] for name in jobItem.chainNames()]
+        if not files: return None
+        states = [self._fileState(name) for name in files]
+        if None in states: return None
+        state = (max(st[0] for st in states), sum(st[1] for st in states))
+        return jobItem1.name + '+' + jobItem2.name, kind, state
+
+    def _combinedRow(self, jobItem1, jobItem2, key, result):
+        return (key[0], key[1], jobItem1.paramtag, jobItem1.datatag + '+' + jobItem2.datatag, key[2][0],
+                key[2][1], sqlite3.Binary(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+
+    def _storedResult(self, name, kind, state):
+        row = self.conn.execute('SELECT mtime, size, data FROM results WHERE name=? AND kind=?',
+                                (name, kind)).fetchone()
+        if row is not None and tuple(row[:2]) == state:
+            try:
+                return pickle.loads(bytes(row[2]))
+            except Exception:
+                pass
+        return None
+
+    def updateCombined(self, pairs, settings=None, procs=1):
+        """
+        Calculate (in parallel) and store marginalized statistics for combined samples of pairs of job items,
+        as used for systematic averages, where not already up to date.
+
+        :param pairs: list of (jobItem1, jobItem2) tuples
+        :param settings: dictionary of analysis settings for loading the samples
+        :param procs: number of processes
+        :return: number of combinations calculated
+        """
+        tasks = []
+        for jobItem1, jobItem2 in pairs:
+            key = self._combinedKey(jobItem1, jobItem2, settings)
+            if key is not None and self._storedResult(*key) is None:
+                tasks.append((jobItem1, jobItem2, key[1], key[2], settings))
+        rows = []
+        for jobItem1, jobItem2, kind, state, result, error in _runTasks(_combinedTask, tasks, procs):
+            if error is not None:
+                print('Error combining %s, %s: %s' % (jobItem1.name, jobItem2.name, error))
+            else:
+                rows.append(self._combinedRow(jobItem1, jobItem2, (jobItem1.name + '+' + jobItem2.name, kind, state),
+                                              result))
+        self._store(rows)
+        return len(rows)
+
+    def combinedMargeStats(self, jobItem1, jobItem2, settings=None):
+        """
+        Get marginalized statistics for the combined samples of two job items (equal total weight for each),
+        from the database if the chains are unchanged.
+
+        :param jobItem1: a :class:`~paramgrid.batchjob.jobItem`
+        :param jobItem2: another :class:`~paramgrid.batchjob.jobItem`
+        :param settings: dictionary of analysis settings for loading the samples
+        :return: :class:`~getdist.types.MargeStats` instance
+        """
+        key = self._combinedKey(jobItem1, jobItem2, settings)
+        if key is not None:
+            result = self._storedResult(*key)
+            if result is not None: return result
+        _, _, _, _, result, error = _combinedTask((jobItem1, jobItem2, None, None, settings))
+        if error is not None: raise error
+        if key is not None: self._store([self._combinedRow(jobItem1, jobItem2, key, result)])
+        return result
+
+    def labelled(self, result, paramNameFile):
+        """
+        Set labels from a .paramnames file, as when passing a paramNameFile to the result class constructor
+        """
+        if result is not None and paramNameFile is not None:
+            if paramNameFile not in self.paramNames:
+                self.paramNames[paramNameFile] = ParamNames(paramNameFile)
+            result.setLabelsFromParamNames(self.paramNames[paramNameFile])
+        return result
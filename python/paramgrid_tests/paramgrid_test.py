@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from paramgrid import jobqueue
+
+
+class LocalJobTest(unittest.TestCase):
+    """test the job scripts written for the paramgrid local scheduler"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tempdir, 'scripts'))
+        os.chdir(self.tempdir)
+        # run the program directly rather than with mpirun
+        with open('job_script', 'w') as f:
+            f.write('##RUN: ##PROGRAM## > ./scripts/##INIBASE##.log##\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def runScript(self, name, program, sequential=False):
+        jobqueue.submitJob(name, ['ok', 'run'], sequential=sequential, local=True, no_sub=True, program=program,
+                           chainsPerNode=1)
+        return subprocess.call(['bash', os.path.join('scripts', name + '_subscript')])
+
+    def testLocalJobStatus(self):
+        self.assertEqual(self.runScript('passjob', 'true'), 0)
+        self.assertNotEqual(self.runScript('failjob', 'false'), 0)
+        self.assertNotEqual(self.runScript('seqjob', 'false', sequential=True), 0)
+
+    def testLocalJobCores(self):
+        j = jobqueue.jobSettings('cores', local=True, chainsPerNode=2, omp=3)
+        self.assertEqual(j.coresPerNode, 6)
+        j = jobqueue.jobSettings('cores', local=True, chainsPerNode=2, coresPerNode=8)
+        self.assertEqual(j.omp, 4)
@@ -14,6 +14,7 @@ except ImportError:
 
 from camb import model, correlations
 from scipy.interpolate import UnivariateSpline
+from planck import datacache
 
 # accuracy parameter
 acc = 1
@@ -87,8 +88,52 @@ def get_def_cuts():
     return ranges
 
 
+class CosmologyState(object):
+    def __init__(self, like, pars, results, PKdelta, PKWeyl=None):
+        """
+        Quantities for the DES theory calculation that depend only on the cosmology (not on DES nuisance
+        parameters): distances, growth and the Limber integrand matrices.
+
+        :param like: the :class:`DES_like` instance
+        :param pars: CAMBparams instance
+        :param results: CAMB background results
+        :param PKdelta: matter power spectrum interpolator
+        :param PKWeyl: Weyl potential power spectrum interpolator if used for lensing
+        """
+        self.pars = pars
+        self.results = results
+        self.PKdelta = PKdelta
+        self.PKWeyl = PKWeyl
+        if acc > 1:
+            self.zs = np.linspace(0.005, like.zmax, int(350 * acc))
+        else:
+            self.zs = like.zmid[like.zmid <= like.zmax]
+        zs = self.zs
+        chis = results.comoving_radial_distance(zs)
+        self.chis = chis
+        self.dchis = np.hstack(((chis[1] + chis[0]) / 2, (chis[2:] - chis[:-2]) / 2, (chis[-1] - chis[-2])))
+        self.Hs = results.h_of_z(zs)
+        D_growth = PKdelta.P(zs, 0.001)
+        self.D_growth = np.sqrt(D_growth / PKdelta.P(0, 0.001))
+        self.h2 = (pars.H0 / 100) ** 2
+        self.omm = pars.omegab + pars.omegac + pars.omegan
+        self.ls_cl = np.array(np.hstack(
+            (np.arange(2., 100 - 4 / acc, 4 / acc),
+             np.exp(np.linspace(np.log(100.), np.log(like.lmax), int(50 * acc))))))
+        dchifac = self.dchis / chis ** 2
+        self.tmp = like.limber_matrix(PKdelta, self.ls_cl, zs, chis, dchifac)
+        if PKWeyl is not None:
+            self.tmplens = like.limber_matrix(PKWeyl, self.ls_cl, zs, chis, dchifac)
+        else:
+            self.tmplens = self.tmp
+
+    def matches(self, results, PKdelta, PKWeyl=None):
+        return results is self.results and PKdelta is self.PKdelta and PKWeyl is self.PKWeyl
+
+
 class DES_like(object):
-    def __init__(self, filename, dataset_params={}, lmax=int(50000 * acc), use_hankel=False, use_Weyl=False):
+    def __init__(self, filename, dataset_params={}, lmax=int(50000 * acc), use_hankel=False, use_Weyl=False,
+                 use_cache=True):
         """
         Load DES likelihood, from original DES .fits file or from CosmoMC-converted text-based .dataset file.
 
@@ -97,7 +142,13 @@ class DES_like(object):
             e.g. dataset_params={'used_data_types':'xip xim'} would get lensing only
         :param lmax: lmax to use internally
         :param use_hankel: use hankel module for Bessel transforms. For checking.
+        :param use_Weyl: use the Weyl potential power spectrum for lensing
+        :param use_cache: cache the Bessel transform matrices in binary files (see planck.datacache)
         """
+        self.filename = filename
+        self.use_cache = use_cache
+        self.cosmology_state = None
+        self._cosmology_params = None
         self.lmax = lmax
         self.use_hankel = use_hankel
         self.use_Weyl = use_Weyl
@@ -412,54 +463,68 @@ class DES_like(object):
             self.hankel0 = hankel.HankelTransform(nu=0, N=N, h=h)
             self.hankel2 = hankel.HankelTransform(nu=2, N=N, h=h)
             self.hankel4 = hankel.HankelTransform(nu=4, N=N, h=h)
-        elif _binned_bessels:
-            # Approximate bessel integral as binned smooth C_L against integrals of bessel in each bin.
-            # Here we crudely precompute an approximation to the bessel integral by brute force
-            dls = np.diff(np.unique((np.exp(np.linspace(np.log(1.), np.log(self.lmax), int(500 * acc)))).astype(
-                np.int)))
-            groups = []
-            ell = 2  # ell_min
-            self.ls_bessel = np.zeros(dls.size)
-            for i, dlx in enumerate(dls):
-                self.ls_bessel[i] = (2 * ell + dlx - 1) / 2.
-                groups.append(np.arange(ell, ell + dlx))
-                ell += dlx
-            js = np.empty((3, self.ls_bessel.size, len(self.theta_bins_radians)))
-            bigell = np.arange(0, self.lmax + 1, dtype=np.float64)
-            for i, theta in enumerate(self.theta_bins_radians):
-                bigx = bigell * theta
-                for ix, nu in enumerate([0, 2, 4]):
-                    bigj = scipy.special.jn(nu, bigx) * bigell / (2 * np.pi)
-                    for j, g in enumerate(groups):
-                        js[ix, j, i] = np.sum(bigj[g])
-            self.bessel_cache = js[0, :, :], js[1, :, :], js[2, :, :]
         else:
-            # get ell for bessel transform in dense array, and precompute bessel function matrices
-            # Much slower than _binned_bessels as many more sampling points
-            dl = 4
-            self.ls_bessel = np.arange(2 + dl / 2, self.lmax + 1, dl, dtype=np.float64)
-
-            j0s = np.empty((len(self.ls_bessel), len(self.theta_bins_radians)))
-            j2s = np.empty((len(self.ls_bessel), len(self.theta_bins_radians)))
-            j4s = np.empty((len(self.ls_bessel), len(self.theta_bins_radians)))
-            for i, theta in enumerate(self.theta_bins_radians):
-                x = self.ls_bessel * theta
-                j0s[:, i] = self.ls_bessel * scipy.special.jn(0, x)
-                j2s[:, i] = self.ls_bessel * scipy.special.jn(2, x)
-                j4s[:, i] = self.ls_bessel * scipy.special.jn(4, x)
-            j0s *= dl / (2 * np.pi)
-            j2s *= dl / (2 * np.pi)
-            j4s *= dl / (2 * np.pi)
-            self.bessel_cache = j0s, j2s, j4s
+            def compute():
+                if _binned_bessels:
+                    return self._binned_bessel_matrices()
+                else:
+                    return self._dense_bessel_matrices()
+
+            # only depends on theta bins and ell sampling, so store to avoid recomputing each time
+            if self.use_cache:
+                cache = datacache.cached_arrays('DES_bessels', [self.filename],
+                                                (self.theta_bins_radians.tolist(), self.lmax, acc, _binned_bessels),
+                                                compute)
+            else:
+                cache = compute()
+            self.ls_bessel = cache['ls_bessel']
+            self.bessel_cache = cache['j0s'], cache['j2s'], cache['j4s']
+
+    def _binned_bessel_matrices(self):
+        # Approximate bessel integral as binned smooth C_L against integrals of bessel in each bin.
+        # Here we crudely precompute an approximation to the bessel integral by brute force
+        dls = np.diff(np.unique((np.exp(np.linspace(np.log(1.), np.log(self.lmax), int(500 * acc)))).astype(
+            np.int)))
+        ell_min = 2
+        starts = ell_min + np.hstack(([0], np.cumsum(dls[:-1])))
+        ls_bessel = (2 * starts + dls - 1) / 2.
+        bigell = np.arange(ell_min, starts[-1] + dls[-1], dtype=np.float64)
+        bigx = np.outer(bigell, self.theta_bins_radians)
+        js = dict(ls_bessel=ls_bessel)
+        for nu in [0, 2, 4]:
+            bigj = scipy.special.jn(nu, bigx) * (bigell / (2 * np.pi))[:, np.newaxis]
+            # sum over the L in each group
+            js['j%ss' % nu] = np.add.reduceat(bigj, starts - ell_min, axis=0)
+        return js
+
+    def _dense_bessel_matrices(self):
+        # get ell for bessel transform in dense array, and precompute bessel function matrices
+        # Much slower than _binned_bessels as many more sampling points
+        dl = 4
+        ls_bessel = np.arange(2 + dl / 2, self.lmax + 1, dl, dtype=np.float64)
+        x = np.outer(ls_bessel, self.theta_bins_radians)
+        js = dict(ls_bessel=ls_bessel)
+        for nu in [0, 2, 4]:
+            js['j%ss' % nu] = scipy.special.jn(nu, x) * (ls_bessel * dl / (2 * np.pi))[:, np.newaxis]
+        return js
 
     def get_theory_for_params(self, paramdic, camb_pars=None, camb_results=None):
-        if camb_pars is None:
-            from cosmomc_to_camb import get_camb_params
-            camb_pars = get_camb_params(paramdic)
-        if camb_results is not None:
-            results, PKdelta, PKWeyl = camb_results
+        # If only DES nuisance parameters have changed since the last call, re-use the CAMB results and
+        # cosmology-dependent quantities, so that only the (fast) kernel and transform calculations are redone
+        cosmology_params = sorted((key, value) for key, value in paramdic.items() if not key.startswith('DES_'))
+        state = self.cosmology_state
+        if camb_pars is None and camb_results is None and state is not None and \
+                cosmology_params == self._cosmology_params:
+            camb_pars, results, PKdelta, PKWeyl = state.pars, state.results, state.PKdelta, state.PKWeyl
         else:
-            results, PKdelta, PKWeyl = self.get_camb_theory(camb_pars)
+            self._cosmology_params = cosmology_params if camb_pars is None and camb_results is None else None
+            if camb_pars is None:
+                from cosmomc_to_camb import get_camb_params
+                camb_pars = get_camb_params(paramdic)
+            if camb_results is not None:
+                results, PKdelta, PKWeyl = camb_results
+            else:
+                results, PKdelta, PKWeyl = self.get_camb_theory(camb_pars)
         wl_photoz_errors = [paramdic['DES_DzS1'], paramdic['DES_DzS2'], paramdic['DES_DzS3'], paramdic['DES_DzS4']]
         lens_photoz_errors = [paramdic['DES_DzL1'], paramdic['DES_DzL2'], paramdic['DES_DzL3'], paramdic['DES_DzL4'],
                               paramdic['DES_DzL5']]
@@ -472,40 +537,61 @@ class DES_like(object):
                                intrinsic_alignment_A=paramdic['DES_AIA'],
                                intrinsic_alignment_alpha=paramdic['DES_alphaIA'], intrinsic_alignment_z0=0.62)
 
+    def limber_matrix(self, PK, ls, zs, chis, dchifac):
+        """
+        Get the matrix that gives Limber-approximation C_L from products of radial kernels
+
+        :param PK: power spectrum interpolator
+        :param ls: array of L values
+        :param zs: redshifts of the radial integration points
+        :param chis: comoving distances of the integration points
+        :param dchifac: integration weights divided by chi^2
+        :return: array [L, z] of dchifac * P(z, k=(L+1/2)/chi), zero outside the range of k
+        """
+        k = (ls[:, np.newaxis] + 0.5) / chis
+        used = (k >= 1e-4) & (k < PK.kmax)
+        # evaluate at all needed (L, z) pairs with one interpolator call
+        tmp = np.zeros(k.shape)
+        tmp[used] = np.broadcast_to(dchifac, k.shape)[used] * PK.P(np.broadcast_to(zs, k.shape)[used], k[used],
+                                                                   grid=False)
+        return tmp
+
+    def get_cosmology_state(self, pars, results, PKdelta, PKWeyl=None):
+        """
+        Get the cosmology-dependent part of the theory calculation, re-using the last one if calculated
+        from the same CAMB results
+
+        :param pars: CAMBparams instance
+        :param results: CAMB background results
+        :param PKdelta: matter power spectrum interpolator
+        :param PKWeyl: Weyl potential power spectrum interpolator if used for lensing
+        :return: :class:`CosmologyState` instance
+        """
+        if self.cosmology_state is None or not self.cosmology_state.matches(results, PKdelta, PKWeyl):
+            self.cosmology_state = CosmologyState(self, pars, results, PKdelta, PKWeyl)
+        return self.cosmology_state
+
     def get_theory(self, pars, results, PKdelta, PKWeyl=None, bin_bias=[1.45, 1.55, 1.65, 1.8, 2.0],
                    shear_calibration_parameters=[0.012] * 4,
                    intrinsic_alignment_A=1.0, intrinsic_alignment_alpha=1.0, intrinsic_alignment_z0=0.62,
                    wl_photoz_errors=[0.002, -0.015, 0.007, -0.018],
                    lens_photoz_errors=[0.002, 0.001, 0.003, 0.0, 0.0]):
-        if acc > 1:
-            zs = np.linspace(0.005, self.zmax, int(350 * acc))
-        else:
-            zs = self.zmid[self.zmid <= self.zmax]
-
-        chis = results.comoving_radial_distance(zs)
-        dchis = np.hstack(((chis[1] + chis[0]) / 2, (chis[2:] - chis[:-2]) / 2, (chis[-1] - chis[-2])))
-        Hs = results.h_of_z(zs)
-        D_growth = PKdelta.P(zs, 0.001)
-        D_growth = np.sqrt(D_growth / PKdelta.P(0, 0.001))
-        h2 = (pars.H0 / 100) ** 2
-        omm = pars.omegab + pars.omegac + pars.omegan
+        state = self.get_cosmology_state(pars, results, PKdelta, PKWeyl)
+        zs, chis, dchis, Hs = state.zs, state.chis, state.dchis, state.Hs
+        h2 = state.h2
         c = 299792458.
 
         def get_wq():
             Alignment_z = intrinsic_alignment_A * ((1 + zs) / (
-                    1 + intrinsic_alignment_z0)) ** intrinsic_alignment_alpha * 0.0134 / D_growth
-            w = []
-            for b in range(self.nzbins):
-                w.append([])
-                zshift = zs - wl_photoz_errors[b]
-                n_chi = Hs * self.zbin_sp[b](zshift)
-                n_chi[zshift < 0] = 0
-                fac = n_chi * dchis
-                for i, chi in enumerate(chis):
-                    w[b].append(np.dot(fac[i:], (1 - chi / chis[i:])))
-                w_align = Alignment_z * n_chi / (chis * (1 + zs) * 3 * h2 * (1e5 / c) ** 2 / 2)
-                w[b] = np.asarray(w[b]) - w_align
-            return w
+                    1 + intrinsic_alignment_z0)) ** intrinsic_alignment_alpha * 0.0134 / state.D_growth
+            zshift = zs - np.asarray(wl_photoz_errors)[:, np.newaxis]
+            n_chi = Hs * np.array([self.zbin_sp[b](zshift[b]) for b in range(self.nzbins)])
+            n_chi[zshift < 0] = 0
+            fac = n_chi * dchis
+            # w_i = sum_{j>=i} fac_j (1 - chi_i / chi_j), using cumulative sums from the far end
+            w = np.cumsum(fac[:, ::-1], axis=1)[:, ::-1] - chis * np.cumsum((fac / chis)[:, ::-1], axis=1)[:, ::-1]
+            w_align = Alignment_z * n_chi / (chis * (1 + zs) * 3 * h2 * (1e5 / c) ** 2 / 2)
+            return w - w_align
 
         def get_qgal():
             w = []
@@ -524,34 +610,13 @@ class DES_like(object):
                 raise ValueError('DES currently only supports Weyl potential for lensing only')
             qs = chis * wq
         else:
-            qs = 1.5 * omm * h2 * (1e5 / c) ** 2 * chis * (1 + zs) * wq
-        ls_cl = np.array(np.hstack(
-            (np.arange(2., 100 - 4 / acc, 4 / acc),
-             np.exp(np.linspace(np.log(100.), np.log(self.lmax), int(50 * acc))))))
+            qs = 1.5 * state.omm * h2 * (1e5 / c) ** 2 * chis * (1 + zs) * wq
+        ls_cl = state.ls_cl
+        tmp = state.tmp
+        tmplens = state.tmplens
 
         # Get the angular power spectra and transform back
 
-        weight = np.empty(chis.shape)
-        dchifac = dchis / chis ** 2
-        tmp = np.empty((ls_cl.shape[0], chis.shape[0]))
-        for ix, l in enumerate(ls_cl):
-            k = (l + 0.5) / chis
-            weight[:] = dchifac
-            weight[k < 1e-4] = 0
-            weight[k >= PKdelta.kmax] = 0
-            tmp[ix, :] = weight * PKdelta.P(zs, k, grid=False)
-
-        if PKWeyl is not None:
-            tmplens = np.empty((ls_cl.shape[0], chis.shape[0]))
-            for ix, l in enumerate(ls_cl):
-                k = (l + 0.5) / chis
-                weight[:] = dchifac
-                weight[k < 1e-4] = 0
-                weight[k >= PKWeyl.kmax] = 0
-                tmplens[ix, :] = weight * PKWeyl.P(zs, k, grid=False)
-        else:
-            tmplens = tmp
-
         corrs_th_p = np.empty((self.nzbins, self.nzbins), dtype=np.object)
         corrs_th_m = np.empty((self.nzbins, self.nzbins), dtype=np.object)
         corrs_th_w = np.empty((self.nwbins, self.nwbins), dtype=np.object)
@@ -682,8 +747,15 @@ def convert_txt(filename, root, outdir, ranges=None):
 
 
 if __name__ == "__main__":
+    import time
+
     like = DES_like(r'C:\Tmp\Planck\DES\simulation-main-paper-mcal-wcov.fits')
     pars = like.get_test_pars()
     results, PKdelta, PKWeyl = like.get_camb_theory(pars)
     theory = like.get_theory(pars, results, PKdelta, PKWeyl)
     print(like.chi_squared(theory))
+    # benchmark the 3x2pt theory calculation (excluding CAMB)
+    start = time.time()
+    for _ in range(10):
+        like.get_theory(pars, results, PKdelta, PKWeyl)
+    print('Theory execution time:', (time.time() - start) / 10)
@@ -17,29 +17,48 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import numpy as np
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.linalg.blas import get_blas_funcs
 from getdist import IniFile
+from planck import datacache
 import io
 import os
 
 _twopi = 2 * np.pi
 
 _marge_params = {'marge_steps': 7, 'step_width_alpha': 0.003, 'step_width_beta': 0.04,
-                 'alpha_centre': 0.14, 'beta_centre': 3.123}
+                 'alpha_centre': 0.14, 'beta_centre': 3.123, 'factor_dtype': 'float64', 'block_size': 8,
+                 'threads': 1, 'refine_tol': None, 'cache_factors': False}
 
 
 class SN_likelihood(object):
 
     def __init__(self, dataset, dataset_params={}, alpha_beta_names=['alpha', 'beta'],
-                 marginalize=False, marginalize_params=_marge_params, precompute_covmats=True, silent=False):
+                 marginalize=False, marginalize_params=_marge_params, precompute_covmats=True, silent=False,
+                 use_cache=True, factor_cache_size=8):
         """
 
         :param dataset: .dataset file with settings
         :param dataset_params:  dictionary of any parameter to override in teh .dataset file
         :param alpha_beta_names: names of alpha and beta parameters if used and varied
         :param marginalize: Marginalize over alpha, beta by dumb grid integration (slow, but useful for importance sampling)
-        :param marginalize_params: Dictionary of options for the grid marguinalization
-        :param precompute_covmats: if marginalizing, pre-compute covariance inverses at expense of memory (~600MB).
+        :param marginalize_params: Dictionary of options for the grid marguinalization. As well as the grid
+                                   steps, widths and centres, can set 'factor_dtype' (dtype for stored factors;
+                                   'float32' halves the memory but slightly changes the result),
+                                   'block_size' (number of grid points evaluated together), 'threads' (number of
+                                   threads to evaluate blocks), 'refine_tol' (if set, evaluate a coarse grid first
+                                   and then only refine near points with relative likelihood above refine_tol) and
+                                   'cache_factors' (if True and use_cache, also cache the pre-computed factors)
+        :param precompute_covmats: if marginalizing, pre-compute inverse Cholesky factors of the covariance at expense
+                                   of memory (~650MB in double precision for JLA); otherwise factorize on the fly.
         :param silent:  Don't print out stuff
+        :param use_cache: cache covariance matrices and their Cholesky factorization in binary files (see
+                          planck.datacache). The pre-computed marginalization factors are large (~650MB for JLA in
+                          double precision), so are only cached if marginalize_params['cache_factors'] is set.
+        :param factor_cache_size: number of Cholesky factorizations of the covariance for different alpha, beta
+                                  values to keep in memory
         """
 
         def relative_path(tag):
@@ -53,10 +72,12 @@ class SN_likelihood(object):
         ini = IniFile(dataset)
         ini.params.update(dataset_params)
         self.name = ini.string('name')
+        self.use_cache = use_cache
+        # (name may be overwritten by a data column)
+        self._cache_name = self.name
         data_file = relative_path('data_file')
         self.twoscriptmfit = ini.bool('twoscriptmfit')
-        if self.twoscriptmfit:
-            scriptmcut = ini.float('scriptmcut', 10.)
+        scriptmcut = ini.float('scriptmcut', 10.) if self.twoscriptmfit else None
 
         assert not ini.float('intrinsicdisp', 0) and not ini.float('intrinsicdisp0', 0)
         self.alpha_beta_names = alpha_beta_names
@@ -120,16 +141,21 @@ class SN_likelihood(object):
 
         covmats = ['mag', 'stretch', 'colour', 'mag_stretch', 'mag_colour', 'stretch_colour']
         self.covs = {}
+        self._cache_files = [data_file]
         for name in covmats:
             if ini.bool('has_%s_covmat' % name):
                 if not silent: print('Reading covmat for: %s ' % name)
                 self.covs[name] = self._read_covmat(relative_path('%s_covmat_file' % name))
+                self._cache_files.append(relative_path('%s_covmat_file' % name))
 
         self.alphabeta_covmat = len(self.covs.items()) > 1 or self.covs.get('mag', None) is None
-        self._last_alpha = np.inf
-        self._last_beta = np.inf
+        self._invcov = None
+        self._factors = OrderedDict()
+        self.factor_cache_size = factor_cache_size
         if alpha_beta_names is None and not marginalize: raise ValueError('Must give alpha, beta')
         assert self.covs
+        # settings the covariance depends on, as well as the cached files
+        self._cache_settings = (self.pecz, sorted(self.covs))
 
         # jla_prep
         zfacsq = 25.0 / np.log(10.0) ** 2
@@ -153,6 +179,7 @@ class SN_likelihood(object):
                 self.twoscriptmfit = False
             self.A1 = A1
             self.A2 = A2
+        self.n_templates = 2 if self.twoscriptmfit else 1
 
         if marginalize:
             self.marge_params = _marge_params.copy()
@@ -162,6 +189,8 @@ class SN_likelihood(object):
             _marge_steps = self.marge_params['marge_steps']
             self.alpha_grid = np.empty((2 * _marge_steps + 1) ** 2)
             self.beta_grid = self.alpha_grid.copy()
+            # integer grid coordinates, used for refinement
+            self.grid_index = np.empty(((2 * _marge_steps + 1) ** 2, 2), dtype=int)
             _int_points = 0
             for alpha_i in range(-_marge_steps, _marge_steps + 1):
                 for beta_i in range(-_marge_steps, _marge_steps + 1):
@@ -169,50 +198,85 @@ class SN_likelihood(object):
                         self.alpha_grid[_int_points] = self.marge_params[
                                                            'alpha_centre'] + alpha_i * self.step_width_alpha
                         self.beta_grid[_int_points] = self.marge_params['beta_centre'] + beta_i * self.step_width_beta
+                        self.grid_index[_int_points] = alpha_i, beta_i
                         _int_points += 1
             if not silent: print('Marignalizing alpha, beta over %s points' % _int_points)
             self.marge_grid = np.empty(_int_points)
             self.int_points = _int_points
             self.alpha_grid = self.alpha_grid[:_int_points]
             self.beta_grid = self.beta_grid[:_int_points]
-            self.invcovs = np.empty(_int_points, dtype=np.object)
+            self.grid_index = self.grid_index[:_int_points]
+            self.marge_block_size = max(1, self.marge_params['block_size'])
+            self.marge_threads = self.marge_params['threads']
+            self.marge_refine_tol = self.marge_params['refine_tol']
+            self.marge_factors = None
             if precompute_covmats:
-                for i, (alpha, beta) in enumerate(zip(self.alpha_grid, self.beta_grid)):
-                    self.invcovs[i] = self.inverse_covariance_matrix(alpha, beta)
+                dtype = np.dtype(self.marge_params['factor_dtype'])
+
+                def compute():
+                    factors = {'inv_chols': np.empty((_int_points, self.nsn, self.nsn), dtype=dtype),
+                               'weights': np.empty((_int_points, self.nsn, self.n_templates)),
+                               'products': np.empty((_int_points, self.n_templates, self.n_templates))}
+
+                    def factorize(indices):
+                        for i in indices:
+                            chol, weights, products = self._make_factor(
+                                np.linalg.cholesky(self.covariance_matrix(self.alpha_grid[i], self.beta_grid[i])))
+                            factors['inv_chols'][i] = solve_triangular(chol, np.eye(self.nsn), lower=True,
+                                                                       check_finite=False)
+                            factors['weights'][i] = weights
+                            factors['products'][i] = products
+
+                    self._map_blocks(factorize, np.arange(_int_points))
+                    return factors
+
+                if self.marge_params['cache_factors']:
+                    self.marge_factors = self._cached('marge_factors', self._cache_files,
+                                                      (self._cache_settings, scriptmcut if self.twoscriptmfit else None,
+                                                       self.alpha_grid.tolist(), self.beta_grid.tolist(), dtype.str),
+                                                      compute)
+                else:
+                    self.marge_factors = compute()
 
         elif not self.alphabeta_covmat:
-            self.inverse_covariance_matrix()
+            chol = self._cached('cholesky', self._cache_files, self._cache_settings,
+                                lambda: {'cholesky': np.linalg.cholesky(self.covariance_matrix())})['cholesky']
+            self._factors[None] = self._make_factor(chol)
+
+    def _cached(self, tag, files, settings, compute):
+        # dictionary of arrays calculated by compute() from files and the settings they depend on,
+        # using the binary cache if enabled
+        if not self.use_cache: return compute()
+        return datacache.cached_arrays(self._cache_name + '_' + tag, files, (self.nsn, settings), compute)
 
     def _read_covmat(self, filename):
-        cov = np.loadtxt(filename)
-        if np.isscalar(cov[0]) and cov[0] ** 2 + 1 == len(cov):
-            cov = cov[1:]
-        return cov.reshape((self.nsn, self.nsn))
+        def compute():
+            cov = np.loadtxt(filename)
+            if np.isscalar(cov[0]) and cov[0] ** 2 + 1 == len(cov):
+                cov = cov[1:]
+            return {'cov': cov.reshape((self.nsn, self.nsn))}
 
-    def inverse_covariance_matrix(self, alpha=0, beta=0):
+        return self._cached(os.path.splitext(os.path.basename(filename))[0], [filename], None, compute)['cov']
+
+    def covariance_matrix(self, alpha=0, beta=0):
         if 'mag' in self.covs:
-            invcovmat = self.covs['mag'].copy()
+            covmat = np.array(self.covs['mag'])
         else:
-            invcovmat = 0
+            covmat = 0
         if self.alphabeta_covmat:
-            if np.isclose(alpha, self._last_alpha) and np.isclose(beta, self._last_beta):
-                return self.invcov
-            self._last_alpha = alpha
-            self._last_beta = beta
-
             alphasq = alpha * alpha
             betasq = beta * beta
             alphabeta = alpha * beta
             if 'stretch' in self.covs:
-                invcovmat += alphasq * self.covs['stretch']
+                covmat += alphasq * self.covs['stretch']
             if 'colour' in self.covs:
-                invcovmat += betasq * self.covs['colour']
+                covmat += betasq * self.covs['colour']
             if 'mag_stretch' in self.covs:
-                invcovmat += 2 * alpha * self.covs['mag_stretch']
+                covmat += 2 * alpha * self.covs['mag_stretch']
             if 'mag_colour' in self.covs:
-                invcovmat -= 2 * beta * self.covs['mag_colour']
+                covmat -= 2 * beta * self.covs['mag_colour']
             if 'stretch_colour' in self.covs:
-                invcovmat -= 2 * alphabeta * self.covs['stretch_colour']
+                covmat -= 2 * alphabeta * self.covs['stretch_colour']
 
             delta = self.pre_vars + alphasq * self.stretch_var + \
                     + betasq * self.colour_var + 2.0 * alpha * self.cov_mag_stretch \
@@ -220,11 +284,65 @@ class SN_likelihood(object):
                     - 2.0 * alphabeta * self.cov_stretch_colour
         else:
             delta = self.pre_vars
-        np.fill_diagonal(invcovmat, invcovmat.diagonal() + delta)
-        self.invcov = np.linalg.inv(invcovmat)
-        return self.invcov
+        np.fill_diagonal(covmat, covmat.diagonal() + delta)
+        return covmat
 
-    def alpha_beta_like(self, lumdists, alpha=0, beta=0, invcovmat=None):
+    def inverse_covariance_matrix(self, alpha=0, beta=0):
+        """
+        Get the inverse covariance for given alpha, beta. The likelihood itself only uses Cholesky factors, but this
+        is kept for scripts using the inverse directly (e.g. for plotting binned data).
+
+        :param alpha: alpha value
+        :param beta: beta value
+        :return: inverse covariance matrix (the last one calculated is kept)
+        """
+        key = (float(alpha), float(beta)) if self.alphabeta_covmat else None
+        if self._invcov is None or self._invcov[0] != key:
+            chol = self.covariance_factor(alpha, beta)[0]
+            self._invcov = (key, cho_solve((chol, True), np.eye(self.nsn)))
+        return self._invcov[1]
+
+    @property
+    def invcov(self):
+        # last inverse covariance calculated (or the fixed one if independent of alpha, beta), as older versions
+        if self._invcov is None: self.inverse_covariance_matrix()
+        return self._invcov[1]
+
+    def _templates(self):
+        # offset templates for the scriptm parameters marginalized over
+        if self.twoscriptmfit:
+            return np.array([self.A1, self.A2]).T
+        else:
+            return np.ones((self.nsn, 1))
+
+    def _make_factor(self, chol):
+        # Cholesky factor, and the quantities needed for the analytic marginalization over scriptm that
+        # do not depend on the distances: C^{-1} times the offset templates, and their inner products
+        templates = self._templates()
+        weights = cho_solve((chol, True), templates)
+        return chol, weights, templates.T.dot(weights)
+
+    def covariance_factor(self, alpha=0, beta=0):
+        """
+        Get the (cached) Cholesky factorization of the covariance for given alpha, beta
+
+        :param alpha: alpha value
+        :param beta: beta value
+        :return: tuple of lower-triangular Cholesky factor, C^{-1} times offset template vectors, and matrix of
+                 template inner products
+        """
+        key = (float(alpha), float(beta)) if self.alphabeta_covmat else None
+        factor = self._factors.pop(key, None)
+        if factor is None:
+            factor = self._make_factor(np.linalg.cholesky(self.covariance_matrix(alpha, beta)))
+            while len(self._factors) >= max(1, self.factor_cache_size):
+                self._factors.popitem(last=False)
+        self._factors[key] = factor
+        return factor
+
+    def _diffmag(self, lumdists, alpha=0, beta=0):
+        # magnitude residuals with the estimated offset scriptm subtracted; alpha and beta can be arrays of
+        # shape (n, 1) to get the residuals for n grid points at once
         if self.alphabeta_covmat:
             alphasq = alpha * alpha
             betasq = beta * beta
@@ -234,44 +352,113 @@ class SN_likelihood(object):
                              + 2.0 * alpha * self.cov_mag_stretch
                              - 2.0 * beta * self.cov_mag_colour
                              - 2.0 * alphabeta * self.cov_stretch_colour)
-            wtval = np.sum(invvars)
-            estimated_scriptm = np.sum((self.mag - lumdists) * invvars) / wtval
-            diffmag = self.mag - lumdists + alpha * self.stretch \
-                      - beta * self.colour - estimated_scriptm
-            if invcovmat is None:
-                invcovmat = self.inverse_covariance_matrix(alpha, beta)
+            wtval = np.sum(invvars, axis=-1, keepdims=True)
+            estimated_scriptm = np.sum((self.mag - lumdists) * invvars, axis=-1, keepdims=True) / wtval
+            return self.mag - lumdists + alpha * self.stretch \
+                   - beta * self.colour - estimated_scriptm
         else:
             invvars = 1.0 / self.pre_vars
             wtval = np.sum(invvars)
             estimated_scriptm = np.sum((self.mag - lumdists) * invvars) / wtval
-            diffmag = self.mag - lumdists - estimated_scriptm
-            invcovmat = self.invcov
+            return self.mag - lumdists - estimated_scriptm
 
-        invvars = invcovmat.dot(diffmag)
-        amarg_A = invvars.dot(diffmag)
+    def _marginalized_chi2(self, amarg_A, amarg, products):
+        # chi2/2 analytically marginalized over scriptm, from d^T C^{-1} d, the offset templates times C^{-1} d
+        # and the template inner products (leading dimensions for multiple grid points)
+        amarg_B = amarg[..., 0]
+        amarg_E = products[..., 0, 0]
         if self.twoscriptmfit:
-            # could simplify this..
-            amarg_B = invvars.dot(self.A1)
-            amarg_C = invvars.dot(self.A2)
-            invvars = invcovmat.dot(self.A1)
-            amarg_D = invvars.dot(self.A2)
-            amarg_E = invvars.dot(self.A1)
-            invvars = invcovmat.dot(self.A2)
-            amarg_F = invvars.dot(self.A2)
-
+            amarg_C = amarg[..., 1]
+            amarg_D = products[..., 0, 1]
+            amarg_F = products[..., 1, 1]
             tempG = amarg_F - amarg_D * amarg_D / amarg_E
-            assert tempG >= 0
+            assert np.all(tempG >= 0)
             chi2 = amarg_A + np.log(amarg_E / _twopi) + \
                    np.log(tempG / _twopi) - amarg_C * amarg_C / tempG - \
                    amarg_B * amarg_B * amarg_F / (amarg_E * tempG) + 2.0 * amarg_B * amarg_C * amarg_D / (
                            amarg_E * tempG)
-
         else:
-            amarg_B = np.sum(invvars)
-            amarg_E = np.sum(invcovmat)
             chi2 = amarg_A + np.log(amarg_E / _twopi) - amarg_B ** 2 / amarg_E
         return chi2 / 2
 
+    def alpha_beta_like(self, lumdists, alpha=0, beta=0, invcovmat=None):
+        """
+        Get -log(likelihood) for given alpha, beta, analytically marginalized over scriptm
+
+        :param lumdists: array of 5*log10(luminosity distance) for each supernova
+        :param alpha: alpha value
+        :param beta: beta value
+        :param invcovmat: optional inverse covariance matrix to use (otherwise uses the cached Cholesky
+                          factorization of the covariance for alpha, beta)
+        :return: -log(likelihood)
+        """
+        diffmag = self._diffmag(lumdists, alpha, beta)
+        if invcovmat is not None:
+            templates = self._templates()
+            weights = invcovmat.dot(templates)
+            return self._marginalized_chi2(invcovmat.dot(diffmag).dot(diffmag), diffmag.dot(weights),
+                                           templates.T.dot(weights))
+        # only one triangular solve needed when the factorization is cached
+        chol, weights, products = self.covariance_factor(alpha, beta)
+        invvars = solve_triangular(chol, diffmag, lower=True, check_finite=False)
+        amarg_A = invvars.dot(invvars)
+        return self._marginalized_chi2(amarg_A, diffmag.dot(weights), products)
+
+    def _map_blocks(self, func, indices):
+        # apply func to blocks of grid point indices, using a pool of threads if requested (most of the work is in
+        # LAPACK/BLAS calls, which release the GIL)
+        blocks = [indices[i:i + self.marge_block_size] for i in range(0, len(indices), self.marge_block_size)]
+        if self.marge_threads > 1 and len(blocks) > 1:
+            pool = ThreadPool(min(self.marge_threads, len(blocks)))
+            try:
+                results = pool.map(func, blocks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+            return results
+        return [func(block) for block in blocks]
+
+    def _marge_block(self, lumdists, indices):
+        # chi2/2 at a block of grid points, as a batched product with stored inverse factors if available,
+        # otherwise factorizing each covariance on the fly
+        diffmag = np.broadcast_to(self._diffmag(lumdists, self.alpha_grid[indices, np.newaxis],
+                                                self.beta_grid[indices, np.newaxis]), (len(indices), self.nsn))
+        if self.marge_factors is not None:
+            # the inverse factors are lower triangular, so a triangular product only reads half of each stored
+            # matrix (passed transposed, so that BLAS can use the C-ordered array without a copy)
+            inv_chols = self.marge_factors['inv_chols']
+            trmv = get_blas_funcs('trmv', (inv_chols,))
+            invvars = np.empty(diffmag.shape)
+            for j, i in enumerate(indices):
+                invvars[j] = trmv(inv_chols[i].T, diffmag[j].astype(inv_chols.dtype), lower=0, trans=1)
+            weights = self.marge_factors['weights'][indices]
+            products = self.marge_factors['products'][indices]
+        else:
+            invvars = np.empty(diffmag.shape)
+            weights = np.empty((len(indices), self.nsn, self.n_templates))
+            products = np.empty((len(indices), self.n_templates, self.n_templates))
+            for j, i in enumerate(indices):
+                chol, weights[j], products[j] = self._make_factor(
+                    np.linalg.cholesky(self.covariance_matrix(self.alpha_grid[i], self.beta_grid[i])))
+                invvars[j] = solve_triangular(chol, diffmag[j], lower=True, check_finite=False)
+        return self._marginalized_chi2(np.einsum('ij,ij->i', invvars, invvars),
+                                       np.einsum('ij,ijk->ik', diffmag, weights), products)
+
+    def marge_grid_like(self, lumdists, indices=None):
+        """
+        Get -log(likelihood) at points of the alpha, beta marginalization grid
+
+        :param lumdists: model distance moduli
+        :param indices: indices of the grid points to evaluate (default all)
+        :return: array of -log(likelihood) for each point
+        """
+        if indices is None: indices = np.arange(self.int_points)
+        if not len(indices): return np.empty(0)
+        return np.concatenate(self._map_blocks(lambda block: self._marge_block(lumdists, block), indices))
+
     def get_redshifts(self):
         return self.zcmb
 
@@ -280,10 +467,21 @@ class SN_likelihood(object):
 
         lumdists = 5 * np.log10((1 + self.zhel) * (1 + self.zcmb) * angular_diameter_distances)
         if self.marginalize:
-            # Should parallelize this loop
-            for i in range(self.int_points):
-                self.marge_grid[i] = self.alpha_beta_like(lumdists, self.alpha_grid[i], self.beta_grid[i],
-                                                          invcovmat=self.invcovs[i])
+            if self.marge_refine_tol:
+                # start with every other grid point, then evaluate neighbours of any points where the likelihood is
+                # non-negligible until there are no more
+                self.marge_grid[:] = np.inf
+                todo = np.flatnonzero(np.all(self.grid_index % 2 == 0, axis=1))
+                done = np.zeros(self.int_points, dtype=bool)
+                while len(todo):
+                    self.marge_grid[todo] = self.marge_grid_like(lumdists, todo)
+                    done[todo] = True
+                    significant = self.grid_index[self.marge_grid < np.min(self.marge_grid) - np.log(
+                        self.marge_refine_tol)]
+                    near = np.any(np.all(np.abs(self.grid_index[:, np.newaxis, :] - significant) <= 1, axis=2), axis=1)
+                    todo = np.flatnonzero(near & ~done)
+            else:
+                self.marge_grid[:] = self.marge_grid_like(lumdists)
             grid_best = np.min(self.marge_grid)
             return grid_best - np.log(np.sum(np.exp(-self.marge_grid[self.marge_grid != np.inf]
                                                     + grid_best)) * self.step_width_alpha * self.step_width_beta)
@@ -324,7 +522,7 @@ if __name__ == "__main__":
     print('')
 
     # JLA marginalized over alpha, beta, e.g. for use in importance sampling with no nuisance parameters.
-    # Quite fast as inverses precomputed. Note normalization is not same as for alpha, beta varying.
+    # Quite fast as inverse Cholesky factors precomputed. Note normalization is not same as for alpha, beta varying.
     like = SN_likelihood(r'C:\Work\Dist\git\cosmomcplanck\data\jla.dataset', marginalize=True)
     zs = like.get_redshifts()
     start = time.time()
@@ -333,8 +531,10 @@ if __name__ == "__main__":
     print('JLA marged chi^2: %.2f, expected 720.00' % chi2)
     assert np.isclose(chi2, 720.0035394)
 
-    # as above, but very slow (but lower memory) using non-precomputed inverses (and non-threaded in python)
-    like = SN_likelihood(r'C:\Work\Dist\git\cosmomcplanck\data\jla.dataset', precompute_covmats=False, marginalize=True)
+    # as above, but slower (and lower memory) factorizing on the fly, using threads and only refining the grid where
+    # the likelihood is non-negligible
+    like = SN_likelihood(r'C:\Work\Dist\git\cosmomcplanck\data\jla.dataset', precompute_covmats=False, marginalize=True,
+                         marginalize_params={'threads': 4, 'refine_tol': 1e-8})
     zs = like.get_redshifts()
     start = time.time()
     chi2 = like.loglike(fit(zs)) * 2
@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+"""
+Binary cache of preprocessed likelihood data (e.g. used covariance blocks, their inverses and bin windows),
+so that large text files are only parsed once. Each cached entry is a directory of .npy files named by a hash of
+the input file contents and any settings, loaded with memory mapping so that many processes using the same
+data share the pages.
+"""
+
+# increment if the stored data changes incompatibly
+cache_version = 1
+
+# directory for cache files (entries are named by content hashes, so data from different places can share it)
+cache_dir = os.environ.get('LIKELIHOOD_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'cosmomc_likelihoods')
+
+_file_hashes = dict()
+
+
+def file_hash(fname):
+    """
+    :param fname: file name
+    :return: md5 hash of the file contents (cached while the file size and modification time are unchanged)
+    """
+    stat = os.stat(fname)
+    state = (stat.st_size, stat.st_mtime)
+    cached = _file_hashes.get(fname)
+    if cached is None or cached[0] != state:
+        md5 = hashlib.md5()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        cached = (state, md5.hexdigest())
+        _file_hashes[fname] = cached
+    return cached[1]
+
+
+def cache_key(files, settings=None):
+    """
+    :param files: list of input file names
+    :param settings: any other (repr-able) values the cached data depends on
+    :return: hash string identifying the inputs
+    """
+    md5 = hashlib.md5(repr((cache_version, settings)).encode('utf-8'))
+    for fname in files:
+        md5.update(file_hash(fname).encode('ascii'))
+    return md5.hexdigest()
+
+
+def cached_arrays(name, files, settings, compute, directory=None, mmap=True):
+    """
+    Get arrays from the cache if available, otherwise compute and store them
+
+    :param name: name for the cache entry (e.g. dataset name and data type)
+    :param files: list of input files the arrays are calculated from
+    :param settings: other values that the arrays depend on
+    :param compute: function returning dictionary of name: numpy array, called if not cached
+    :param directory: cache directory (default cache_dir: $LIKELIHOOD_CACHE_DIR if set, otherwise
+                      cosmomc_likelihoods in the user cache directory, e.g. ~/.cache)
+    :param mmap: load arrays with read-only memory mapping (otherwise in memory)
+    :return: dictionary of name: array
+    """
+    directory = directory or cache_dir
+    entry = os.path.join(directory, '%s_%s' % (name, cache_key(files, settings)))
+    if os.path.isdir(entry):
+        try:
+            return dict((os.path.splitext(f)[0], np.load(os.path.join(entry, f), mmap_mode='r' if mmap else None))
+                        for f in os.listdir(entry) if f.endswith('.npy'))
+        except (IOError, OSError, ValueError):
+            pass
+    arrays = compute()
+    try:
+        if not os.path.exists(directory): os.makedirs(directory)
+        tmp = tempfile.mkdtemp(dir=directory)
+        try:
+            for key, value in arrays.items():
+                np.save(os.path.join(tmp, key + '.npy'), value)
+            os.rename(tmp, entry)
+        except (IOError, OSError):
+            # e.g. another process already wrote it
+            shutil.rmtree(tmp, ignore_errors=True)
+    except (IOError, OSError):
+        # not writable, just use the calculated values
+        pass
+    return arrays
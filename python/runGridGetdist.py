@@ -5,16 +5,17 @@ import subprocess
 import getdist
 from getdist import IniFile
 import time
-from paramgrid import batchjob_args
+from paramgrid import batchjob_args, plotpipeline
 
 
 def checkDir(fname):
     if not os.path.exists(fname): os.makedirs(fname)
 
 
-Opts = batchjob_args.batchArgs('Run getdist over the grid of models', notExist=True)
+Opts = batchjob_args.batchArgs('Run getdist over the grid of models', notExist=True, statusSnapshot=True)
 Opts.parser.add_argument('--update_only', action='store_true')
-Opts.parser.add_argument('--make_plots', action='store_true', help='run generated script plot files to make PDFs')
+Opts.parser.add_argument('--make_plots', action='store_true',
+                         help='run generated script plot files to make PDFs (in parallel using --procs processes)')
 Opts.parser.add_argument('--norun', action='store_true')
 Opts.parser.add_argument('--plot_data', default=None,
                          help="directory to store the plot_data in for each chain. Default None to generate on the fly.")
@@ -31,6 +32,8 @@ Opts.parser.add_argument('--command', default='python', help="program to run")
 Opts.parser.add_argument('--command_params', nargs='*',
                          default=['python/GetDist.py'], help="arguments program to run (excl. ini name)")
 Opts.parser.add_argument('--exist', action='store_true', help="Silently skip all chains that don't exist")
+Opts.parser.add_argument('--no_results_db', action='store_true',
+                         help="don't update the grid's database of parsed results used by makeTables.py etc.")
 
 (batch, args) = Opts.parseForBatch()
 
@@ -56,6 +59,7 @@ checkDir(ini_dir)
 
 if args.delay: time.sleep(args.delay)
 processes = set()
+plotItems = []
 
 for jobItem in Opts.filteredBatchItems():
     ini = IniFile()
@@ -88,7 +92,6 @@ for jobItem in Opts.filteredBatchItems():
         ini.params['compare_num'] = 1
         ini.params['compare1'] = jobItem.parent.chainRoot
     if args.no_plots: ini.params['no_plots'] = True
-    if args.make_plots: ini.params['make_plots'] = True
     fname = ini_dir + jobItem.name + tag + '.ini'
     ini.params.update(jobItem.dist_settings)
     ini.saveFile(fname)
@@ -96,9 +99,25 @@ for jobItem in Opts.filteredBatchItems():
                 not args.update_only or jobItem.getDistNeedsUpdate()):
         if jobItem.chainExists():
             print("running: " + fname)
+            plotItems.append(jobItem)
             processes.add(subprocess.Popen([args.command] + args.command_params + [fname]))
             while len(processes) >= args.procs:
                 time.sleep(.1)
                 processes.difference_update([p for p in processes if p.poll() is not None])
         else:
             if not args.exist: print("Chains do not exist yet: " + jobItem.chainRoot)
+
+while processes:
+    time.sleep(.1)
+    processes.difference_update([p for p in processes if p.poll() is not None])
+
+if not args.no_results_db:
+    with batch.resultsDB() as db:
+        print('Updated %u results in %s' % (db.update(Opts.filteredBatchItems()), db.filename))
+
+if args.make_plots and not args.no_plots:
+    scripts = []
+    for jobItem in plotItems:
+        scripts += plotpipeline.distPlotScripts(jobItem, plot_ext)
+    print('Making plots from %u scripts...' % len(scripts))
+    plotpipeline.runScripts(scripts, procs=args.procs)
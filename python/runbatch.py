@@ -63,6 +63,8 @@ isMinimize = args.importance_minimize or args.minimize
 
 if args.combineOneJobName:
     print('Combining multiple (hopefully fast) into single job script: ' + args.combineOneJobName)
+elif args.job_array:
+    print('Submitting as a single job array, %u run(s) per array task' % args.runsPerJob)
 
 iniFiles = []
 
@@ -74,7 +76,7 @@ def jobName():
     if len(iniFiles) < 2 or len(s) < 70: return s
     base = os.path.basename(iniFiles[0])
     if len(base) > 70: base = base[:70]
-    return base + '__' + hashlib.md5(s).hexdigest()[:16]
+    return base + '__' + hashlib.md5(s.encode('utf-8')).hexdigest()[:16]
 
 
 def submitJob(ini):
@@ -85,7 +87,7 @@ def submitJob(ini):
     else:
         print('... ' + ini)
     iniFiles.append(ini)
-    if args.combineOneJobName: return
+    if args.combineOneJobName or args.job_array: return
     if len(iniFiles) >= args.runsPerJob:
         if args.runsPerJob > 1: print('--> jobName: ', jobName())
         jobqueue.submitJob(jobName(), iniFiles, **args.__dict__)
@@ -121,6 +123,6 @@ for jobItem in Opts.filteredBatchItems(wantSubItems=args.subitems):
                                 submitJob(jobItem.iniFile(variant))
 
 if len(iniFiles) > 0:
-    if args.runsPerJob > 1: print('--> jobName: ', jobName())
+    if args.runsPerJob > 1 or args.job_array: print('--> jobName: ', jobName())
     jobqueue.submitJob(args.combineOneJobName or jobName(), iniFiles, sequential=args.combineOneJobName is not None,
                        **args.__dict__)